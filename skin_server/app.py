@@ -1,34 +1,214 @@
 # app.py
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
+from werkzeug.utils import secure_filename
+from concurrent.futures import ThreadPoolExecutor
+import io
 import os
 import json
+import time
+import uuid
+import zipfile
+import zlib
+
+# ✅ Prometheus 指標（/metrics）
+import metrics
 
 # ✅ 你的 ConvNeXt 病灶模型推論
-from lesion_model import predict_lesion
+from lesion_model import predict_lesion, predict_lesion_batch, get_batcher_stats, resolve_tta
+
+# ✅ RAG 檢索快取（每個分類標籤的查詢結果）
+from rag_milvus import get_search_cache_stats, search_knowledge
+
+# ✅ 模型註冊表：分類器 / BGE-m3 / Milvus 背景平行載入
+from model_registry import registry
 
 # ✅ ConvNeXt + RAG + LLM 的整合流程
-from combined_inference import predict_combined
+from combined_inference import predict_combined, predict_combined_stream, result_cache, llm_admission
+from llm_admission import QueueFullError, PRIORITY_REPORT, PRIORITY_CHAT
+
+# ✅ 非同步報告工作（/jobs）
+from report_jobs import job_manager
 
 app = Flask(__name__)
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# 上傳的圖直接在記憶體裡解碼；要留存原圖再設 SAVE_UPLOADS=1（背景寫檔，不擋 request）
+SAVE_UPLOADS = os.environ.get("SAVE_UPLOADS", "0") == "1"
+
+# 批次端點：一次最多幾張；zip 裡單張 / 全部解壓後最多多大（擋 zip bomb）
+MAX_BATCH_IMAGES = int(os.environ.get("MAX_BATCH_IMAGES", "32"))
+MAX_ZIP_MEMBER_BYTES = int(os.environ.get("MAX_ZIP_MEMBER_BYTES", str(20 * 1024 * 1024)))
+MAX_ZIP_TOTAL_BYTES = int(os.environ.get("MAX_ZIP_TOTAL_BYTES", str(200 * 1024 * 1024)))
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+_upload_saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload-saver")
+
+
+def _reset_upload_saver():
+    # serve.py fork 出來的 worker 不會繼承 master 的 thread，thread pool 要重開一個
+    global _upload_saver
+    _upload_saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload-saver")
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_upload_saver)
+
 print("🚀 Flask 伺服器啟動中（單一 ConvNeXt + RAG + LLM）...")
 
+# 模型在背景平行載入 + 暖機（完成後再預熱每個分類標籤的 RAG 結果），不擋 port 綁定
+# serve.py（prefork）會先在 master 預載權重，fork 之後才在各 worker 裡 start
+if os.environ.get("SKIN_PREFORK") != "1":
+    registry.start(background=True)
+
 
 # ==============================================================
-# 1. /predict_combined —— Flutter 主要用的 API
+# 指標：每個 request 的 route / 狀態碼 / 耗時 / 進行中數量
+#   在 response 關閉時才結算，串流 route 的耗時會算到最後一個 byte
 # ==============================================================
-@app.route("/predict_combined", methods=["POST"])
-def predict_combined_api():
-    # 一定要有 image
-    if "image" not in request.files:
-        return jsonify({"error": "未上傳圖片"}), 400
+def _route_label() -> str:
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
 
-    image = request.files["image"]
-    img_path = os.path.join(UPLOAD_FOLDER, image.filename)
-    image.save(img_path)
 
+def _metrics_done(t0: float, route: str, method: str, status: int):
+    metrics.http_in_flight.dec(route=route)
+    metrics.http_latency.observe(time.perf_counter() - t0, route=route)
+    metrics.http_requests.inc(route=route, method=method, status=str(status))
+
+
+@app.before_request
+def _metrics_start():
+    g.metrics_t0 = time.perf_counter()
+    g.metrics_route = _route_label()
+    metrics.http_in_flight.inc(route=g.metrics_route)
+
+
+@app.after_request
+def _metrics_status(response):
+    t0 = g.pop("metrics_t0", None)
+    if t0 is not None:
+        args = (t0, g.pop("metrics_route"), request.method, response.status_code)
+        response.call_on_close(lambda: _metrics_done(*args))
+    return response
+
+
+@app.teardown_request
+def _metrics_finish(exc):
+    # after_request 沒跑到（例如它自己出錯）才會走到這裡
+    t0 = g.pop("metrics_t0", None)
+    if t0 is not None:
+        _metrics_done(t0, g.pop("metrics_route", "unmatched"), request.method, 500)
+
+
+# 已經有 stats() 的元件：被抓取時才取值
+metrics.CallbackGauge("skin_ready", "模型都載好、暖機完成為 1", lambda: 1.0 if registry.is_ready() else 0.0)
+metrics.CallbackGauge("skin_llm_active", "正在呼叫 LLM 的請求數", lambda: llm_admission.stats()["active"])
+metrics.CallbackGauge("skin_llm_queue_depth", "排隊等 LLM 的請求數", lambda: llm_admission.stats()["queue_depth"])
+metrics.CallbackGauge(
+    "skin_llm_admission", "LLM 准入累計次數（admitted / rejected / evicted / timed_out）",
+    lambda: {k: llm_admission.stats()[k] for k in ("admitted", "rejected", "evicted", "timed_out")},
+    ["result"],
+)
+metrics.CallbackGauge("skin_lesion_batch_queue_depth", "等 ConvNeXt micro-batch 的影像數",
+                      lambda: get_batcher_stats()["queue_depth"])
+metrics.CallbackGauge("skin_lesion_avg_batch_size", "ConvNeXt 平均 batch 大小",
+                      lambda: get_batcher_stats()["avg_batch_size"])
+metrics.CallbackGauge(
+    "skin_result_cache", "結果快取累計次數", lambda: {
+        k: v for k, v in result_cache.stats().items() if k in ("hits_memory", "hits_disk", "misses", "evictions")
+    }, ["result"])
+metrics.CallbackGauge("skin_report_jobs_pending", "排隊 + 執行中的非同步報告工作數",
+                      lambda: job_manager.stats()["pending"])
+metrics.CallbackGauge(
+    "skin_rag_cache", "RAG 檢索快取累計次數",
+    lambda: {k: get_search_cache_stats()[k] for k in ("hits", "misses")}, ["result"])
+
+
+def _write_upload(data: bytes, filename: str):
+    # 檔名前面加 uuid，兩個 client 同時上傳 image.jpg 也不會互蓋
+    name = f"{uuid.uuid4().hex}_{secure_filename(filename) or 'upload.jpg'}"
+    try:
+        with open(os.path.join(UPLOAD_FOLDER, name), "wb") as f:
+            f.write(data)
+    except Exception as e:
+        print("⚠️ 上傳圖片存檔失敗：", e)
+
+
+def read_upload(file_storage) -> bytes:
+    """直接從 request stream 讀出整張圖，必要時丟到背景存檔"""
+    data = file_storage.stream.read()
+    if SAVE_UPLOADS and data:
+        _upload_saver.submit(_write_upload, data, file_storage.filename or "")
+    return data
+
+
+class BatchUploadError(ValueError):
+    """批次上傳的內容不合法（張數太多、zip 壞掉或太大），回 400"""
+
+
+def _read_zip(data: bytes, archive_name: str):
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise BatchUploadError(f"{archive_name} 不是有效的 zip 檔")
+
+    items, total = [], 0
+    with zf:
+        for info in zf.infolist():
+            base = os.path.basename(info.filename)
+            if info.is_dir() or base.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+            if not base.lower().endswith(IMAGE_EXTS):
+                continue
+            if len(items) >= MAX_BATCH_IMAGES:
+                raise BatchUploadError(f"一次最多 {MAX_BATCH_IMAGES} 張")
+            # file_size 是 zip 自己宣稱的大小，可以造假；實際讀的量也要擋
+            try:
+                with zf.open(info) as f:
+                    content = f.read(MAX_ZIP_MEMBER_BYTES + 1)
+            except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError) as e:
+                # CRC / 大小對不上、壓縮法不支援、有加密：都是上傳的檔案有問題，不是伺服器錯誤
+                raise BatchUploadError(f"{info.filename} 讀取失敗：{e}")
+            if len(content) > MAX_ZIP_MEMBER_BYTES:
+                raise BatchUploadError(f"{info.filename} 超過 {MAX_ZIP_MEMBER_BYTES} bytes")
+            total += len(content)
+            if total > MAX_ZIP_TOTAL_BYTES:
+                raise BatchUploadError(f"{archive_name} 解壓後超過 {MAX_ZIP_TOTAL_BYTES} bytes")
+            items.append((info.filename, content))
+    return items
+
+
+def read_batch_uploads():
+    """
+    批次端點的上傳：欄位名稱不拘（image / images / files…，同一個欄位可以放多張），
+    .zip 會自動展開裡面的圖片。回傳 [(檔名, bytes), ...]，順序同上傳順序
+    """
+    items = []
+    for field in request.files:
+        for fs in request.files.getlist(field):
+            data = read_upload(fs)
+            if not data:
+                continue
+            name = fs.filename or field
+            if data[:4] == b"PK\x03\x04" or name.lower().endswith(".zip"):
+                items += _read_zip(data, name)
+            else:
+                items.append((name, data))
+            if len(items) > MAX_BATCH_IMAGES:
+                raise BatchUploadError(f"一次最多 {MAX_BATCH_IMAGES} 張")
+    return items
+
+
+def _flag(name: str) -> bool:
+    value = request.form.get(name) or request.args.get(name) or ""
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def parse_tta() -> str:
+    """tta 欄位（form 或 query）：off / auto / always（1 / 0 也可以），沒帶用 LESION_TTA；不合法丟 ValueError"""
+    return resolve_tta(request.form.get("tta") or request.args.get("tta"))
+
+
+def parse_survey() -> dict:
     # 問卷目前先不太用，但保留欄位
     survey_raw = request.form.get("survey", "")
     survey = {}
@@ -37,26 +217,179 @@ def predict_combined_api():
             survey = json.loads(survey_raw)
         except Exception as e:
             print("⚠️ survey JSON 解析失敗：", e)
+    return survey
+
+
+def too_busy(e: QueueFullError):
+    """LLM 佇列滿了：429 + Retry-After，順便告訴 client 大概要等多久"""
+    resp = jsonify({
+        "error": "伺服器忙碌中，請稍後再試",
+        "detail": str(e),
+        "retry_after": e.retry_after,
+        "estimated_wait": e.estimated_wait,
+        "queue_depth": e.queue_depth,
+    })
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp
+
+
+def ndjson_response(events):
+    """把事件 generator 轉成一行一個 JSON 的串流回應（chunked）"""
+    def generate():
+        try:
+            for event in events:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except QueueFullError as e:
+            yield json.dumps({
+                "type": "error",
+                "message": str(e),
+                "retry_after": e.retry_after,
+                "estimated_wait": e.estimated_wait,
+            }, ensure_ascii=False) + "\n"
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield json.dumps({"type": "error", "message": str(e)}, ensure_ascii=False) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",   # 前面有 nginx 的話不要幫忙 buffer
+        },
+    )
+
+
+# ==============================================================
+# 1. /predict_combined —— Flutter 主要用的 API
+# ==============================================================
+@app.route("/predict_combined", methods=["POST"])
+def predict_combined_api():
+    # 一定要有 image
+    if "image" not in request.files:
+        return jsonify({"error": "未上傳圖片"}), 400
+
+    image = request.files["image"]
+    image_bytes = read_upload(image)
+    if not image_bytes:
+        return jsonify({"error": "圖片內容為空"}), 400
+
+    survey = parse_survey()
+    try:
+        tta = parse_tta()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
         # ⭐ 核心：呼叫你寫好的 combined_inference
-        result = predict_combined(img_path, survey)
+        result = predict_combined(image_bytes, survey, tta)
 
-        # Flutter 只吃這兩個
+        # Flutter 只吃 top1 / report；timings / prompt_tokens 給壓測看各階段耗時、prompt 大小
         top1 = result.get("final_top1") or "無資料"
         report = result.get("final_text") or "（無 LLM 回覆）"
 
         return jsonify({
             "top1": top1,
             "report": report,
+            "timings": result.get("timings", {}),
+            "prompt_tokens": result.get("prompt_tokens"),
         }), 200
 
+    except QueueFullError as e:
+        return too_busy(e)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
 
+# ==============================================================
+# 1b. /predict_combined_stream —— 分類結果先回，報告邊生邊送
+#     回應為 application/x-ndjson，事件格式見 predict_combined_stream
+# ==============================================================
+@app.route("/predict_combined_stream", methods=["POST"])
+def predict_combined_stream_api():
+    if "image" not in request.files:
+        return jsonify({"error": "未上傳圖片"}), 400
+
+    image_bytes = read_upload(request.files["image"])
+    if not image_bytes:
+        return jsonify({"error": "圖片內容為空"}), 400
+
+    survey = parse_survey()
+    try:
+        tta = parse_tta()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        llm_admission.check(PRIORITY_REPORT)
+    except QueueFullError as e:
+        return too_busy(e)
+    return ndjson_response(predict_combined_stream(image_bytes, survey, tta))
+
+
+# ==============================================================
+# 1c. /jobs —— 非同步報告：POST 分類完就回 job id，GET long-poll 拿進度 / 報告
+#     POST /jobs（同 /predict_combined 的欄位）→ 202 新建 / 200 接到同一張圖既有的工作
+#     GET /jobs/<id>?since=<version>&wait=<秒>&offset=<字數>&think_offset=<字數>
+#       version 比 since 新、工作結束或等滿 wait 秒才回；offset / think_offset 之後的 text / think 才回
+#       （已經拿過的不重送，R1 的思考過程很長，每次重送整段流量會隨長度平方成長）
+# ==============================================================
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    if "image" not in request.files:
+        return jsonify({"error": "未上傳圖片"}), 400
+
+    image_bytes = read_upload(request.files["image"])
+    if not image_bytes:
+        return jsonify({"error": "圖片內容為空"}), 400
+
+    survey = parse_survey()
+    try:
+        tta = parse_tta()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        job, created = job_manager.submit(image_bytes, survey, tta)
+    except QueueFullError as e:
+        return too_busy(e)
+
+    if job["status"] == "error" and not job["top1"]:
+        return jsonify(job), 500
+    resp = jsonify(job)
+    resp.status_code = 202 if created else 200
+    resp.headers["Location"] = f"/jobs/{job['id']}"
+    return resp
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    try:
+        since = int(request.args.get("since", "-1"))
+        wait = float(request.args.get("wait", "0"))
+        offset = max(0, int(request.args.get("offset", "0")))
+        think_offset = max(0, int(request.args.get("think_offset", "0")))
+    except ValueError:
+        return jsonify({"error": "since / wait / offset / think_offset 要是數字"}), 400
+
+    job = job_manager.get(job_id, since=since, wait=wait)
+    if job is None:
+        return jsonify({"error": "找不到這個工作（可能已過期）"}), 404
+    job["text_length"] = len(job["text"])
+    job["text"] = job["text"][offset:]
+    job["think_length"] = len(job["think"])
+    job["think"] = job["think"][think_offset:]
+    return jsonify(job), 200
+
+
+@app.route("/jobs", methods=["GET"])
+def job_stats():
+    return jsonify(job_manager.stats()), 200
+
+
 # ==============================================================
 # 2. /analyze —— Debug 用，只回 ConvNeXt 模型原始結果
 # ==============================================================
@@ -66,12 +399,18 @@ def analyze():
         return jsonify({"error": "未上傳圖片"}), 400
 
     img = request.files["image"]
-    img_path = os.path.join(UPLOAD_FOLDER, img.filename)
     image_name = img.filename
-    img.save(img_path)
+    image_bytes = read_upload(img)
+    if not image_bytes:
+        return jsonify({"error": "圖片內容為空"}), 400
+
+    try:
+        tta = parse_tta()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        lesion_result = predict_lesion(img_path)
+        lesion_result = predict_lesion(image_bytes, tta=tta)
         return jsonify({
             "image": image_name,
             "lesion_raw": lesion_result,
@@ -83,11 +422,86 @@ def analyze():
         return jsonify({"error": str(e)}), 500
 
 
+# ==============================================================
+# 2b. /predict_batch —— 多張圖一次分類（多個檔案欄位或一個 zip）
+#     平行解碼 → 依 micro-batch 上限切塊 forward；rag=1 時同一個標籤只查一次 RAG
+#     回傳 {"count", "results": [{image, top1, top3} | {image, error}], "rag": {標籤: [...]}, "timings"}
+# ==============================================================
+def _batch_predict():
+    """兩個批次端點共用：回傳 (uploads, preds, timings) 或直接回錯誤 response"""
+    try:
+        uploads = read_batch_uploads()
+        tta = parse_tta()
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
+    if not uploads:
+        return None, (jsonify({"error": "未上傳圖片"}), 400)
+
+    t0 = time.perf_counter()
+    preds = predict_lesion_batch([data for _, data in uploads], tta=tta)
+    classify_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+    print(f"🖼 批次分類：{len(uploads)} 張，{classify_ms} ms")
+    return (uploads, preds, {"classify": classify_ms}), None
+
+
+@app.route("/predict_batch", methods=["POST"])
+def predict_batch():
+    try:
+        batch, error = _batch_predict()
+        if error is not None:
+            return error
+        uploads, preds, timings = batch
+
+        results = [{"image": name, **pred} for (name, _), pred in zip(uploads, preds)]
+        body = {"count": len(results), "results": results}
+
+        if _flag("rag"):
+            t0 = time.perf_counter()
+            rag = {}
+            for label in dict.fromkeys(p["top1"]["label"] for p in preds if "top1" in p):
+                try:
+                    rag[label] = search_knowledge(label, top_k=5)
+                except Exception as e:
+                    print(f"⚠️ 批次 RAG 查詢失敗（{label}）：", e)
+                    rag[label] = []
+            body["rag"] = rag
+            timings["rag"] = round((time.perf_counter() - t0) * 1000.0, 1)
+
+        body["timings"] = timings
+        return jsonify(body), 200
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+# ==============================================================
+# 2c. /analyze_batch —— /analyze 的多張版，只回 ConvNeXt 原始結果
+# ==============================================================
+@app.route("/analyze_batch", methods=["POST"])
+def analyze_batch():
+    try:
+        batch, error = _batch_predict()
+        if error is not None:
+            return error
+        uploads, preds, timings = batch
+        return jsonify({
+            "count": len(uploads),
+            "results": [{"image": name, "lesion_raw": pred} for (name, _), pred in zip(uploads, preds)],
+            "timings": timings,
+        }), 200
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
 
 # ==============================================================
 # 4. LLM 問答（Chat）API —— 不需要圖片、不需要模型
 # ==============================================================
-from combined_inference import ask_llm
+from combined_inference import ask_llm, ask_llm_stream
 
 @app.route("/ask_llm", methods=["POST"])
 def ask_llm_api():
@@ -105,16 +519,106 @@ def ask_llm_api():
 
         return jsonify({"answer": answer}), 200
 
+    except QueueFullError as e:
+        return too_busy(e)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+# ==============================================================
+# 4b. LLM 問答串流版 —— 一行一個 JSON：think / token / done
+# ==============================================================
+@app.route("/ask_llm_stream", methods=["POST"])
+def ask_llm_stream_api():
+    data = request.get_json(silent=True) or {}
+    prompt = (data.get("question") or "").strip()
+
+    if not prompt:
+        return jsonify({"error": "指令 不可為空"}), 400
+
+    print("🧠 LLM 問答請求（串流）：", prompt)
+
+    try:
+        llm_admission.check(PRIORITY_CHAT)
+    except QueueFullError as e:
+        return too_busy(e)
+
+    def events():
+        parts = []
+        for kind, text in ask_llm_stream(prompt):
+            if kind == "token":
+                parts.append(text)
+            yield {"type": kind, "text": text}
+        yield {"type": "done", "answer": "".join(parts) or "（LLM 無回覆）"}
+
+    return ndjson_response(events())
+
+
+# ==============================================================
+# 0. 健康檢查 —— /healthz：行程活著；/readyz：模型都載好、暖機完
+# ==============================================================
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"}), 200
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    status = registry.status()
+    return jsonify(status), (200 if status["ready"] else 503)
+
+
+# ==============================================================
+# 5. 微批次排程統計 —— 調 LESION_MAX_BATCH_SIZE / LESION_MAX_WAIT_MS 用
+# ==============================================================
+@app.route("/lesion_stats", methods=["GET"])
+def lesion_stats():
+    return jsonify(get_batcher_stats()), 200
+
+
+# ==============================================================
+# 6. /predict_combined 結果快取 —— 命中率 / 手動清空
+#    （換 best_model.pth 或重建 RAG 後，key 會自動變；要立刻釋放空間再清）
+# ==============================================================
+@app.route("/result_cache", methods=["GET"])
+def result_cache_stats():
+    return jsonify(result_cache.stats()), 200
+
+
+@app.route("/result_cache/clear", methods=["POST"])
+def result_cache_clear():
+    cleared = result_cache.invalidate_all()
+    return jsonify({"cleared": cleared}), 200
+
+
+@app.route("/rag_cache", methods=["GET"])
+def rag_cache_stats():
+    return jsonify(get_search_cache_stats()), 200
+
+
+# ==============================================================
+# 7. LLM 准入佇列狀態 —— 執行中 / 排隊 / 被拒絕次數
+# ==============================================================
+@app.route("/llm_queue", methods=["GET"])
+def llm_queue_stats():
+    return jsonify(llm_admission.stats()), 200
+
+
+# ==============================================================
+# 8. Prometheus 指標
+# ==============================================================
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
 # ==============================================================
 # 3. 入口 —— 一定要 host=0.0.0.0, threaded=True
+#    這是開發用（單一行程 + debug）；正式環境用 python serve.py --workers N（多行程共用模型權重）
 # ==============================================================
 if __name__ == "__main__":
-    # 一律用 python app.py 啟動，不要用 flask run
+    # 開發時用 python app.py 啟動，不要用 flask run
     app.run(
         host="0.0.0.0",
         port=5000,
@@ -0,0 +1,175 @@
+# bench_preprocess.py
+# fast_preprocess 跟原本 torchvision 前處理的速度 / 一致性比對
+#
+# 用法：
+#   python bench_preprocess.py --images D:\data\val1 --max-images 200
+#   python bench_preprocess.py --images a.jpg b.jpg --upscale 4032 --ckpt best_model.pth
+#
+#   --upscale：把圖放大成長邊 N px 的 JPEG 再測（手上沒有手機原圖時模擬 12 MP 照片）
+#   --ckpt：順便跑分類器，比 top-1 一致率跟最大機率差
+#
+# 比對基準是「torchvision transform + EXIF 轉正」：伺服器以前沒轉正，轉不轉是方向問題不是縮圖問題，分開算。
+# 圖片先全部讀進記憶體（伺服器拿到的也是 bytes），只量解碼 + 前處理。
+
+import argparse
+import io
+import json
+import os
+import time
+
+import torch
+from PIL import Image, ImageOps
+
+import fast_preprocess
+from export_lesion_model import list_images
+from lesion_backends import load_eager_model
+from lesion_model import transform
+
+CPU = torch.device("cpu")
+
+
+# -----------------------------
+# 1. 各種前處理
+# -----------------------------
+def tv_plain(data: bytes) -> torch.Tensor:
+    """伺服器原本的做法（= 訓練時的 transform_val）"""
+    return transform(Image.open(io.BytesIO(data)).convert("RGB"))
+
+
+def tv_exif(data: bytes) -> torch.Tensor:
+    return transform(ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert("RGB"))
+
+
+def fast_full(data: bytes) -> torch.Tensor:
+    """全解析度解碼，只用預先配置的 buffer（看 draft 本身的影響）"""
+    return fast_preprocess.to_tensor_into(fast_preprocess.load_resized(data, draft_factor=0),
+                                          torch.empty(3, 224, 224))
+
+
+def fast_draft(data: bytes) -> torch.Tensor:
+    return fast_preprocess.preprocess(data)
+
+
+PIPELINES = {
+    "torchvision": tv_plain,
+    "torchvision+exif": tv_exif,
+    "fast_no_draft": fast_full,
+    "fast": fast_draft,
+}
+REFERENCE = "torchvision+exif"
+
+
+# -----------------------------
+# 2. 讀圖（可以放大成手機照片的大小）
+# -----------------------------
+def load_inputs(paths, upscale: int):
+    out = []
+    for p in paths:
+        with open(p, "rb") as f:
+            data = f.read()
+        if upscale:
+            img = Image.open(io.BytesIO(data))
+            exif = img.info.get("exif", b"")
+            img = img.convert("RGB")
+            scale = upscale / max(img.size)
+            img = img.resize((round(img.width * scale), round(img.height * scale)), Image.BICUBIC)
+            buf = io.BytesIO()
+            img.save(buf, "JPEG", quality=92, exif=exif)
+            data = buf.getvalue()
+        out.append(data)
+    return out
+
+
+def orientation(data: bytes) -> int:
+    try:
+        return Image.open(io.BytesIO(data)).getexif().get(0x0112, 1)
+    except Exception:
+        return 1
+
+
+# -----------------------------
+# 3. 量測
+# -----------------------------
+def run(fn, inputs, repeat: int):
+    fn(inputs[0])  # 暖機
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        xs = [fn(d) for d in inputs]
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return torch.stack(xs), best
+
+
+@torch.inference_mode()
+def classify(model, x: torch.Tensor, batch_size: int = 16) -> torch.Tensor:
+    return torch.cat([torch.softmax(model(x[i:i + batch_size]), dim=1)
+                      for i in range(0, x.shape[0], batch_size)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比對 fast_preprocess 跟 torchvision 前處理")
+    parser.add_argument("--images", nargs="+", required=True, help="圖片檔或資料夾")
+    parser.add_argument("--max-images", type=int, default=200)
+    parser.add_argument("--upscale", type=int, default=0, help="放大成長邊 N px 的 JPEG 再測，0 = 原圖")
+    parser.add_argument("--repeat", type=int, default=3, help="每種跑幾輪取最快")
+    parser.add_argument("--ckpt", help="有給就比對分類器 top-1 一致率")
+    parser.add_argument("--report", default="preprocess_report.json")
+    args = parser.parse_args()
+
+    paths = []
+    for item in args.images:
+        paths += list_images(item, args.max_images) if os.path.isdir(item) else [item]
+    paths = paths[:args.max_images]
+    if not paths:
+        print("❌ 沒有找到圖片")
+        return
+
+    inputs = load_inputs(paths, args.upscale)
+    sizes = [Image.open(io.BytesIO(d)).size for d in inputs]
+    mp = sum(w * h for w, h in sizes) / len(sizes) / 1e6
+    rotated = sum(1 for d in inputs if orientation(d) != 1)
+    print(f"🖼 {len(inputs)} 張，平均 {mp:.1f} MP，有 EXIF 旋轉的 {rotated} 張，"
+          f"DRAFT_FACTOR={fast_preprocess.DRAFT_FACTOR}")
+
+    tensors, report = {}, {}
+    for name, fn in PIPELINES.items():
+        x, elapsed = run(fn, inputs, args.repeat)
+        tensors[name] = x
+        report[name] = {"ms_per_image": round(elapsed / len(inputs) * 1000.0, 2)}
+
+    ref = tensors[REFERENCE]
+    for name, x in tensors.items():
+        diff = (x - ref).abs()
+        report[name].update(
+            max_abs_diff=round(diff.max().item(), 4),
+            mean_abs_diff=round(diff.mean().item(), 5),
+        )
+
+    if args.ckpt:
+        model, classes = load_eager_model(args.ckpt, CPU)
+        ref_probs = classify(model, ref)
+        for name, x in tensors.items():
+            probs = ref_probs if name == REFERENCE else classify(model, x)
+            report[name].update(
+                top1_agreement=round((probs.argmax(1) == ref_probs.argmax(1)).float().mean().item(), 4),
+                max_prob_diff=round((probs - ref_probs).abs().max().item(), 4),
+            )
+
+    base = report["torchvision"]["ms_per_image"]
+    print(f"\n=== 前處理比對（以 {REFERENCE} 為基準，數值是 normalize 後的單位）===")
+    for name, row in report.items():
+        agree = f" | top-1 一致 {row['top1_agreement']:.4f} | 最大機率差 {row['max_prob_diff']:.4f}" \
+            if "top1_agreement" in row else ""
+        print(f"{name:17s} | {row['ms_per_image']:7.2f} ms/張（{base / row['ms_per_image']:.1f}x）"
+              f" | 最大差 {row['max_abs_diff']:.4f} | 平均差 {row['mean_abs_diff']:.5f}{agree}")
+
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump({"images": len(inputs), "avg_megapixels": round(mp, 2), "exif_rotated": rotated,
+                   "draft_factor": fast_preprocess.DRAFT_FACTOR, "results": report},
+                  f, ensure_ascii=False, indent=2)
+    print(f"\n📝 報告已寫入 {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+# bench_server.py
+# 端到端壓測：
+#   1. 起一個 fake_ollama.py（可調 token 速率）
+#   2. 起 app.py（同一支程式用 --role serve 啟動，在 app 行程裡把 Milvus / BGE-m3 換成本地替身）
+#   3. 用指定的併發數打 /predict_combined、/analyze、/ask_llm（及串流版）
+#   4. 輸出 p50 / p95 / p99、throughput、各階段耗時，寫成 JSON，改版前後可以直接比
+#
+# 用法：
+#   python bench_server.py --routes predict_combined analyze ask_llm --concurrency 1 4 8 --requests 40
+#   python bench_server.py --random-classifier            # 沒有 best_model.pth 也能跑
+#   python bench_server.py --real-rag                      # 用真的 Milvus + BGE-m3
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RAG_DIR = os.path.join(HERE, "rag_sources")
+
+ROUTES = ("predict_combined", "predict_combined_stream", "analyze", "ask_llm", "ask_llm_stream")
+
+RANDOM_CLASSES = ["基底細胞癌", "鱗狀細胞癌", "光化性角化", "黑色素瘤", "痣", "脂漏性角化", "皮膚纖維瘤", "血管病灶"]
+
+
+# ==============================================================
+# 1. 本地替身：Milvus collection + BGE-m3（在 app 行程裡）
+# ==============================================================
+class HashEmbedder:
+    """用文字 hash 當亂數種子產生固定的單位向量，介面同 BGEM3FlagModel.encode"""
+
+    def __init__(self, dim: int = 1024, delay_ms: float = 0.0):
+        self.dim = dim
+        self.delay = delay_ms / 1000.0
+
+    def encode(self, texts, **kwargs):
+        if self.delay:
+            time.sleep(self.delay * len(texts))
+        vecs = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha1(str(t).encode("utf-8")).digest()[:4], "little")
+            v = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            vecs[i] = v / np.linalg.norm(v)
+        return {"dense_vecs": vecs}
+
+
+class _Entity(dict):
+    pass
+
+
+class _Hit:
+    def __init__(self, distance: float, entity: dict):
+        self.distance = distance
+        self.entity = _Entity(entity)
+
+
+class StandInCollection:
+    """介面同 pymilvus Collection.search 的暴力 cosine 搜尋"""
+
+    def __init__(self, rows, embedder: HashEmbedder, delay_ms: float = 0.0):
+        self.rows = rows
+        self.delay = delay_ms / 1000.0
+        vecs = embedder.encode([r["content"] for r in rows])["dense_vecs"] if rows else np.zeros((0, embedder.dim))
+        self.matrix = vecs
+
+    def load(self):
+        pass
+
+    def search(self, data, anns_field, param, limit, output_fields):
+        if self.delay:
+            time.sleep(self.delay)
+        results = []
+        for q in data:
+            q = np.asarray(q, dtype=np.float32)
+            q = q / (np.linalg.norm(q) or 1.0)
+            scores = self.matrix @ q
+            idx = np.argsort(-scores)[:limit]
+            results.append([
+                _Hit(float(scores[i]), {f: self.rows[i].get(f) for f in output_fields})
+                for i in idx
+            ])
+        return results
+
+
+def load_rag_rows(limit: int = 0):
+    rows = []
+    for name in sorted(os.listdir(RAG_DIR)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(RAG_DIR, name), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        items = data["items"] if isinstance(data, dict) and "items" in data else data
+        for it in items:
+            if not isinstance(it, dict):
+                continue
+            title = it.get("term_zh_standard") or it.get("title_zh") or it.get("title") or "未命名"
+            content = (it.get("snippet_zh") or it.get("symptoms_zh") or it.get("content")
+                       or it.get("term_zh_raw") or title)
+            rows.append({"title": title, "url": it.get("url") or "", "content": str(content)[:8192]})
+    return rows[:limit] if limit else rows
+
+
+def serve(args):
+    """--role serve：裝好替身再 import app，跑 threaded dev server"""
+    import rag_milvus
+
+    if not args.real_rag:
+        embedder = HashEmbedder(delay_ms=args.embed_ms)
+        rag_milvus.bge_model = embedder
+        rag_milvus.collection = StandInCollection(load_rag_rows(), embedder, delay_ms=args.search_ms)
+        print("🧪 已換上 Milvus / BGE-m3 替身")
+
+    import app as app_module
+    app_module.app.run(host="127.0.0.1", port=args.port, debug=False, threaded=True)
+
+
+# ==============================================================
+# 2. 起 / 關 子行程
+# ==============================================================
+def wait_http(url: str, timeout: float, ok=(200,)):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code in ok:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def make_random_checkpoint(path: str):
+    import torch
+    import timm
+    model = timm.create_model("convnext_tiny", pretrained=False, num_classes=len(RANDOM_CLASSES))
+    torch.save({"model_state": model.state_dict(), "classes": RANDOM_CLASSES,
+                "model_name": "convnext_tiny"}, path)
+
+
+def start_stack(args, tmpdir):
+    env = dict(os.environ)
+    env["OLLAMA_URL"] = f"http://127.0.0.1:{args.ollama_port}/api/generate"
+    env["RAG_INDEX_VERSION_PATH"] = os.path.join(tmpdir, "rag_index_version.json")
+    if args.random_classifier:
+        ckpt = os.path.join(tmpdir, "random_model.pth")
+        make_random_checkpoint(ckpt)
+        env["LESION_MODEL_PATH"] = ckpt
+    env.update(dict(kv.split("=", 1) for kv in args.server_env))
+
+    ollama = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "fake_ollama.py"),
+         "--port", str(args.ollama_port),
+         "--token-rate", str(args.token_rate),
+         "--tokens", str(args.llm_tokens),
+         "--prefill-ms", str(args.prefill_ms)],
+        cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    server_log = open(os.path.join(tmpdir, "server.log"), "w", encoding="utf-8")
+    server_cmd = [sys.executable, os.path.abspath(__file__), "--role", "serve",
+                  "--port", str(args.port), "--embed-ms", str(args.embed_ms), "--search-ms", str(args.search_ms)]
+    if args.real_rag:
+        server_cmd.append("--real-rag")
+    server = subprocess.Popen(server_cmd, cwd=HERE, env=env, stdout=server_log, stderr=subprocess.STDOUT)
+    return ollama, server, server_log
+
+
+# ==============================================================
+# 3. 打 request
+# ==============================================================
+def make_images(folder: str, n: int):
+    """有指定資料夾就用裡面的圖，沒有就產生 1200x900 的隨機 JPEG"""
+    if folder:
+        paths = []
+        for root, _, files in os.walk(folder):
+            for f in files:
+                if f.lower().endswith((".jpg", ".jpeg", ".png")):
+                    paths.append(os.path.join(root, f))
+        paths.sort()
+        return [open(p, "rb").read() for p in paths[:n]] or make_images("", n)
+
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    out = []
+    for _ in range(max(1, n)):
+        arr = (rng.random((900, 1200, 3)) * 255).astype(np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(arr).save(buf, format="JPEG", quality=90)
+        out.append(buf.getvalue())
+    return out
+
+
+def unique_bytes(img: bytes) -> bytes:
+    # JPEG EOI 後面多塞幾個 byte：解碼結果一樣，但 hash 不同 → 不會命中結果快取
+    return img + os.urandom(16)
+
+
+def one_request(session, base, route, img, question, cache_hits):
+    t0 = time.perf_counter()
+    ttfb = None
+    timings = {}
+    prompt_tokens = None
+    try:
+        if route in ("ask_llm", "ask_llm_stream"):
+            resp = session.post(f"{base}/{route}", json={"question": question},
+                                stream=route.endswith("_stream"), timeout=600)
+        else:
+            data = img if cache_hits else unique_bytes(img)
+            resp = session.post(f"{base}/{route}", files={"image": ("bench.jpg", data, "image/jpeg")},
+                                stream=route.endswith("_stream"), timeout=600)
+
+        if route.endswith("_stream"):
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                if ttfb is None:
+                    ttfb = time.perf_counter() - t0
+                event = json.loads(line)
+                if event.get("type") == "done":
+                    timings = event.get("timings") or {}
+                    prompt_tokens = event.get("prompt_tokens")
+        else:
+            body = resp.json()
+            ttfb = time.perf_counter() - t0
+            if isinstance(body, dict):
+                timings = body.get("timings") or {}
+                prompt_tokens = body.get("prompt_tokens")
+        status = resp.status_code
+    except Exception as e:
+        status = f"error:{type(e).__name__}"
+    return {
+        "latency": time.perf_counter() - t0,
+        "ttfb": ttfb,
+        "status": status,
+        "timings": timings,
+        "prompt_tokens": prompt_tokens,
+    }
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    lo, hi = int(pos), min(int(pos) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def summarize(samples, wall):
+    ok = [s for s in samples if s["status"] == 200]
+    lat = [s["latency"] * 1000.0 for s in ok]
+    ttfb = [s["ttfb"] * 1000.0 for s in ok if s["ttfb"] is not None]
+    prompt_tokens = [float(s["prompt_tokens"]) for s in ok if s.get("prompt_tokens") is not None]
+    statuses = {}
+    for s in samples:
+        statuses[str(s["status"])] = statuses.get(str(s["status"]), 0) + 1
+
+    stages = {}
+    for s in ok:
+        for k, v in (s["timings"] or {}).items():
+            stages.setdefault(k, []).append(float(v))
+
+    def dist(vs):
+        return {
+            "p50": round(percentile(vs, 0.50), 1),
+            "p95": round(percentile(vs, 0.95), 1),
+            "p99": round(percentile(vs, 0.99), 1),
+            "mean": round(statistics.fmean(vs), 1),
+        } if vs else None
+
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "status_counts": statuses,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 3) if wall > 0 else 0.0,
+        "latency_ms": dist(lat),
+        "ttfb_ms": dist(ttfb),
+        "stages_ms": {k: dist(v) for k, v in sorted(stages.items())},
+        "prompt_tokens": dist(prompt_tokens),
+    }
+
+
+def run_level(base, route, concurrency, n, images, cache_hits):
+    questions = ["什麼是濕疹？", "痣會變成皮膚癌嗎？", "乾癬要怎麼照顧？"]
+    samples = []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def task(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        r = one_request(local.session, base, route, images[i % len(images)],
+                        questions[i % len(questions)], cache_hits)
+        with lock:
+            samples.append(r)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(task, range(n)))
+    return summarize(samples, time.perf_counter() - t0)
+
+
+# ==============================================================
+# 4. 主流程
+# ==============================================================
+def main():
+    parser = argparse.ArgumentParser(description="skin_server 端到端壓測")
+    parser.add_argument("--role", choices=["bench", "serve"], default="bench", help=argparse.SUPPRESS)
+    parser.add_argument("--routes", nargs="+", default=["analyze", "predict_combined", "ask_llm"], choices=ROUTES)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--requests", type=int, default=32, help="每個併發等級打幾次")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--images", default="", help="測試圖資料夾（預設產生隨機 JPEG）")
+    parser.add_argument("--cache-hits", action="store_true", help="重複送同一張圖（測快取命中）")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--token-rate", type=float, default=30.0)
+    parser.add_argument("--llm-tokens", type=int, default=300)
+    parser.add_argument("--prefill-ms", type=float, default=200.0)
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="替身 embedding 的模擬延遲")
+    parser.add_argument("--search-ms", type=float, default=0.0, help="替身 Milvus 搜尋的模擬延遲")
+    parser.add_argument("--real-rag", action="store_true", help="用真的 Milvus + BGE-m3")
+    parser.add_argument("--random-classifier", action="store_true", help="用隨機權重的 convnext_tiny")
+    parser.add_argument("--server-env", nargs="*", default=[], help="額外傳給伺服器的環境變數 KEY=VALUE")
+    parser.add_argument("--label", default="", help="這次測試的名稱（寫進結果）")
+    parser.add_argument("--out", default="", help="結果 JSON 路徑（預設 bench_results/<時間>.json）")
+    args = parser.parse_args()
+
+    if args.role == "serve":
+        serve(args)
+        return
+
+    tmpdir = tempfile.mkdtemp(prefix="skin_bench_")
+    ollama, server, server_log = start_stack(args, tmpdir)
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        print("⏳ 等待伺服器 ready ...")
+        if not wait_http(f"{base}/readyz", timeout=600):
+            print(f"❌ 伺服器沒有 ready，請看 {os.path.join(tmpdir, 'server.log')}")
+            return
+        if not wait_http(f"http://127.0.0.1:{args.ollama_port}/api/generate", 30, ok=(405,)):
+            print("❌ 假 Ollama 沒有啟動")
+            return
+
+        images = make_images(args.images, 8)
+        results = {}
+        for route in args.routes:
+            run_level(base, route, 1, args.warmup, images, args.cache_hits)
+            results[route] = {}
+            for c in args.concurrency:
+                print(f"🚀 {route} 併發 {c}，{args.requests} 次 ...")
+                summary = run_level(base, route, c, args.requests, images, args.cache_hits)
+                results[route][str(c)] = summary
+                lat = summary["latency_ms"] or {}
+                tokens = summary["prompt_tokens"]
+                print(f"   ok {summary['ok']}/{summary['requests']} | "
+                      f"p50 {lat.get('p50')} ms | p95 {lat.get('p95')} ms | p99 {lat.get('p99')} ms | "
+                      f"{summary['throughput_rps']} req/s"
+                      + (f" | prompt ≈{tokens['p50']:.0f} tokens" if tokens else ""))
+
+        report = {
+            "label": args.label,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "config": {k: v for k, v in vars(args).items() if k not in ("role", "out")},
+            "results": results,
+        }
+        out = args.out or os.path.join(HERE, "bench_results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+        os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n📝 結果已寫入 {out}")
+    finally:
+        for p in (server, ollama):
+            p.terminate()
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        server_log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,17 +7,30 @@ Milvus + BGE-M3 高可靠 RAG 重建器
 1. [ {...}, {...} ]
 2. { "items": [ {...}, {...} ] }
 3. 任意亂格式（字串、list），會自動包成 dict
+
+增量模式（--incremental）：
+每筆資料正規化後（title / url / content）算指紋，跟 manifest 記錄的已索引指紋比對，
+只 embed 新增 / 修改的、刪掉已移除的；語料沒變的話不載 BGE-m3，幾秒就結束。
+
+串流模式：ijson 一筆一筆解析 → 湊批 embed → 分段寫入，讀取 / embed / 寫入三段重疊，
+每寫完一段就存 checkpoint，中途掛掉再跑一次會接著做。
 """
 
+import argparse
+import hashlib
+import itertools
 import os
 import json
+import queue
+import threading
+import time
 from tqdm import tqdm
+import numpy as np
 import torch
-from pymilvus import (
-    connections, FieldSchema, CollectionSchema,
-    DataType, Collection, utility
-)
-from FlagEmbedding import BGEM3FlagModel
+
+from embedding_cache import encode_cached, open_default_cache
+from label_index import RAG_LABEL_INDEX, build_label_index, write_label_index
+from rag_version import write_index_version
 
 
 JSON_DIR = r"./rag_sources"
@@ -26,6 +39,19 @@ MILVUS_PORT = "19530"
 COLLECTION_NAME = "dermnet_zh_bge_m3"
 EMBED_DIM = 1024
 
+# 寫到哪裡：milvus（預設）/ local（本機 mmap 索引，RAG_BACKEND=local 時查詢端讀這份）/ both
+RAG_BACKEND = os.environ.get("RAG_BACKEND", "milvus")
+RAG_LOCAL_INDEX_DIR = os.environ.get("RAG_LOCAL_INDEX_DIR", "rag_local_index")
+
+EMBED_MODEL = "BAAI/bge-m3"
+# 已索引內容的清單（增量模式用）：各寫入目標目前有哪些指紋
+MANIFEST_PATH = os.environ.get("RAG_INDEX_MANIFEST", "rag_index_manifest.json")
+# 重建進度（中途掛掉時用來接著做），成功後自動刪掉
+CHECKPOINT_PATH = os.environ.get("RAG_BUILD_CHECKPOINT", "rag_build_checkpoint.json")
+# 每批 embed 的 token 預算 = 筆數 × 批內最長長度（padding 後實際要算的量）；GPU 記憶體小就調低
+EMBED_TOKEN_BUDGET = int(os.environ.get("EMBED_TOKEN_BUDGET", "16384"))
+EMBED_MAX_LENGTH = int(os.environ.get("EMBED_MAX_LENGTH", "8192"))
+
 
 # -------------------------
 # 工具：清洗文字
@@ -101,105 +127,686 @@ def normalize_item(item):
 
 
 # -------------------------
-# 1. 讀取所有 JSON
+# 串流讀 JSON（ijson）：一次只解析一筆，不用把整個檔案讀進記憶體
+# - [ {...}, ... ]          → prefix "item"
+# - { "items": [ ... ] }    → prefix "items.item"
+# 沒裝 ijson 就退回 load_json_safely
 # -------------------------
-all_titles = []
-all_urls = []
-all_contents = []
+def iter_json_file(path):
+    try:
+        import ijson
+    except ImportError:
+        yield from load_json_safely(path)
+        return
+
+    with open(path, "rb") as f:
+        head = f.read(4096).lstrip(b"\xef\xbb\xbf \t\r\n")
+        if head.startswith(b"["):
+            prefix = "item"
+        elif head.startswith(b"{"):
+            prefix = "items.item"
+        else:
+            raise ValueError(f"⚠ JSON 格式錯誤：{path}")
+        f.seek(0)
+        if f.read(3) != b"\xef\xbb\xbf":
+            f.seek(0)
+        yield from ijson.items(f, prefix, use_float=True)
 
-json_files = [f for f in os.listdir(JSON_DIR) if f.endswith(".json")]
-print("找到 JSON：", json_files)
 
-for jf in json_files:
-    path = os.path.join(JSON_DIR, jf)
-    print(f"📥 載入 {jf}")
+# -------------------------
+# 1. 讀取所有 JSON（一筆一筆產生）
+# -------------------------
+def item_fingerprint(title, url, content):
+    """正規化後的三個欄位決定指紋；內容一改就是新指紋（舊的那筆會被刪掉）"""
+    raw = json.dumps([title, url, content], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def iter_items(json_dir=JSON_DIR, verbose=True):
+    """yield {fp, title, url, content}；完全相同的條目指紋後面加 -1、-2，一筆都不少"""
+    seen = {}
+
+    json_files = sorted(f for f in os.listdir(json_dir) if f.endswith(".json"))
+    if verbose:
+        print("找到 JSON：", json_files)
+
+    for jf in json_files:
+        path = os.path.join(json_dir, jf)
+        if verbose:
+            print(f"📥 載入 {jf}")
+
+        for raw_item in iter_json_file(path):
+
+            item = normalize_item(raw_item)
+
+            title = safe_text(
+                item.get("term_zh_standard"),
+                item.get("title_zh"),
+                item.get("term_zh_raw"),
+                item.get("title"),
+                item.get("name_zh")
+            )
+
+            content = safe_text(
+                item.get("full_text_zh"),
+                item.get("content_zh"),
+                item.get("snippet_zh"),
+                item.get("symptoms_zh"),
+                item.get("causes_zh"),
+                item.get("content"),
+                item.get("term_zh_raw"),
+                title
+            )
+
+            url = item.get("url") or ""
+            title = title or "未命名"
+            content = content or title
+
+            fp = item_fingerprint(title, url, content)
+            n = seen.get(fp, 0)
+            seen[fp] = n + 1
+            if n:
+                fp = f"{fp}-{n}"
+
+            yield {"fp": fp, "title": title, "url": url, "content": content}
+
+
+def corpus_signature(json_dir=JSON_DIR):
+    """來源檔的名稱 / 大小 / 修改時間；checkpoint 只在來源沒動過時才接著用"""
+    h = hashlib.sha256()
+    for name in sorted(f for f in os.listdir(json_dir) if f.endswith(".json")):
+        st = os.stat(os.path.join(json_dir, name))
+        h.update(f"{name}:{st.st_size}:{st.st_mtime_ns};".encode("utf-8"))
+    return h.hexdigest()[:16]
 
-    data = load_json_safely(path)
 
-    for raw_item in data:
+# -------------------------
+# 2. Embedding
+# -------------------------
+_model = None
+_cache = None
+_cache_opened = False
+_embed_stats = {"texts": 0, "tokens": 0, "padded": 0, "batches": 0, "splits": 0, "seconds": 0.0}
+
+
+def get_model():
+    """真的有東西要 embed 才載 BGE-m3（增量模式下語料沒變就完全不用載）"""
+    global _model
+    if _model is None:
+        from FlagEmbedding import BGEM3FlagModel
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        print("使用裝置：", device)
+        _model = BGEM3FlagModel(EMBED_MODEL, device=device, use_fp16=(device == "cuda"))
+    return _model
+
+
+def get_cache():
+    global _cache, _cache_opened
+    if not _cache_opened:
+        _cache = open_default_cache(EMBED_MODEL, EMBED_DIM)
+        _cache_opened = True
+    return _cache
+
+
+def token_lengths(texts):
+    """每段文字 tokenize 後的長度（超過 EMBED_MAX_LENGTH 的會被截斷，照截斷後算）"""
+    tokenizer = getattr(get_model(), "tokenizer", None)
+    if tokenizer is not None:
+        try:
+            ids = tokenizer(list(texts), add_special_tokens=True, truncation=True,
+                            max_length=EMBED_MAX_LENGTH)["input_ids"]
+            return [len(x) for x in ids]
+        except Exception as e:
+            print("⚠ tokenizer 失敗，改用字數估長度：", e)
+    # 中文大致一字一 token
+    return [min(len(t) + 2, EMBED_MAX_LENGTH) for t in texts]
+
+
+def plan_batches(lengths, token_budget=EMBED_TOKEN_BUDGET, max_batch=64):
+    """
+    依長度由長到短排，每批的「筆數 × 批內最長長度」（padding 後真正要算的量）不超過 token_budget，
+    短的詞條擠在一起、長文章自己一批。回傳 [[原始 index, ...], ...]
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches, cur = [], []
+    for i in order:
+        # 由長到短排，批內最長的就是第一筆
+        width = lengths[cur[0]] if cur else lengths[i]
+        if cur and (len(cur) + 1 > max_batch or (len(cur) + 1) * width > token_budget):
+            batches.append(cur)
+            cur = []
+        cur.append(i)
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def _encode_batch(model, texts):
+    """一批失敗（通常是 OOM）就對半切開重算；剩一筆還失敗就重試一次，再失敗整個中止（不能讓向量跟 metadata 錯位）"""
+    try:
+        emb = model.encode(texts, batch_size=len(texts), max_length=EMBED_MAX_LENGTH)["dense_vecs"]
+        return np.asarray(emb, dtype=np.float32).reshape(len(texts), EMBED_DIM)
+    except Exception as e:
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        if len(texts) == 1:
+            print("⚠ Embedding 失敗，重試一次：", e)
+            emb = model.encode(texts, batch_size=1, max_length=EMBED_MAX_LENGTH)["dense_vecs"]
+            return np.asarray(emb, dtype=np.float32).reshape(1, EMBED_DIM)
+        _embed_stats["splits"] += 1
+        mid = len(texts) // 2
+        print(f"⚠ Embedding 失敗（{len(texts)} 筆），切成 {mid} + {len(texts) - mid} 筆重算：", e)
+        return np.concatenate([_encode_batch(model, texts[:mid]), _encode_batch(model, texts[mid:])])
+
+
+def _encode_uncached(texts, batch_size=64, token_budget=EMBED_TOKEN_BUDGET):
+    """按 token 長度分批 encode，結果照原本順序放回"""
+    embeddings = np.zeros((len(texts), EMBED_DIM), dtype=np.float32)
+    if not texts:
+        return embeddings
+    model = get_model()
+
+    t0 = time.perf_counter()
+    lengths = token_lengths(texts)
+    for batch in plan_batches(lengths, token_budget, batch_size):
+        embeddings[batch] = _encode_batch(model, [texts[i] for i in batch])
+        _embed_stats["batches"] += 1
+        _embed_stats["padded"] += len(batch) * lengths[batch[0]]
+
+    _embed_stats["texts"] += len(texts)
+    _embed_stats["tokens"] += sum(lengths)
+    _embed_stats["seconds"] += time.perf_counter() - t0
+    return embeddings
+
+
+def embed_texts(texts, batch_size=64, token_budget=EMBED_TOKEN_BUDGET):
+    """回傳 (N, EMBED_DIM) float32；算過的文字直接從 embedding 快取讀（跟查詢端共用）"""
+    return encode_cached(get_cache(), list(texts),
+                         lambda t: _encode_uncached(t, batch_size, token_budget), EMBED_DIM)
+
+
+def embed_stats_line():
+    st = _embed_stats
+    if not st["texts"]:
+        return None
+    secs = max(st["seconds"], 1e-9)
+    return (f"⚡ embedding：{st['texts']} 筆 / {st['batches']} 批，{st['tokens']} tokens，"
+            f"{st['tokens'] / secs:.0f} tokens/s（{st['texts'] / secs:.1f} 筆/s），"
+            f"padding 效率 {st['tokens'] / max(st['padded'], 1):.0%}"
+            + (f"，失敗切批 {st['splits']} 次" if st["splits"] else ""))
 
-        item = normalize_item(raw_item)
 
-        title = safe_text(
-            item.get("term_zh_standard"),
-            item.get("title_zh"),
-            item.get("term_zh_raw"),
-            item.get("title"),
-            item.get("name_zh")
-        )
+# -------------------------
+# manifest：各寫入目標目前索引了哪些指紋
+# -------------------------
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {"model": EMBED_MODEL, "dim": EMBED_DIM, "targets": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("model") != EMBED_MODEL or manifest.get("dim") != EMBED_DIM:
+        print("⚠ manifest 的 embedding 模型不同，全部重建")
+        return {"model": EMBED_MODEL, "dim": EMBED_DIM, "targets": {}}
+    return manifest
 
-        content = safe_text(
-            item.get("full_text_zh"),
-            item.get("content_zh"),
-            item.get("snippet_zh"),
-            item.get("symptoms_zh"),
-            item.get("causes_zh"),
-            item.get("content"),
-            item.get("term_zh_raw"),
-            title
-        )
 
-        url = item.get("url") or ""
+def save_manifest(manifest, path=MANIFEST_PATH):
+    _write_json_atomic(path, manifest)
 
-        all_titles.append(title or "未命名")
-        all_urls.append(url)
-        all_contents.append(content or title)
 
-print(f"\n📌 最終總筆數：{len(all_contents)} 筆\n")
+def _write_json_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
 
 
 # -------------------------
-# 2. Embedding
+# checkpoint：每寫完一批就記「已寫入幾筆 + sink 狀態」，
+# 重建中途掛掉，同樣的參數再跑一次就從這裡接著做
 # -------------------------
-device = "cuda" if torch.cuda.is_available() else "cpu"
-print("使用裝置：", device)
+class Checkpoint:
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print("⚠ checkpoint 讀取失敗，從頭開始：", e)
+            return None
+        return data if data.get("key") == self.key else None
+
+    def save(self, done, sink_state):
+        _write_json_atomic(self.path, {"key": self.key, "done": done, "sink": sink_state})
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
 
-model = BGEM3FlagModel("BAAI/bge-m3", device=device, use_fp16=(device == "cuda"))
 
-batch_size = 16
-embeddings = []
+# -------------------------
+# 3a. Milvus sink
+#     主鍵用指紋（fp），增量時才能照指紋刪除 / upsert
+# -------------------------
+def _connect_milvus():
+    from pymilvus import connections
+    connections.connect(alias="default", host=MILVUS_HOST, port=MILVUS_PORT)
+
+
+def _columns(items, embeddings):
+    return [
+        [it["fp"] for it in items],
+        [it["title"] for it in items],
+        [it["url"] for it in items],
+        [it["content"] for it in items],
+        embeddings.tolist(),
+    ]
+
+
+def milvus_supports_incremental():
+    """collection 存在而且是新版 schema（fp 主鍵）才能增量"""
+    from pymilvus import Collection, utility
+
+    _connect_milvus()
+    if not utility.has_collection(COLLECTION_NAME):
+        return False
+    if "fp" not in [f.name for f in Collection(COLLECTION_NAME).schema.fields]:
+        print("⚠ 舊版 collection 沒有 fp 主鍵，改做全量重建")
+        return False
+    return True
+
+
+def create_milvus_collection():
+    from pymilvus import (
+        FieldSchema, CollectionSchema,
+        DataType, Collection, utility
+    )
+
+    _connect_milvus()
+
+    if utility.has_collection(COLLECTION_NAME):
+        print(f"刪除舊 collection：{COLLECTION_NAME}")
+        utility.drop_collection(COLLECTION_NAME)
+
+    fields = [
+        FieldSchema(name="fp", dtype=DataType.VARCHAR, max_length=64, is_primary=True, auto_id=False),
+        FieldSchema(name="title", dtype=DataType.VARCHAR, max_length=512),
+        FieldSchema(name="url", dtype=DataType.VARCHAR, max_length=512),
+        FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=8192),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=EMBED_DIM),
+    ]
+
+    schema = CollectionSchema(fields, description="DermNet + TW 名詞 RAG DB")
+    collection = Collection(COLLECTION_NAME, schema, shards_num=2)
+
+    index_params = {
+        "metric_type": "COSINE",
+        "index_type": "IVF_FLAT",
+        "params": {"nlist": 1024},
+    }
+
+    collection.create_index("embedding", index_params)
+    return collection
 
-print("🚀 產生 embedding ...")
-for i in tqdm(range(0, len(all_contents), batch_size)):
-    batch = all_contents[i:i+batch_size]
-    try:
-        emb = model.encode(batch)["dense_vecs"]
-        for e in emb:
-            embeddings.append(e.tolist())
-    except Exception as e:
-        print("⚠ Embedding 失敗跳過：", e)
 
-print("✔ embedding 完成：", len(embeddings))
+class MilvusSink:
+    """full：建新 collection；incremental：沿用既有 collection。兩種都用 upsert 寫入"""
+
+    def __init__(self, mode, resume_state=None):
+        from pymilvus import Collection
+
+        self.mode = mode
+        if mode == "full" and resume_state is None:
+            self.collection = create_milvus_collection()
+        else:
+            _connect_milvus()
+            self.collection = Collection(COLLECTION_NAME)
+        self.count = 0
+
+    def delete(self, fps, chunk_size=512):
+        for i in range(0, len(fps), chunk_size):
+            self.collection.delete(f"fp in {json.dumps(fps[i:i + chunk_size])}")
+
+    def add(self, items, embeddings):
+        # fp 是 primary key，upsert 對同一個 fp 是冪等的：run_pipeline 先寫 sink 才存 checkpoint，
+        # 中間當掉的話 resume 會重送最後一批，用 insert 會多出重複的列（RAG 也會撈到重複的結果）
+        self.collection.upsert(_columns(items, embeddings))
+        self.count += len(items)
+
+    def state(self):
+        return {}
+
+    def commit(self):
+        self.collection.flush()
+        self.collection.load()
+        print(f"✅ Milvus collection {COLLECTION_NAME} 寫入 {self.count} 筆")
+
+    def abort(self):
+        pass
 
 
 # -------------------------
-# 3. 建立 Milvus collection
+# 3b. 本地 mmap 索引 sink（local_vector_index.py）
 # -------------------------
-connections.connect(alias="default", host=MILVUS_HOST, port=MILVUS_PORT)
+LOCAL_FIELDS = ("title", "url", "content", "fp")
 
-if utility.has_collection(COLLECTION_NAME):
-    print(f"刪除舊 collection：{COLLECTION_NAME}")
-    utility.drop_collection(COLLECTION_NAME)
 
-fields = [
-    FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-    FieldSchema(name="title", dtype=DataType.VARCHAR, max_length=512),
-    FieldSchema(name="url", dtype=DataType.VARCHAR, max_length=512),
-    FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=8192),
-    FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=EMBED_DIM),
-]
+class LocalSink:
+    def __init__(self, index_dir, kind="flat", nlist=0, resume_state=None):
+        from local_vector_index import LocalIndexWriter
 
-schema = CollectionSchema(fields, description="DermNet + TW 名詞 RAG DB")
-collection = Collection(COLLECTION_NAME, schema, shards_num=2)
+        self.kind = kind
+        self.nlist = nlist
+        self.index_dir = index_dir
+        self.writer = LocalIndexWriter(index_dir, EMBED_DIM, LOCAL_FIELDS, resume_state=resume_state)
 
-index_params = {
-    "metric_type": "COSINE",
-    "index_type": "IVF_FLAT",
-    "params": {"nlist": 1024},
-}
+    def add(self, items, embeddings):
+        self.writer.add(items, embeddings)
 
-collection.create_index("embedding", index_params)
-collection.insert([all_titles, all_urls, all_contents, embeddings])
-collection.load()
+    def state(self):
+        return self.writer.state()
 
-print("\n🎉 RAG 重建成功（不遺漏任何資料）！")
+    def commit(self):
+        info = self.writer.commit(self.kind, self.nlist)
+        print(f"✅ 本地索引寫入 {self.index_dir}：{info['kind']}，{info['count']} 筆"
+              + (f"，{info['nlist']} 群" if info["kind"] == "ivf" else ""))
+
+    def abort(self):
+        self.writer.abort()
+
+
+def open_local_index(index_dir):
+    """增量用：舊索引存在而且有 fp 欄位才回傳"""
+    from local_vector_index import LocalVectorIndex
+
+    try:
+        old = LocalVectorIndex(index_dir)
+    except FileNotFoundError:
+        return None
+    if "fp" not in old.fields or old.info.get("dim") not in (EMBED_DIM, 0):
+        old.close()
+        return None
+    return old
+
+
+# -------------------------
+# 4. 串流管線
+#   [讀取 thread] 解析 + 湊成一批 ──q1──► [embed thread] ──q2──► [主 thread] 寫入 sink + checkpoint
+#   佇列都有上限：embed 跟寫入互相重疊，記憶體裡最多只有幾批資料
+# -------------------------
+_DONE = object()
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+def _put(q, x, stop):
+    while not stop.is_set():
+        try:
+            q.put(x, timeout=0.2)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(items, chunk_size, q, stop):
+    try:
+        batch = []
+        for it in items:
+            batch.append(it)
+            if len(batch) >= chunk_size:
+                if not _put(q, batch, stop):
+                    return
+                batch = []
+        if batch:
+            _put(q, batch, stop)
+    except BaseException as e:
+        _put(q, _Failed(e), stop)
+    finally:
+        _put(q, _DONE, stop)
+
+
+def _embed_stage(to_vectors, q_in, q_out, stop):
+    while not stop.is_set():
+        try:
+            x = q_in.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        if x is _DONE or isinstance(x, _Failed):
+            _put(q_out, x, stop)
+            if x is _DONE:
+                return
+            continue
+        try:
+            _put(q_out, (x, to_vectors(x)), stop)
+        except BaseException as e:
+            _put(q_out, _Failed(e), stop)
+            _put(q_out, _DONE, stop)
+            return
+
+
+def run_pipeline(items, total, sink, to_vectors, checkpoint, done=0, chunk_size=256, queue_size=4):
+    """items 已經跳過 checkpoint 裡寫過的前 done 筆；回傳總共寫入幾筆"""
+    stop = threading.Event()
+    q_items = queue.Queue(maxsize=queue_size)
+    q_vecs = queue.Queue(maxsize=queue_size)
+    threads = [
+        threading.Thread(target=_produce, args=(items, chunk_size, q_items, stop), name="ingest-read", daemon=True),
+        threading.Thread(target=_embed_stage, args=(to_vectors, q_items, q_vecs, stop), name="ingest-embed",
+                         daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    bar = tqdm(total=total, initial=done, unit="筆")
+    try:
+        while True:
+            x = q_vecs.get()
+            if x is _DONE:
+                break
+            if isinstance(x, _Failed):
+                raise x.error
+            batch, vecs = x
+            sink.add(batch, vecs)
+            done += len(batch)
+            checkpoint.save(done, sink.state())
+            bar.update(len(batch))
+    finally:
+        stop.set()
+        bar.close()
+        for t in threads:
+            t.join(timeout=5)
+    return done
+
+
+def build_target(target, mode, fps, args, indexed):
+    """對一個寫入目標跑完整個管線；回傳 (新增 / 修改筆數, 刪除筆數)"""
+    location = COLLECTION_NAME if target == "milvus" else os.path.abspath(args.local_dir)
+    key = {
+        "target": target,
+        "location": location,
+        "mode": mode,
+        "corpus": corpus_signature(JSON_DIR),
+        "indexed": hashlib.sha256("\n".join(sorted(indexed)).encode("utf-8")).hexdigest()[:16],
+    }
+    checkpoint = Checkpoint(args.checkpoint, key)
+    saved = None if args.no_resume else checkpoint.load()
+    done = saved["done"] if saved else 0
+    if saved:
+        print(f"⏩ [{target}] 從 checkpoint 接著做：已寫入 {done} 筆")
+
+    target_fps = set(fps)
+    items = iter_items(JSON_DIR, verbose=False)
+    old = None
+    removed = 0
+
+    if target == "milvus":
+        sink = MilvusSink(mode, resume_state=saved["sink"] if saved else None)
+        if mode == "incremental":
+            gone = sorted(indexed - target_fps)
+            sink.delete(gone)
+            removed = len(gone)
+            items = (it for it in items if it["fp"] not in indexed)
+            total = len(target_fps - indexed)
+        else:
+            total = len(fps)
+        added = total
+
+        def to_vectors(batch):
+            return embed_texts([it["content"] for it in batch], args.batch_size, args.token_budget)
+    else:
+        sink = LocalSink(args.local_dir, args.local_kind, args.nlist,
+                         resume_state=saved["sink"] if saved else None)
+        total = len(fps)
+        old_rows = {}
+        if mode == "incremental":
+            old = open_local_index(args.local_dir)
+            old_rows = {old.row(i)["fp"]: i for i in range(len(old))}
+            removed = len(set(old_rows) - target_fps)
+        added = len(target_fps - set(old_rows))
+
+        def to_vectors(batch):
+            # 沒變的條目直接搬舊索引的向量，只 embed 新的
+            vecs = np.empty((len(batch), EMBED_DIM), dtype=np.float32)
+            need = []
+            for i, it in enumerate(batch):
+                j = old_rows.get(it["fp"])
+                if j is None:
+                    need.append(i)
+                else:
+                    vecs[i] = old.vectors[j]
+            if need:
+                vecs[need] = embed_texts([batch[i]["content"] for i in need], args.batch_size, args.token_budget)
+            return vecs
+
+    try:
+        run_pipeline(itertools.islice(items, done, None), total, sink, to_vectors, checkpoint,
+                     done=done, chunk_size=args.chunk_size, queue_size=args.queue_size)
+        sink.commit()
+    except BaseException:
+        print(f"❌ [{target}] 重建中斷，checkpoint 留在 {args.checkpoint}，同樣的參數再跑一次會接著做")
+        raise
+    finally:
+        if old is not None:
+            old.close()
+    checkpoint.clear()
+    return added, removed
+
+
+# -------------------------
+# 標籤 → 文件字面索引（查詢端遇到已知的分類標籤就不用跑 embedding）
+# -------------------------
+def write_labels(path, json_dir=JSON_DIR):
+    """對照表 / 文章的名稱欄位 + 這次寫進向量庫的文件內容 → rag_label_index.json"""
+    mapping = []
+    for jf in sorted(f for f in os.listdir(json_dir) if f.endswith(".json")):
+        for raw_item in iter_json_file(os.path.join(json_dir, jf)):
+            item = normalize_item(raw_item)
+            if item.get("url"):
+                mapping.append(item)
+    index = build_label_index(mapping, iter_items(json_dir, verbose=False), EMBED_MODEL)
+    write_label_index(index, path)
+    print(f"🔤 標籤索引：{len(index['terms'])} 個詞 → {len(index['docs'])} 篇文件（{path}）")
+
+
+# -------------------------
+# 主流程
+# -------------------------
+def main():
+    parser = argparse.ArgumentParser(description="重建 DermNet RAG 向量庫")
+    parser.add_argument("--backend", choices=["milvus", "local", "both"], default=RAG_BACKEND)
+    parser.add_argument("--local-dir", default=RAG_LOCAL_INDEX_DIR)
+    parser.add_argument("--local-kind", choices=["flat", "ivf"], default="flat",
+                        help="flat = 精確搜尋；ivf = 分群後只搜最近幾群（資料量大時用）")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF 群數（0 = sqrt(N)）")
+    parser.add_argument("--batch-size", type=int, default=64, help="BGE-m3 每批最多幾筆（短詞條才會湊到這麼多）")
+    parser.add_argument("--token-budget", type=int, default=EMBED_TOKEN_BUDGET,
+                        help="每批 token 上限（筆數 × 批內最長長度）；文字先依長度排序再切批")
+    parser.add_argument("--chunk-size", type=int, default=256, help="每次寫入 Milvus / 本地索引幾筆（也是 checkpoint 間隔）")
+    parser.add_argument("--queue-size", type=int, default=4, help="各階段之間最多排幾批")
+    parser.add_argument("--incremental", action="store_true",
+                        help="只處理新增 / 修改 / 刪除的條目（依 manifest 比對指紋）")
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--no-resume", action="store_true", help="忽略 checkpoint，從頭重建")
+    parser.add_argument("--label-index", default=RAG_LABEL_INDEX,
+                        help="標籤字面索引輸出路徑（空字串 = 不寫）")
+    args = parser.parse_args()
+
+    # 第一遍只算指紋（串流解析，不留內容），決定要做什麼
+    fps = [it["fp"] for it in iter_items(JSON_DIR)]
+    print(f"\n📌 最終總筆數：{len(fps)} 筆\n")
+
+    manifest = load_manifest(args.manifest)
+    targets = ["milvus", "local"] if args.backend == "both" else [args.backend]
+
+    changed = False
+    for target in targets:
+        state = manifest["targets"].get(target) or {}
+        indexed = set(state.get("fps") or [])
+        location = COLLECTION_NAME if target == "milvus" else os.path.abspath(args.local_dir)
+
+        mode = "full"
+        if args.incremental and state.get("location") == location:
+            if indexed == set(fps) and (target == "milvus" or state.get("kind") == args.local_kind):
+                print(f"✔ [{target}] 內容沒有變動，略過")
+                continue
+            if target == "milvus":
+                mode = "incremental" if milvus_supports_incremental() else "full"
+            else:
+                old = open_local_index(args.local_dir)
+                if old is not None:
+                    mode = "incremental"
+                    old.close()
+        if args.incremental and mode == "full":
+            print(f"ℹ️ [{target}] 沒有可用的舊索引，全量重建")
+        if mode == "full":
+            indexed = set()
+
+        added, removed = build_target(target, mode, fps, args, indexed)
+        if mode == "incremental":
+            print(f"🔁 [{target}] 增量更新：新增 / 修改 {added} 筆，刪除 {removed} 筆")
+        changed = changed or mode == "full" or bool(added or removed)
+
+        manifest["targets"][target] = {"location": location, "kind": args.local_kind, "fps": fps}
+        save_manifest(manifest, args.manifest)
+
+    line = embed_stats_line()
+    if line:
+        print(line)
+
+    cache = get_cache() if _cache_opened else None
+    if cache is not None:
+        st = cache.stats()
+        print(f"💾 embedding 快取：命中 {st['hits']} 筆，新算 {st['misses']} 筆（共 {st['entries']} 筆）")
+
+    if args.label_index and (changed or not os.path.exists(args.label_index)):
+        write_labels(args.label_index)
+
+    if not changed:
+        print("\n✅ RAG 內容沒有變動，版本不變（快取繼續有效）")
+        return
+
+    # 寫新的版本戳記：查詢端的結果快取 / 檢索快取看到版本變了就會失效
+    target_name = COLLECTION_NAME if args.backend == "milvus" else f"{COLLECTION_NAME}@{args.backend}"
+    version = write_index_version(target_name, len(fps))
+    print(f"🏷 RAG 版本：{version}")
+
+    print("\n🎉 RAG 重建成功（不遺漏任何資料）！")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,60 @@
 #   ConvNeXt 影像分類 → RAG（Milvus）→ DeepSeek LLM 報告
 
 import json
-from typing import Dict, Any, List, Optional
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
 import requests
 
-from lesion_model import predict_lesion
+from context_packer import CONTEXT_TOKEN_BUDGET, estimate_tokens, pack_context
+from lesion_model import predict_lesion, get_model_fingerprint, tta_cache_tag
 from rag_milvus import search_knowledge
+from rag_version import read_index_version
+from result_cache import ResultCache, make_cache_key
+from stage_pipeline import StagePipeline
+from llm_admission import AdmissionController, QueueFullError, PRIORITY_REPORT, PRIORITY_CHAT, PRIORITY_NAMES
+import metrics
 
-# Ollama 伺服器（DeepSeek-R1 14B）
-OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
+# Ollama 伺服器（DeepSeek-R1 14B）；壓測時用 OLLAMA_URL 指到 fake_ollama.py
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://127.0.0.1:11434/api/generate")
 LLM_MODEL = "deepseek-r1:14b"
 
+# 同時打到 Ollama 的請求數上限 + 等待佇列長度；滿了 app.py 回 429
+llm_admission = AdmissionController(
+    max_concurrent=int(os.environ.get("LLM_MAX_CONCURRENT", "1")),
+    max_queue=int(os.environ.get("LLM_MAX_QUEUE", "8")),
+    queue_timeout=float(os.environ.get("LLM_QUEUE_TIMEOUT", "120")),
+)
+
+# 改了 build_report_prompt 或 LLM 參數就把版本號往上加，舊的快取結果才會失效
+# RAG 打包的 token 預算也會改變 prompt，一起放進版本號
+PROMPT_VERSION = f"report-v2/ctx{CONTEXT_TOKEN_BUDGET}"
+
+# 同一張圖重送（App 重試、連點、重開結果頁）直接回快取，不再重跑模型 + RAG + LLM
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("RESULT_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.environ.get("RESULT_CACHE_TTL", "86400")),
+    disk_dir=os.environ.get("RESULT_CACHE_DIR") or None,
+    disk_max_files=int(os.environ.get("RESULT_CACHE_DISK_MAX_FILES", "10000")),
+)
+
+# 各 stage 共用的 thread pool；分類一出來就先投機查前幾名候選標籤的 RAG（0 = 關閉）
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "8"))
+SPECULATIVE_TOPK = int(os.environ.get("SPECULATIVE_RETRIEVAL", "3"))
+_stage_pool = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="stage")
+
+
+def _reset_after_fork():
+    # serve.py fork 出來的 worker：thread 不會跟著過來，pool 換新的
+    global _stage_pool
+    _stage_pool = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="stage")
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
 
 # ---------------------------
 # 風險評估（依目前 8 類中文標籤）
@@ -105,58 +148,326 @@ def call_llm(prompt: str) -> str:
         "stream": False,
         "temperature": 0.7,
     }
-    resp = requests.post(OLLAMA_URL, json=payload, timeout=300)
-    resp.raise_for_status()
-    data = resp.json()
-    return data.get("response", "")
+    try:
+        with llm_admission.slot(PRIORITY_REPORT):
+            resp = requests.post(OLLAMA_URL, json=payload, timeout=300)
+        resp.raise_for_status()
+        data = resp.json()
+    except QueueFullError:
+        metrics.record_llm_failure("report", "rejected")
+        raise
+    except Exception:
+        metrics.record_llm_failure("report")
+        raise
+    text = data.get("response", "")
+    # eval_count / eval_duration 是 Ollama 自己量的生成 token 數與時間，進 /metrics
+    metrics.record_llm("report", len(prompt), len(text), data)
+    return text
 
 
 # ---------------------------
-# 主流程：影像 → RAG → LLM
+# 串流呼叫 Ollama（stream=True，一行一個 JSON）
 # ---------------------------
-def predict_combined(image_path: str, survey=None):
+def stream_llm(prompt: str, model: str = LLM_MODEL, temperature: Optional[float] = None,
+               priority: int = PRIORITY_REPORT) -> Iterator[str]:
+    """Ollama 每吐出一段文字就 yield 一段（整段串流期間佔一個 LLM 名額）"""
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "stream": True,
+    }
+    if temperature is not None:
+        payload["temperature"] = temperature
+
+    kind = PRIORITY_NAMES.get(priority, str(priority))
+    n_chars = 0
+    final: Dict[str, Any] = {}
+    ok = False
+
+    # (連線逾時, 兩個 chunk 之間最多等多久)
     try:
-        print("\n==============================")
-        print("🔥 [COMBINED] 影像 → RAG → LLM 開始")
-        print("==============================")
+        with llm_admission.slot(priority), \
+                requests.post(OLLAMA_URL, json=payload, stream=True, timeout=(10, 300)) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(data["error"])
+                text = data.get("response", "")
+                if text:
+                    n_chars += len(text)
+                    yield text
+                if data.get("done"):
+                    final = data
+                    break
+        ok = True
+    except QueueFullError:
+        metrics.record_llm_failure(kind, "rejected")
+        raise
+    except GeneratorExit:
+        # client 中途斷線
+        metrics.record_llm_failure(kind, "cancelled")
+        raise
+    except Exception:
+        metrics.record_llm_failure(kind)
+        raise
+    if ok:
+        metrics.record_llm(kind, len(prompt), n_chars, final)
+
+
+class ThinkSplitter:
+    """
+    把 DeepSeek-R1 的輸出切成 think / token 兩種：
+    <think> ... </think> 之間是推理過程，其餘是給使用者看的內容。
+    標籤可能被切在兩個 chunk 中間，所以尾巴疑似標籤開頭的部分先留著。
+    """
+
+    OPEN = "<think>"
+    CLOSE = "</think>"
+
+    def __init__(self):
+        self.in_think = False
+        self.buf = ""
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        self.buf += text
+        out: List[Tuple[str, str]] = []
+        while self.buf:
+            tag = self.CLOSE if self.in_think else self.OPEN
+            kind = "think" if self.in_think else "token"
+            idx = self.buf.find(tag)
+            if idx >= 0:
+                if idx > 0:
+                    out.append((kind, self.buf[:idx]))
+                self.buf = self.buf[idx + len(tag):]
+                self.in_think = not self.in_think
+                continue
+
+            keep = 0
+            for n in range(min(len(tag) - 1, len(self.buf)), 0, -1):
+                if tag.startswith(self.buf[-n:]):
+                    keep = n
+                    break
+            emit = self.buf[:len(self.buf) - keep]
+            if emit:
+                out.append((kind, emit))
+            self.buf = self.buf[len(self.buf) - keep:]
+            break
+        return out
 
-        # 1️⃣ 模型分類
-        lesion = predict_lesion(image_path)
+    def flush(self) -> List[Tuple[str, str]]:
+        if not self.buf:
+            return []
+        out = [("think" if self.in_think else "token", self.buf)]
+        self.buf = ""
+        return out
+
+
+def stream_llm_events(prompt: str, model: str = LLM_MODEL, temperature: Optional[float] = None,
+                      priority: int = PRIORITY_REPORT) -> Iterator[Tuple[str, str]]:
+    """stream_llm + ThinkSplitter，yield (kind, text)"""
+    splitter = ThinkSplitter()
+    for chunk in stream_llm(prompt, model, temperature, priority):
+        for kind, text in splitter.feed(chunk):
+            yield kind, text
+    for kind, text in splitter.flush():
+        yield kind, text
+
+
+# ---------------------------
+# 結果快取 key
+# ---------------------------
+def read_image_bytes(image) -> bytes:
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    if hasattr(image, "read"):
+        return image.read()
+    with open(image, "rb") as f:
+        return f.read()
+
+
+def result_cache_key(image_bytes: bytes, tta=None) -> str:
+    # survey 目前沒有進 prompt，所以不放進 key；之後有用到要一起加
+    return make_cache_key(
+        image_bytes,
+        get_model_fingerprint(),
+        tta_cache_tag(tta),
+        LLM_MODEL,
+        PROMPT_VERSION,
+        read_index_version(),
+    )
+
+
+# ---------------------------
+# 共用前半段：分類 → 風險 → RAG → Prompt（相依圖，能重疊的一起跑）
+#
+#   classify ──► top1 ──► risk ──────────┐
+#        │          └──► retrieve ──────►  prompt
+#        ├──► speculative_retrieve[1..k]（這張圖的 top-k 候選，跟 top1 / risk 同時開跑）
+#        └──────────────────────────────────┘
+#   top1 一確定就取消其他候選（pipe.cancel：還沒開始的才取消得掉，已經在跑的跑完順便把 RAG 快取填好）；
+#   retrieve 接手 top-1 那一個：已經在跑 / 跑完就等它，還沒輪到就取消掉自己查，不會卡住 pool。
+#   取消的候選在 timings 裡記 0。
+# ---------------------------
+def _retrieve(label: str) -> List[Dict[str, Any]]:
+    return search_knowledge(label, top_k=5)
+
+
+def _log_rag(rag_info: List[Dict[str, Any]]):
+    print("\n===== 🔵 [RAG Query] =====")
+    if not rag_info:
+        print("⚠️ RAG 沒取到任何相關知識（可能是標籤名稱對不上資料庫）")
+    else:
+        print(f"🟢 共取到 {len(rag_info)} 筆 RAG 資料")
+        for i, item in enumerate(rag_info, start=1):
+            print(f"  RAG {i}: {item.get('title')} (字數 {len(item.get('content',''))})")
+
+
+def start_report_pipeline(image_bytes: bytes, tta=None) -> StagePipeline:
+    pipe = StagePipeline(_stage_pool)
+
+    # 1️⃣ 模型分類（分類一出來，top-k 候選的 RAG 查詢先開跑）
+    pipe.add("classify", lambda: predict_lesion(image_bytes, tta=tta))
+
+    speculative: Dict[str, str] = {}  # stage 名稱 → 它查的標籤（top1 填）
+
+    def pick_top1(lesion):
         top1 = lesion.get("top1", {})
         label = top1.get("label", "未知")
         conf = float(top1.get("confidence", 0.0))
-
         print(f"🔍 [Model] Top1 = {label} ({conf*100:.1f}%)")
+        for rank, cand in enumerate(lesion.get("top3", [])[:SPECULATIVE_TOPK]):
+            name = f"speculative_retrieve[{rank + 1}]"
+            speculative[name] = cand["label"]
+            if cand["label"] != label:
+                pipe.cancel(name)
+        return label, conf
+
+    pipe.add("top1", pick_top1, deps=["classify"])
+
+    # top1 先加：pool 滿的時候 top1 排在候選前面，輪到它時還在排隊的候選就取消得掉
+    def candidate(lesion, rank):
+        top3 = lesion.get("top3", [])
+        return _retrieve(top3[rank]["label"]) if rank < len(top3) else []
 
-        # 2️⃣ RAG 查詢
-        rag_info = search_knowledge(label, top_k=5)
+    for rank in range(SPECULATIVE_TOPK):
+        pipe.add(f"speculative_retrieve[{rank + 1}]",
+                 lambda lesion, rank=rank: candidate(lesion, rank), deps=["classify"])
 
-        print("\n===== 🔵 [RAG Query] =====")
-        if not rag_info:
-            print("⚠️ RAG 沒取到任何相關知識（可能是標籤名稱對不上資料庫）")
-        else:
-            print(f"🟢 共取到 {len(rag_info)} 筆 RAG 資料")
-            for i, item in enumerate(rag_info, start=1):
-                print(f"  RAG {i}: {item.get('title')} (字數 {len(item.get('content',''))})")
+    # 2️⃣ 風險評估 / RAG 查詢（top-1 一出來就並行）
+    pipe.add("risk", lambda top1: compute_risk_flag(*top1), deps=["top1"])
 
-        # 3️⃣ 建立 Prompt + 呼叫 LLM
-        prompt = build_report_prompt(lesion, rag_info, compute_risk_flag(label, conf))
+    def retrieve(top1):
+        label = top1[0]
+        for name, cand in speculative.items():
+            # cancel 成功 = 還沒開始跑，自己查；失敗 = 已經在跑或跑完，等它就好
+            if cand == label and not pipe.cancel(name):
+                return pipe.result(name)
+        return _retrieve(label)
 
+    pipe.add("retrieve", retrieve, deps=["top1"])
+
+    # 3️⃣ RAG 內容打包（去重、挑句子，控制在 token 預算內）
+    def pack(top1, rag_info):
+        _log_rag(rag_info)
+        packed, stats = pack_context(rag_info, top1[0], CONTEXT_TOKEN_BUDGET)
+        print(f"📦 RAG 打包：{stats['hits_used']}/{stats['hits_in']} 筆（重複 {stats['duplicates']}），"
+              f"句子 {stats['sentences_used']}/{stats['sentences']}，約 {stats['tokens']} tokens（預算 {stats['budget']}）")
+        return packed, stats
+
+    pipe.add("pack", pack, deps=["top1", "retrieve"])
+
+    # 4️⃣ 建立 Prompt
+    def prompt(lesion, packed, risk_flag):
+        text = build_report_prompt(lesion, packed[0], risk_flag)
+        tokens = estimate_tokens(text)
+        metrics.llm_prompt_tokens_estimated.observe(tokens, kind="report")
+        print(f"📝 Prompt：{len(text)} 字，約 {tokens} tokens")
+        return text
+
+    pipe.add("prompt", prompt, deps=["classify", "pack", "risk"])
+    return pipe
+
+
+def report_context(pipe: StagePipeline) -> Dict[str, Any]:
+    """等到 prompt 完成，把各 stage 結果整理成一個 dict"""
+    prompt = pipe.result("prompt")
+    label, conf = pipe.result("top1")
+    _, pack_stats = pipe.result("pack")
+    return {
+        "lesion": pipe.result("classify"),
+        "label": label,
+        "confidence": conf,
+        "risk_flag": pipe.result("risk"),
+        "rag": pipe.result("retrieve"),
+        "prompt": prompt,
+        "prompt_tokens": estimate_tokens(prompt),
+        "context": pack_stats,
+    }
+
+
+def _log_timings(timings: Dict[str, float]):
+    metrics.observe_timings(timings)
+    print("⏱ 各階段耗時(ms)：" + ", ".join(f"{k}={v}" for k, v in timings.items()))
+
+
+# ---------------------------
+# 主流程：影像 → RAG → LLM
+# ---------------------------
+def predict_combined(image, survey=None, tta=None):
+    """image 可為路徑、bytes 或 file-like，直接交給 predict_lesion 解碼；tta 見 lesion_model.resolve_tta"""
+    try:
+        image_bytes = read_image_bytes(image)
+        cache_key = result_cache_key(image_bytes, tta)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            print("⚡ [COMBINED] 結果快取命中，略過模型 / RAG / LLM")
+            cached["cached"] = True
+            return cached
+
+        # LLM 佇列已滿就別浪費分類 / RAG 的算力，直接讓 app.py 回 429
+        llm_admission.check(PRIORITY_REPORT)
+
+        print("\n==============================")
+        print("🔥 [COMBINED] 影像 → RAG → LLM 開始")
+        print("==============================")
+
+        pipe = start_report_pipeline(image_bytes, tta)
+        ctx = report_context(pipe)
+
+        llm_ok = False
+        t0 = time.perf_counter()
         try:
             print("\n===== 🤖 呼叫 DeepSeek =====")
-            final_text = call_llm(prompt)
+            final_text = call_llm(ctx["prompt"])
+            llm_ok = True
             print(f"✨ LLM 回應字數：{len(final_text)}")
+        except QueueFullError:
+            raise
         except Exception as err:
             print("❌ LLM 呼叫失敗：", err)
             final_text = "（LLM 回應失敗，但分類結果已產生）"
+        pipe.record("llm", (time.perf_counter() - t0) * 1000.0)
 
-        return {
-            "final_top1": label,
+        result = {
+            "final_top1": ctx["label"],
             "final_text": final_text,
-            "rag": rag_info,
-            "lesion": lesion,
+            "rag": ctx["rag"],
+            "lesion": ctx["lesion"],
         }
+        # LLM 失敗的結果不快取，下次重送還有機會成功
+        if llm_ok:
+            result_cache.put(cache_key, result)
+
+        result["timings"] = pipe.report()
+        result["prompt_tokens"] = ctx["prompt_tokens"]
+        _log_timings(result["timings"])
+        return result
 
+    except QueueFullError:
+        raise
     except Exception as e:
         print("❌ COMBINED ERROR:", e)
         return {
@@ -165,14 +476,121 @@ def predict_combined(image_path: str, survey=None):
             "rag": [],
             "lesion": {},
         }
-    
-OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
+
+
+# ---------------------------
+# 串流版主流程：分類結果先回，LLM token 邊生邊送
+# ---------------------------
+def _classification_event(lesion: Dict[str, Any], risk_flag: str, cached: bool = False) -> Dict[str, Any]:
+    return {
+        "type": "classification",
+        "top1": lesion.get("top1", {}),
+        "top3": lesion.get("top3", []),
+        "risk_flag": risk_flag,
+        "cached": cached,
+    }
+
+
+def predict_combined_stream(image, survey=None, tta=None) -> Iterator[Dict[str, Any]]:
+    """
+    依序 yield 事件（app.py 轉成一行一個 JSON）：
+      {"type": "classification", top1, top3, risk_flag}
+      {"type": "rag", "titles": [...]}
+      {"type": "think" | "token", "text": ...}   ← DeepSeek 每吐一段就送一段
+      {"type": "error", "message": ...}           ← LLM 失敗時
+      {"type": "done", "top1": ..., "report": 完整全文, "prompt_tokens": 估計的 prompt token 數}
+    """
+    image_bytes = read_image_bytes(image)
+    cache_key = result_cache_key(image_bytes, tta)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        print("⚡ [COMBINED-STREAM] 結果快取命中")
+        lesion = cached.get("lesion", {})
+        top1 = lesion.get("top1", {})
+        risk_flag = compute_risk_flag(top1.get("label", "未知"), float(top1.get("confidence", 0.0)))
+        yield _classification_event(lesion, risk_flag, cached=True)
+        splitter = ThinkSplitter()
+        for kind, text in splitter.feed(cached.get("final_text", "")) + splitter.flush():
+            yield {"type": kind, "text": text}
+        yield {"type": "done", "top1": cached.get("final_top1"), "report": cached.get("final_text", "")}
+        return
+
+    print("\n==============================")
+    print("🔥 [COMBINED-STREAM] 影像 → RAG → LLM 開始")
+    print("==============================")
+
+    # 分類 + 風險一好就先送，RAG / prompt 繼續在背景跑
+    pipe = start_report_pipeline(image_bytes, tta)
+    yield _classification_event(pipe.result("classify"), pipe.result("risk"))
+
+    ctx = report_context(pipe)
+    yield {"type": "rag", "titles": [item.get("title") for item in ctx["rag"]]}
+
+    # raw 保留 <think> 標籤原文，快取內容才會跟非串流版 call_llm 的回傳一致
+    raw: List[str] = []
+    splitter = ThinkSplitter()
+    llm_ok = False
+    t0 = time.perf_counter()
+    try:
+        for chunk in stream_llm(ctx["prompt"], LLM_MODEL, temperature=0.7):
+            raw.append(chunk)
+            for kind, text in splitter.feed(chunk):
+                yield {"type": kind, "text": text}
+        for kind, text in splitter.flush():
+            yield {"type": kind, "text": text}
+        llm_ok = True
+    except QueueFullError as err:
+        print("⏳ LLM 佇列已滿：", err)
+        yield {
+            "type": "error",
+            "message": str(err),
+            "retry_after": err.retry_after,
+            "estimated_wait": err.estimated_wait,
+        }
+    except Exception as err:
+        print("❌ LLM 串流失敗：", err)
+        yield {"type": "error", "message": str(err)}
+
+    pipe.record("llm", (time.perf_counter() - t0) * 1000.0)
+
+    final_text = "".join(raw) if llm_ok else "（LLM 回應失敗，但分類結果已產生）"
+    print(f"✨ LLM 串流完成，字數：{len(final_text)}")
+
+    if llm_ok:
+        result_cache.put(cache_key, {
+            "final_top1": ctx["label"],
+            "final_text": final_text,
+            "rag": ctx["rag"],
+            "lesion": ctx["lesion"],
+        })
+    timings = pipe.report()
+    _log_timings(timings)
+    yield {"type": "done", "top1": ctx["label"], "report": final_text, "timings": timings,
+           "prompt_tokens": ctx["prompt_tokens"]}
+
+
 def ask_llm(prompt: str) -> str:
     payload = {
         "model": "deepseek-r1:14b",
         "prompt": prompt,
         "stream": False
     }
-    res = requests.post(OLLAMA_URL, json=payload)
-    result = res.json()
-    return result.get("response") or "（LLM 無回覆）"
+    # 聊天優先序低於報告；以前沒有 timeout，Ollama 卡住會整條 thread 掛著
+    try:
+        with llm_admission.slot(PRIORITY_CHAT):
+            res = requests.post(OLLAMA_URL, json=payload, timeout=300)
+        result = res.json()
+    except QueueFullError:
+        metrics.record_llm_failure("chat", "rejected")
+        raise
+    except Exception:
+        metrics.record_llm_failure("chat")
+        raise
+    answer = result.get("response") or ""
+    metrics.record_llm("chat", len(prompt), len(answer), result)
+    return answer or "（LLM 無回覆）"
+
+
+def ask_llm_stream(prompt: str) -> Iterator[Tuple[str, str]]:
+    """ask_llm 的串流版，yield (kind, text)，kind 為 "think" 或 "token" """
+    return stream_llm_events(prompt, "deepseek-r1:14b", priority=PRIORITY_CHAT)
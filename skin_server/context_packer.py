@@ -0,0 +1,205 @@
+# context_packer.py
+# 報告 prompt 的 RAG 內容打包：
+#   以前 5 筆 RAG 結果整段貼進 prompt，每段最長 8192 字，prompt 動輒好幾萬字，DeepSeek 的 prefill 比生成還久。
+#   這裡在 token 預算內挑句子：
+#     1. 重複 / 高度重疊的結果只留一筆（同網址的短條目常常是長文的摘要）
+#     2. 結果依檢索分數 + 標題跟標籤的相關度排序
+#     3. 每筆拆成句子，依「跟標籤的相關度、對應到報告哪一段（簡介 / 症狀 / 風險 / 照護 / 就醫）、結果排名」打分
+#     4. 先讓報告的每一段都拿到最相關的一句，剩下的預算照分數填，超過預算就停
+#     5. 選到的句子照原文順序放回各自的結果
+#
+# token 數用估的（中日韓字一字約一 token，其他約 4 字元一 token），實際數字看 Ollama 回的 prompt_eval_count。
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from label_index import candidate_keys, normalize_term
+
+# RAG 內容的 token 預算；0 = 不打包，整段照貼（舊行為）
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "2000"))
+
+# 報告要求的五段，各段的關鍵字（句子命中越多越算那一段的素材）
+SECTION_KEYWORDS = {
+    "intro": ("是一種", "是指", "屬於", "定義", "簡介", "概述", "常見於", "好發"),
+    "symptoms": ("症狀", "表現", "外觀", "特徵", "出現", "紅", "癢", "丘疹", "斑", "皮疹", "水皰", "脫屑", "病灶"),
+    "risk": ("原因", "引起", "風險", "危險", "因素", "併發", "惡化", "遺傳", "感染", "癌"),
+    "care": ("治療", "照護", "保濕", "清潔", "避免", "藥", "乳膏", "預防", "管理", "防曬"),
+    "referral": ("就醫", "醫師", "醫生", "診斷", "檢查", "切片", "轉診", "預後", "追蹤", "立即"),
+}
+
+# 一句最長幾個字（爬下來的內文常常整段沒有句號）
+MAX_SENTENCE_CHARS = 240
+# 兩筆結果的字元 3-gram 重疊超過這個比例就當成重複
+DUP_OVERLAP = 0.8
+
+_CJK = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]")
+# 句尾標點、換行；爬下來的條列常常只用空白隔開，中文字之間的空白也當成斷句
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?;])|(?<=\. )|\n+|(?<=[：:])\s+|(?<=[\u4e00-\u9fff）」])\s+(?=[\u4e00-\u9fff（「])")
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def split_sentences(text: str) -> List[str]:
+    out = []
+    for part in _SENTENCE_END.split(text or ""):
+        part = part.strip()
+        while len(part) > MAX_SENTENCE_CHARS:
+            out.append(part[:MAX_SENTENCE_CHARS])
+            part = part[MAX_SENTENCE_CHARS:].strip()
+        if len(part) >= 2:
+            out.append(part)
+    return out
+
+
+def _shingles(text: str, n: int = 3) -> set:
+    key = normalize_term(text)
+    return {key[i:i + n] for i in range(max(len(key) - n + 1, 1))}
+
+
+def _overlap(a: set, b: set) -> float:
+    """小的那筆有多少比例出現在大的那筆裡（短摘要被長文包含也算重複）"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def _label_terms(label: str) -> Tuple[List[str], set]:
+    """標籤拆成可比對的詞（Acne / 痤瘡 / 青春痘…）+ 中文字 bigram"""
+    terms = [k for k in candidate_keys(label) if len(k) >= 2]
+    bigrams = set()
+    for k in terms:
+        bigrams |= {k[i:i + 2] for i in range(len(k) - 1)}
+    return terms, bigrams
+
+
+def _relevance(text: str, terms: List[str], bigrams: set) -> float:
+    key = normalize_term(text)
+    if not key:
+        return 0.0
+    if any(t in key for t in terms):
+        return 1.0
+    if not bigrams:
+        return 0.0
+    hit = sum(1 for b in bigrams if b in key)
+    return 0.8 * hit / len(bigrams)
+
+
+def _section(sentence: str) -> Tuple[Optional[str], int]:
+    best, best_n = None, 0
+    for name, words in SECTION_KEYWORDS.items():
+        n = sum(1 for w in words if w in sentence)
+        if n > best_n:
+            best, best_n = name, n
+    return best, best_n
+
+
+def dedupe_hits(hits: List[Dict]) -> Tuple[List[Dict], int]:
+    kept, kept_sh, dropped = [], [], 0
+    for h in hits:
+        sh = _shingles(h.get("content") or h.get("title") or "")
+        if any(_overlap(sh, other) >= DUP_OVERLAP for other in kept_sh):
+            dropped += 1
+            continue
+        kept.append(h)
+        kept_sh.append(sh)
+    return kept, dropped
+
+
+def _join(sentences) -> str:
+    """句子接回一段：沒有句尾標點的補「。」，英文句子之間留空白"""
+    out = []
+    for s in sentences:
+        if not s.endswith(("。", "！", "？", "；", "：", ".", "!", "?", ";", ":")):
+            s += "。"
+        out.append(s + " " if s[-1] in ".!?;" else s)
+    return "".join(out).strip()
+
+
+def _header(i: int, hit: Dict) -> str:
+    return f"【資料 {i}：{hit.get('title') or '未命名條目'}】\n來源連結：{hit.get('url') or ''}\n"
+
+
+def pack_context(hits: List[Dict], label: str, budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[List[Dict], Dict]:
+    """
+    回傳 (打包後的 hits, 統計)；打包後每筆的 content 只剩選到的句子。
+    budget <= 0 時原封不動。
+    """
+    stats = {"hits_in": len(hits), "hits_used": len(hits), "duplicates": 0,
+             "sentences": 0, "sentences_used": 0, "tokens": 0, "budget": budget}
+    if budget <= 0 or not hits:
+        stats["tokens"] = sum(estimate_tokens(_header(i, h)) + estimate_tokens(h.get("content") or "")
+                              for i, h in enumerate(hits, start=1))
+        return [dict(h) for h in hits], stats
+
+    # 長的排前面去重：短條目被長文包含時留長文
+    ordered = sorted(hits, key=lambda h: len(h.get("content") or ""), reverse=True)
+    unique, stats["duplicates"] = dedupe_hits(ordered)
+
+    terms, bigrams = _label_terms(label)
+    ranked = sorted(
+        unique,
+        key=lambda h: float(h.get("score") or 0.0) + 0.5 * _relevance(h.get("title") or "", terms, bigrams),
+        reverse=True,
+    )
+
+    # 每句：(分數, 第幾筆結果, 第幾句, 句子, 段落, token)
+    candidates = []
+    seen = set()
+    for rank, hit in enumerate(ranked):
+        weight = 1.0 / (1.0 + 0.5 * rank)
+        for pos, sent in enumerate(split_sentences(hit.get("content") or "")):
+            key = normalize_term(sent)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            section, n_kw = _section(sent)
+            score = weight * (1.0 + 2.0 * _relevance(sent, terms, bigrams) + 0.3 * min(n_kw, 3)
+                              + 0.5 / (1 + pos))
+            candidates.append((score, rank, pos, sent, section, estimate_tokens(sent) + 1))
+    stats["sentences"] = len(candidates)
+
+    chosen: Dict[int, List[Tuple[int, str]]] = {}
+    used = [0]
+
+    def take(c) -> bool:
+        _, rank, pos, sent, _, cost = c
+        if rank not in chosen:
+            cost += estimate_tokens(_header(len(chosen) + 1, ranked[rank]))
+        if used[0] + cost > budget:
+            return False
+        chosen.setdefault(rank, []).append((pos, sent))
+        used[0] += cost
+        return True
+
+    by_score = sorted(candidates, key=lambda c: c[0], reverse=True)
+    picked = set()
+    # 先讓報告每一段都有素材
+    for section in SECTION_KEYWORDS:
+        for idx, c in enumerate(by_score):
+            if c[4] == section and idx not in picked:
+                if take(c):
+                    picked.add(idx)
+                break
+    # 剩下的預算照分數填
+    for idx, c in enumerate(by_score):
+        if idx in picked:
+            continue
+        if take(c):
+            picked.add(idx)
+        elif used[0] >= budget * 0.98:
+            break
+
+    packed = []
+    for rank in sorted(chosen):
+        hit = dict(ranked[rank])
+        hit["content"] = _join(s for _, s in sorted(chosen[rank]))
+        packed.append(hit)
+
+    stats.update(hits_used=len(packed), sentences_used=len(picked), tokens=used[0])
+    return packed, stats
@@ -0,0 +1,330 @@
+# embedding_cache.py
+# BGE-m3 向量的持久化快取（build_dermnet_index.py 跟 rag_milvus 共用）：
+#   key = sha256(模型名稱 + 文字)，同一段文字只要 embed 過一次，重建索引 / 重啟伺服器都直接讀檔。
+#
+# 目錄結構：
+#   meta.json                  {"model", "dim", "generation"}；壓縮後換新一代
+#   vectors-<gen>.f32          只會往後加的 float32 陣列（N, dim），用 memmap 讀
+#   index-<gen>.log            一行一筆 "key slot"，也是只往後加
+#
+# 多個行程（builder、prefork 的多個 worker）可以同時用：寫入時拿檔案鎖，
+# 讀的時候發現 log 變長就把新的幾行讀進來。筆數超過 max_entries 就壓縮成最近用到的 3/4。
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# builder 跟伺服器都在 skin_server 底下跑，預設讀寫同一個資料夾；EMBED_CACHE_DIR 設成空字串 = 關閉
+EMBED_CACHE_DIR = os.environ.get("EMBED_CACHE_DIR", "embed_cache")
+EMBED_CACHE_SIZE = int(os.environ.get("EMBED_CACHE_SIZE", "200000"))
+
+META_FILE = "meta.json"
+LOCK_FILE = "lock"
+
+
+class _FileLock:
+    """跨行程的互斥鎖（Linux 用 fcntl，Windows 用 msvcrt）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.path, "a+b")
+        try:
+            import fcntl
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        except ImportError:
+            import msvcrt
+            self._f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            import fcntl
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+        except ImportError:
+            import msvcrt
+            self._f.seek(0)
+            msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+        self._f.close()
+        self._f = None
+
+
+def text_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir: str, model_name: str, dim: int, max_entries: int = 200_000):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._file_lock = _FileLock(os.path.join(cache_dir, LOCK_FILE))
+        self._slots: Dict[str, int] = {}
+        self._last_used: Dict[str, int] = {}
+        self._tick = 0
+        self._generation: Optional[str] = None
+        self._log_pos = 0
+        self._mm: Optional[np.memmap] = None
+        self._meta_mtime = None
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.compactions = 0
+
+        with self._lock, self._file_lock:
+            self._load_meta(create=True)
+
+    # -----------------------------
+    # 檔案 / generation
+    # -----------------------------
+    def _paths(self, gen: str):
+        return (os.path.join(self.cache_dir, f"vectors-{gen}.f32"),
+                os.path.join(self.cache_dir, f"index-{gen}.log"))
+
+    def _write_meta(self, gen: str):
+        tmp_path = os.path.join(self.cache_dir, META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "generation": gen}, f)
+        os.replace(tmp_path, os.path.join(self.cache_dir, META_FILE))
+
+    def _load_meta(self, create: bool = False):
+        """讀 meta.json；generation 變了（別的行程壓縮過）就整份重讀。呼叫端持有 self._lock"""
+        meta_path = os.path.join(self.cache_dir, META_FILE)
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("model") != self.model_name or meta.get("dim") != self.dim:
+                if not create:
+                    return
+                print(f"⚠️ embedding 快取的模型不同（{meta.get('model')}），重新開一份")
+                meta = None
+        if meta is None:
+            if not create:
+                return
+            gen = uuid.uuid4().hex[:12]
+            for p in self._paths(gen):
+                open(p, "ab").close()
+            self._write_meta(gen)
+            meta = {"generation": gen}
+
+        self._meta_mtime = os.stat(meta_path).st_mtime_ns
+        if meta["generation"] != self._generation:
+            self._generation = meta["generation"]
+            self._slots.clear()
+            self._last_used.clear()
+            self._log_pos = 0
+            self._mm = None
+        self._read_log()
+
+    def _read_log(self):
+        """把 index log 新增的部分讀進來"""
+        _, log_path = self._paths(self._generation)
+        try:
+            size = os.path.getsize(log_path)
+        except OSError:
+            return
+        if size <= self._log_pos:
+            return
+        with open(log_path, "rb") as f:
+            f.seek(self._log_pos)
+            data = f.read(size - self._log_pos)
+        # 只處理完整的行（另一個行程可能正寫到一半）
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            parts = line.split()
+            if len(parts) == 2:
+                key = parts[0].decode("ascii")
+                self._slots[key] = int(parts[1])
+                self._last_used.setdefault(key, 0)
+        self._log_pos += end
+
+    def _refresh(self):
+        meta_path = os.path.join(self.cache_dir, META_FILE)
+        try:
+            mtime = os.stat(meta_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._meta_mtime:
+            self._load_meta()
+        else:
+            self._read_log()
+
+    def _vectors(self, need_rows: int) -> np.memmap:
+        if self._mm is None or self._mm.shape[0] < need_rows:
+            vec_path, _ = self._paths(self._generation)
+            rows = os.path.getsize(vec_path) // (self.dim * 4)
+            self._mm = np.memmap(vec_path, dtype=np.float32, mode="r", shape=(rows, self.dim)) if rows else None
+        return self._mm
+
+    # -----------------------------
+    # 查 / 寫
+    # -----------------------------
+    def _lookup(self, keys: List[str]):
+        slots = [self._slots.get(k) for k in keys]
+        found = [s for s in slots if s is not None]
+        return slots, (self._vectors(max(found) + 1) if found else None)
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        keys = [text_key(self.model_name, t) for t in texts]
+        out: List[Optional[np.ndarray]] = [None] * len(texts)
+        with self._lock:
+            if any(k not in self._slots for k in keys):
+                self._refresh()
+            try:
+                slots, mm = self._lookup(keys)
+            except OSError:
+                # 別的行程壓縮過、舊一代的檔案已經刪了：換到新一代重查一次，還是不行就當沒快取
+                try:
+                    self._load_meta()
+                    slots, mm = self._lookup(keys)
+                except OSError as e:
+                    print("⚠️ embedding 快取讀取失敗，當成沒快取：", e)
+                    slots, mm = [None] * len(keys), None
+            for i, (k, slot) in enumerate(zip(keys, slots)):
+                if slot is None or mm is None or slot >= mm.shape[0]:
+                    self.misses += 1
+                    continue
+                out[i] = np.array(mm[slot])
+                self._tick += 1
+                self._last_used[k] = self._tick
+                self.hits += 1
+        return out
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+        with self._lock, self._file_lock:
+            self._refresh()
+            vec_path, log_path = self._paths(self._generation)
+            base = os.path.getsize(vec_path) // (self.dim * 4)
+            rows, lines = [], []
+            for t, v in zip(texts, vectors):
+                k = text_key(self.model_name, t)
+                if k in self._slots:
+                    continue
+                slot = base + len(rows)
+                self._slots[k] = slot
+                self._tick += 1
+                self._last_used[k] = self._tick
+                rows.append(v)
+                lines.append(f"{k} {slot}\n")
+            if not rows:
+                return
+            # 先寫向量再寫 index，讀的人看到 index 時向量一定已經在檔案裡
+            with open(vec_path, "ab") as f:
+                f.write(np.stack(rows).tobytes())
+            with open(log_path, "a", encoding="ascii") as f:
+                f.write("".join(lines))
+            self._log_pos = os.path.getsize(log_path)
+            self.writes += len(rows)
+
+            if len(self._slots) > self.max_entries:
+                self._compact()
+
+    def _compact(self):
+        """只留最近用到的 3/4（本行程的使用紀錄；其他的照寫入順序）。呼叫端持有兩把鎖"""
+        keep_n = max(1, self.max_entries * 3 // 4)
+        ranked = sorted(self._slots.items(), key=lambda kv: (self._last_used.get(kv[0], 0), kv[1]), reverse=True)
+        keep = sorted(ranked[:keep_n], key=lambda kv: kv[1])
+
+        old_gen = self._generation
+        mm = self._vectors(max(s for _, s in keep) + 1)
+        gen = uuid.uuid4().hex[:12]
+        vec_path, log_path = self._paths(gen)
+        with open(vec_path, "wb") as vf, open(log_path, "w", encoding="ascii") as lf:
+            for new_slot, (k, slot) in enumerate(keep):
+                vf.write(np.asarray(mm[slot], dtype=np.float32).tobytes())
+                lf.write(f"{k} {new_slot}\n")
+        self._write_meta(gen)
+
+        self._mm = None
+        last_used = {k: self._last_used.get(k, 0) for k, _ in keep}
+        self._generation = None
+        self._load_meta()
+        self._last_used.update(last_used)
+        self.compactions += 1
+        print(f"🧹 embedding 快取壓縮：{len(ranked)} → {len(keep)} 筆")
+
+        for p in self._paths(old_gen):
+            try:
+                os.remove(p)
+            except OSError:
+                pass  # Windows 上別的行程還 mmap 著，下次再說
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "dir": self.cache_dir,
+                "model": self.model_name,
+                "entries": len(self._slots),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "writes": self.writes,
+                "compactions": self.compactions,
+            }
+
+
+def encode_cached(cache: Optional[EmbeddingCache], texts: Sequence[str],
+                  encode_fn: Callable[[List[str]], np.ndarray], dim: int) -> np.ndarray:
+    """先查快取，只把沒算過的文字交給 encode_fn，算完寫回；回傳 (len(texts), dim)"""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    if not texts:
+        return out
+    if cache is None:
+        out[:] = encode_fn(list(texts))
+        return out
+
+    try:
+        cached = cache.get_many(texts)
+    except Exception as e:
+        # 快取是選用的，壞掉就全部重算，不能讓檢索跟著失敗
+        print("⚠️ embedding 快取查詢失敗，改成不快取：", e)
+        cached = [None] * len(texts)
+    missing = [i for i, v in enumerate(cached) if v is None]
+    for i, v in enumerate(cached):
+        if v is not None:
+            out[i] = v
+    if missing:
+        # 同一批裡重複的文字只算一次
+        uniq = list(dict.fromkeys(texts[i] for i in missing))
+        vecs = np.asarray(encode_fn(uniq), dtype=np.float32)
+        try:
+            cache.put_many(uniq, vecs)
+        except Exception as e:
+            print("⚠️ embedding 快取寫入失敗：", e)
+        by_text = dict(zip(uniq, vecs))
+        for i in missing:
+            out[i] = by_text[texts[i]]
+    return out
+
+
+def open_default_cache(model_name: str, dim: int) -> Optional[EmbeddingCache]:
+    if not EMBED_CACHE_DIR:
+        return None
+    try:
+        return EmbeddingCache(EMBED_CACHE_DIR, model_name, dim, EMBED_CACHE_SIZE)
+    except Exception as e:
+        print("⚠️ embedding 快取開啟失敗，改成不快取：", e)
+        return None
@@ -0,0 +1,189 @@
+# export_lesion_model.py
+# 從 best_model.pth 匯出各種推論後端 + 校正 + 跟 fp32 比對 top-1 一致率
+#
+# 用法：
+#   python export_lesion_model.py --backends torchscript int8_static onnx onnx_int8 \
+#       --calib-dir D:\data\train --val-dir D:\data\val1
+#
+# 匯出的檔案放在 checkpoint 旁邊（best_model.onnx、best_model.int8_static.pt ...），
+# 伺服器用 LESION_BACKEND=<名稱> 切換。報告同時印出來並寫成 JSON。
+
+import argparse
+import json
+import os
+import random
+import time
+
+import torch
+
+from lesion_backends import (
+    BACKENDS, artifact_path, load_backend, load_eager_model, write_artifact_meta,
+    to_torchscript, to_int8_static, export_onnx, quantize_onnx,
+)
+from lesion_model import preprocess_image
+
+CPU = torch.device("cpu")
+
+
+# -----------------------------
+# 1. 找圖片（資料夾結構同 ImageFolder：<類別>/<圖>）
+# -----------------------------
+def list_images(folder, limit, seed=42):
+    all_imgs = []
+    for root, dirs, files in os.walk(folder):
+        for f in files:
+            if f.lower().endswith((".jpg", ".jpeg", ".png")):
+                all_imgs.append(os.path.join(root, f))
+    all_imgs.sort()
+    if limit and len(all_imgs) > limit:
+        all_imgs = random.Random(seed).sample(all_imgs, limit)
+    return all_imgs
+
+
+def iter_batches(paths, batch_size=16):
+    # 跟伺服器同一條前處理（LESION_FAST_DECODE 開了就是 fast_preprocess），比對的才是實際會送進模型的輸入
+    for i in range(0, len(paths), batch_size):
+        chunk = paths[i:i + batch_size]
+        yield torch.stack([preprocess_image(p) for p in chunk]), chunk
+
+
+# -----------------------------
+# 2. 匯出
+# -----------------------------
+def export(backend, model, classes, model_name, ckpt_path, calib_paths):
+    if backend in ("eager", "int8_dynamic", "optimized"):
+        print(f"ℹ️ {backend} 在載入時直接建立，不需要匯出")
+        return
+
+    t0 = time.perf_counter()
+    if backend == "torchscript":
+        path = artifact_path(ckpt_path, backend)
+        torch.jit.save(to_torchscript(model), path)
+    elif backend == "int8_static":
+        path = artifact_path(ckpt_path, backend)
+        print(f"🎯 靜態量化校正：{len(calib_paths)} 張")
+        calib = (x for x, _ in iter_batches(calib_paths))
+        torch.jit.save(to_int8_static(model, calib), path)
+    elif backend == "onnx":
+        path = artifact_path(ckpt_path, backend)
+        export_onnx(model, path)
+    else:  # onnx_int8
+        src = artifact_path(ckpt_path, "onnx")
+        if not os.path.exists(src):
+            export_onnx(model, src)
+            write_artifact_meta(src, classes, model_name, ckpt_path)
+        path = artifact_path(ckpt_path, backend)
+        quantize_onnx(src, path)
+
+    write_artifact_meta(path, classes, model_name, ckpt_path)
+    size_mb = os.path.getsize(path) / 1e6
+    print(f"✅ {backend} → {path}（{size_mb:.1f} MB，{time.perf_counter() - t0:.1f}s）")
+
+
+# -----------------------------
+# 3. 跟 fp32 比對
+# -----------------------------
+@torch.inference_mode()
+def run_all(runner, paths, batch_size):
+    probs, elapsed = [], 0.0
+    for x, _ in iter_batches(paths, batch_size):
+        t0 = time.perf_counter()
+        logits = runner(x)
+        elapsed += time.perf_counter() - t0
+        probs.append(torch.softmax(logits.float(), dim=1))
+    return torch.cat(probs), elapsed
+
+
+def evaluate(backends, ckpt_path, val_paths, classes, batch_size):
+    labels = [os.path.basename(os.path.dirname(p)) for p in val_paths]
+    gt = [classes.index(l) if l in classes else -1 for l in labels]
+    has_gt = any(g >= 0 for g in gt)
+
+    ref_runner, _ = load_backend("eager", ckpt_path, CPU)
+    ref_probs, ref_time = run_all(ref_runner, val_paths, batch_size)
+    ref_top1 = ref_probs.argmax(dim=1)
+
+    report = {}
+    for backend in ["eager"] + [b for b in backends if b != "eager"]:
+        if backend == "eager":
+            probs, elapsed = ref_probs, ref_time
+        else:
+            try:
+                runner, _ = load_backend(backend, ckpt_path, CPU)
+            except Exception as e:
+                print(f"❌ {backend} 載入失敗：{e}")
+                report[backend] = {"error": str(e)}
+                continue
+            probs, elapsed = run_all(runner, val_paths, batch_size)
+
+        top1 = probs.argmax(dim=1)
+        row = {
+            "images": len(val_paths),
+            "top1_agreement_vs_fp32": round((top1 == ref_top1).float().mean().item(), 4),
+            "max_prob_diff_vs_fp32": round((probs - ref_probs).abs().max().item(), 4),
+            "ms_per_image": round(elapsed / max(1, len(val_paths)) * 1000.0, 2),
+        }
+        if has_gt:
+            mask = torch.tensor([g >= 0 for g in gt])
+            target = torch.tensor([max(g, 0) for g in gt])
+            row["accuracy"] = round((top1[mask] == target[mask]).float().mean().item(), 4)
+        report[backend] = row
+
+    print("\n=== 後端比對（以 fp32 eager 為基準）===")
+    for backend, row in report.items():
+        if "error" in row:
+            print(f"{backend:13s} | 失敗：{row['error']}")
+            continue
+        acc = f" | acc {row['accuracy']:.4f}" if "accuracy" in row else ""
+        print(f"{backend:13s} | top-1 一致 {row['top1_agreement_vs_fp32']:.4f} "
+              f"| 最大機率差 {row['max_prob_diff_vs_fp32']:.4f} "
+              f"| {row['ms_per_image']:.2f} ms/張{acc}")
+    return report
+
+
+# -----------------------------
+# 4. 主流程
+# -----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="匯出 ConvNeXt 推論後端並比對 fp32")
+    parser.add_argument("--ckpt", default="best_model.pth")
+    parser.add_argument("--backends", nargs="+", default=["torchscript", "int8_dynamic"],
+                        choices=BACKENDS)
+    parser.add_argument("--calib-dir", help="靜態量化校正用圖片資料夾")
+    parser.add_argument("--calib-size", type=int, default=200)
+    parser.add_argument("--val-dir", help="比對用圖片資料夾（<類別>/<圖> 的話會順便算準確率）")
+    parser.add_argument("--max-images", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--report", default="export_report.json")
+    args = parser.parse_args()
+
+    ckpt = torch.load(args.ckpt, map_location=CPU)
+    model_name = ckpt["model_name"]
+    del ckpt
+    model, classes = load_eager_model(args.ckpt, CPU)
+    print(f"📦 {args.ckpt}：{model_name}，{len(classes)} 類")
+
+    calib_paths = list_images(args.calib_dir, args.calib_size) if args.calib_dir else []
+    for backend in args.backends:
+        try:
+            export(backend, model, classes, model_name, args.ckpt, calib_paths)
+        except Exception as e:
+            print(f"❌ {backend} 匯出失敗：{e}")
+
+    if not args.val_dir:
+        print("\n（沒有指定 --val-dir，略過 top-1 一致率比對）")
+        return
+
+    val_paths = list_images(args.val_dir, args.max_images)
+    if not val_paths:
+        print(f"❌ {args.val_dir} 底下沒有找到圖片")
+        return
+
+    report = evaluate(args.backends, args.ckpt, val_paths, classes, args.batch_size)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump({"checkpoint": args.ckpt, "results": report}, f, ensure_ascii=False, indent=2)
+    print(f"\n📝 報告已寫入 {args.report}")
+
+
+if __name__ == "__main__":
+    main()
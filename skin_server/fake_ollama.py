@@ -0,0 +1,90 @@
+# fake_ollama.py
+# 壓測用的假 Ollama：只實作 /api/generate，照設定的 token 速率吐字，
+# stream=True 回一行一個 JSON、stream=False 等全部「生成」完才回，欄位跟真的 Ollama 一樣
+# （含 eval_count / eval_duration），不用 GPU、不用真的 DeepSeek。
+#
+# 單獨啟動：python fake_ollama.py --port 11435 --token-rate 30 --tokens 300
+
+import argparse
+import json
+import time
+
+from flask import Flask, Response, jsonify, request
+
+THINK_TOKENS = ["<think>", "先", "整理", "一下", "資料", "。", "</think>"]
+BODY_TOKENS = ["一、", "簡介", "：", "此類", "病灶", "多為", "良性", "，", "建議", "持續", "觀察", "。", "\n"]
+
+
+def create_app(token_rate: float = 30.0, num_tokens: int = 300, prefill_ms: float = 200.0,
+               think: bool = True) -> Flask:
+    app = Flask(__name__)
+
+    def tokens():
+        out = list(THINK_TOKENS) if think else []
+        i = 0
+        while len(out) < num_tokens:
+            out.append(BODY_TOKENS[i % len(BODY_TOKENS)])
+            i += 1
+        return out
+
+    def meta(prompt: str, n: int, started: float, eval_started: float):
+        now = time.perf_counter()
+        return {
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((now - started) * 1e9),
+            "prompt_eval_count": len(prompt),
+            "prompt_eval_duration": int((eval_started - started) * 1e9),
+            "eval_count": n,
+            "eval_duration": int((now - eval_started) * 1e9),
+        }
+
+    @app.route("/api/generate", methods=["POST"])
+    def generate():
+        data = request.get_json(force=True) or {}
+        prompt = data.get("prompt", "")
+        model = data.get("model", "fake")
+        toks = tokens()
+        interval = 1.0 / token_rate if token_rate > 0 else 0.0
+
+        started = time.perf_counter()
+        time.sleep(prefill_ms / 1000.0)
+        eval_started = time.perf_counter()
+
+        if not data.get("stream", True):
+            time.sleep(interval * len(toks))
+            body = {"model": model, "response": "".join(toks)}
+            body.update(meta(prompt, len(toks), started, eval_started))
+            return jsonify(body)
+
+        def gen():
+            for t in toks:
+                time.sleep(interval)
+                yield json.dumps({"model": model, "response": t, "done": False}, ensure_ascii=False) + "\n"
+            last = {"model": model, "response": ""}
+            last.update(meta(prompt, len(toks), started, eval_started))
+            yield json.dumps(last) + "\n"
+
+        return Response(gen(), mimetype="application/x-ndjson")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="壓測用假 Ollama /api/generate")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-rate", type=float, default=30.0, help="每秒吐幾個 token")
+    parser.add_argument("--tokens", type=int, default=300, help="每次回覆幾個 token")
+    parser.add_argument("--prefill-ms", type=float, default=200.0, help="吐第一個 token 前的延遲")
+    parser.add_argument("--no-think", action="store_true", help="不輸出 <think> 區段")
+    args = parser.parse_args()
+
+    app = create_app(args.token_rate, args.tokens, args.prefill_ms, think=not args.no_think)
+    print(f"🤖 假 Ollama 啟動：http://{args.host}:{args.port}/api/generate "
+          f"（{args.token_rate} tok/s，{args.tokens} tokens）")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# fast_preprocess.py
+# 分類器的快速前處理：手機拍的圖動輒 12～50 MP，原本 Image.open().convert("RGB") 會把整張解碼成全解析度，
+# 再讓 transforms.Resize((224, 224)) 縮一次，模型只要 224×224，大部分 CPU 都花在解碼跟縮圖。
+#
+#   1. JPEG 用 draft 模式：libjpeg 直接在 DCT 階段縮 1/2、1/4、1/8 解碼，
+#      只縮到「還至少是 224 × DRAFT_FACTOR」，剩下交給 PIL 的 antialias resize，結果跟全解析度縮下來幾乎一樣
+#   2. EXIF 方向：手機直拍的照片像素是橫的、靠 Orientation 標籤轉正，沒轉的話 Resize((224, 224)) 會把病灶壓扁成另一個方向
+#   3. resize 完的 uint8 直接轉 float + normalize 寫進呼叫端給的 tensor
+#      （批次端點一次配好 (N, 3, 224, 224)，各張直接寫進自己那一格，不用最後再 stack）
+#
+# 跟訓練 / 原本伺服器的 transform（Resize((224, 224)) → ToTensor → Normalize）對齊：
+#   PIL 對 PIL 圖做 bilinear resize 本來就有 antialias，torchvision 的 Resize 對 PIL 圖也是呼叫同一個 resize，
+#   差別只在 draft 先縮過一次。一致性用 bench_preprocess.py 量。
+
+import io
+import os
+
+import numpy as np
+import torch
+from PIL import Image, ImageOps
+
+IMAGE_SIZE = 224
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+# draft 最少保留幾倍的目標解析度再交給 resize；0 = 不用 draft（全解析度解碼）
+DRAFT_FACTOR = int(os.environ.get("LESION_DRAFT_FACTOR", "2"))
+# 照 EXIF Orientation 轉正（訓練資料大多沒有這個標籤，手機上傳的幾乎都有）
+EXIF_TRANSPOSE = os.environ.get("LESION_EXIF_TRANSPOSE", "1") == "1"
+
+# x_norm = x_uint8 * SCALE - SHIFT，ToTensor（/255）跟 Normalize 併成一次 mul + sub
+_SCALE = torch.tensor([1.0 / (255.0 * s) for s in STD]).view(3, 1, 1)
+_SHIFT = torch.tensor([m / s for m, s in zip(MEAN, STD)]).view(3, 1, 1)
+
+def load_resized(image, size: int = IMAGE_SIZE, draft_factor: int = DRAFT_FACTOR,
+                 exif_transpose: bool = EXIF_TRANSPOSE) -> Image.Image:
+    """
+    image 可以是路徑、bytes 或 file-like；回傳 size×size 的 RGB PIL 圖
+    （跟 Resize((size, size)) 一樣不保持長寬比，訓練時就是這樣縮的）
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    img = Image.open(image)
+    if img.format == "JPEG" and draft_factor > 0:
+        # draft 只會選 1/2、1/4、1/8，而且保證解出來不小於要求的大小
+        target = size * draft_factor
+        img.draft("RGB", (target, target))
+    if exif_transpose:
+        img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return img.resize((size, size), Image.BILINEAR)
+
+
+def to_tensor_into(img: Image.Image, out: torch.Tensor) -> torch.Tensor:
+    """uint8 RGB 圖 → normalize 後的 (3, H, W) float，寫進 out（out 可以是大 batch tensor 的一格）"""
+    # np.asarray(PIL 圖) 是唯讀的，不經過 torch.from_numpy（會警告）：
+    # 直接用 numpy 把 uint8 轉 float 寫進 out 的 (H, W, 3) view，一次搬完
+    np.copyto(out.numpy().transpose(1, 2, 0), np.asarray(img), casting="unsafe")
+    out.mul_(_SCALE).sub_(_SHIFT)
+    return out
+
+
+def preprocess(image, out: torch.Tensor = None, size: int = IMAGE_SIZE) -> torch.Tensor:
+    """讀圖 → (3, size, size) float tensor；給了 out 就寫進 out"""
+    if out is None:
+        out = torch.empty(3, size, size)
+    return to_tensor_into(load_resized(image, size), out)
@@ -0,0 +1,202 @@
+# label_index.py
+# 標籤 → 文件的字面索引：送進 search_knowledge 的查詢幾乎都是分類器的固定標籤（"Acne - 痤瘡（青春痘）"），
+# dermnet_disease_mapping_tw.json 已經把 term_en / term_zh_standard / term_zh_raw / synonyms_tw 對到 DermNet 網址，
+# 直接查表就知道要哪幾篇，不用跑 BGE-m3 + 向量檢索；查不到才退回向量檢索。
+#
+# build_dermnet_index.py 建索引時順便寫 rag_label_index.json（文件內容跟向量庫同一份），rag_milvus 讀：
+#   {"model", "docs": [{title, url, content}, ...], "terms": {正規化後的詞: [doc 編號, ...]}}
+#
+# 正規化：NFKC（全形括號 / 斜線 → 半形）、小寫、去掉空白與標點、簡體 → 繁體（有裝 opencc 用 opencc，
+# 沒裝用下面的常用字表）、再把台灣常見的異體字（皰 / 疱、蘚 / 癬…）收成同一個字。
+
+import json
+import os
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+# 查詢端讀這個檔；設成空字串 = 關閉，全部走向量檢索
+RAG_LABEL_INDEX = os.environ.get("RAG_LABEL_INDEX", "rag_label_index.json")
+
+# 對照表裡哪些欄位算「名稱」（前兩個是正式名稱，同一個詞對到多筆時排前面）
+PRIMARY_FIELDS = ("term_zh_standard", "term_en")
+ALIAS_FIELDS = ("term_zh_raw", "synonyms_tw", "title_zh", "title")
+
+# 簡 → 繁（皮膚科名詞常見字；沒裝 opencc 時用）
+_S2T_SIMP = (
+    "疮疡癣藓湿疖痈痒肤肿脓红黄鳞恶发脱细组织结节网状样变异风热药疗术脉头颈阴传虫螨虱伤损烧冻过应荨银"
+    "赘继单纯带综征体质积层关统类种现见觉触诊断检测试盘环线点块颗烂溃缩软纤维苍龟秃须婴儿妇产颊额沟会阳"
+    "门间处区内对称无与为气压泽润营养钙锌铁剂酰亚钠钾镁辐灯场机复杂态脏肾胆脑肠皱纹晒烫渍脚奥华鲁诺尔兰"
+    "罗伦韦达马纳萨贝莱叶汤卢约乔济滨湾岛广东长边缘围扩张蓝绿晕干"
+)
+_S2T_TRAD = (
+    "瘡瘍癬蘚濕癤癰癢膚腫膿紅黃鱗惡發脫細組織結節網狀樣變異風熱藥療術脈頭頸陰傳蟲蟎蝨傷損燒凍過應蕁銀"
+    "贅繼單純帶綜徵體質積層關統類種現見覺觸診斷檢測試盤環線點塊顆爛潰縮軟纖維蒼龜禿須嬰兒婦產頰額溝會陽"
+    "門間處區內對稱無與為氣壓澤潤營養鈣鋅鐵劑醯亞鈉鉀鎂輻燈場機復雜態臟腎膽腦腸皺紋曬燙漬腳奧華魯諾爾蘭"
+    "羅倫韋達馬納薩貝萊葉湯盧約喬濟濱灣島廣東長邊緣圍擴張藍綠暈乾"
+)
+# 繁體裡的異體字，兩邊都收成同一個
+_VARIANTS = {"皰": "疱", "蘚": "癬", "髮": "發", "徵": "症", "黴": "霉", "綫": "線", "痳": "麻"}
+
+_FOLD = str.maketrans({**dict(zip(_S2T_SIMP, _S2T_TRAD)), **_VARIANTS})
+_STRIP = re.compile(r"[\W_]+", re.UNICODE)
+_PAREN = re.compile(r"\(([^()]*)\)")
+
+try:
+    import opencc
+    _opencc = opencc.OpenCC("s2t")
+except Exception:
+    _opencc = None
+
+
+def normalize_term(text: str) -> str:
+    """比對用的 key：同一個詞的簡 / 繁、全形 / 半形、大小寫、空白差異都會得到同一個結果"""
+    text = unicodedata.normalize("NFKC", str(text or "")).lower()
+    if _opencc is not None:
+        text = _opencc.convert(text)
+    text = text.translate(_FOLD)
+    return _STRIP.sub("", text)
+
+
+def _plain(text: str) -> str:
+    """跟 normalize_term 一樣但不做簡繁 / 異體字收斂（分辨「字面完全一樣」跟「收斂後才一樣」）"""
+    return _STRIP.sub("", unicodedata.normalize("NFKC", str(text or "")).lower())
+
+
+def _candidate_parts(query: str) -> List[str]:
+    text = unicodedata.normalize("NFKC", str(query or "")).strip()
+    parts = [text]
+    if " - " in text:
+        parts += [p.strip() for p in text.split(" - ")]
+    # 完整名稱優先，括號裡的別名最後
+    out = []
+    for part in parts:
+        out += [part, _PAREN.sub("", part)]
+    for part in parts:
+        out += _PAREN.findall(part)
+    return out
+
+
+def candidate_keys(query: str) -> List[str]:
+    """
+    一個查詢可以用哪些 key 查（依優先順序，去重）：
+      "Acne - 痤瘡（青春痘）" → 整串、Acne、痤瘡（青春痘）、痤瘡、青春痘
+    """
+    keys = []
+    for p in _candidate_parts(query):
+        k = normalize_term(p)
+        if k and k not in keys:
+            keys.append(k)
+    return keys
+
+
+def _names(item: Dict, fields: Iterable[str]) -> List[str]:
+    names = []
+    for field in fields:
+        value = item.get(field)
+        if isinstance(value, list):
+            names += [str(v) for v in value if v]
+        elif value:
+            names.append(str(value))
+    return names
+
+
+def build_label_index(mapping_items: Iterable[Dict], docs: Iterable[Dict], model_name: str = "") -> Dict:
+    """
+    mapping_items：原始 JSON 條目（有 url + 各種名稱欄位的才用）
+    docs：要寫進向量庫的 {title, url, content}；同一個網址的文件都掛在那個詞底下，內容長的排前面
+    """
+    by_url: Dict[str, List[Dict]] = {}
+    for d in docs:
+        if d.get("url"):
+            by_url.setdefault(d["url"], []).append({"title": d["title"], "url": d["url"], "content": d["content"]})
+
+    out_docs: List[Dict] = []
+    doc_ids: Dict[str, List[int]] = {}
+    for url, ds in by_url.items():
+        ds.sort(key=lambda d: len(d["content"] or ""), reverse=True)
+        doc_ids[url] = list(range(len(out_docs), len(out_docs) + len(ds)))
+        out_docs += ds
+
+    primary: Dict[str, List[int]] = {}
+    alias: Dict[str, List[int]] = {}
+    for item in mapping_items:
+        if not isinstance(item, dict) or item.get("url") not in doc_ids:
+            continue
+        ids = doc_ids[item["url"]]
+        for table, fields in ((primary, PRIMARY_FIELDS), (alias, ALIAS_FIELDS)):
+            for name in _names(item, fields):
+                key = normalize_term(name)
+                if key:
+                    bucket = table.setdefault(key, [])
+                    bucket += [i for i in ids if i not in bucket]
+
+    terms = {}
+    for key in set(primary) | set(alias):
+        ids = list(primary.get(key, []))
+        ids += [i for i in alias.get(key, []) if i not in ids]
+        terms[key] = ids
+
+    # 有用到的文件才留
+    used = sorted({i for ids in terms.values() for i in ids})
+    remap = {old: new for new, old in enumerate(used)}
+    return {
+        "model": model_name,
+        "docs": [out_docs[i] for i in used],
+        "terms": {k: [remap[i] for i in ids] for k, ids in sorted(terms.items())},
+    }
+
+
+def write_label_index(index: Dict, path: str = RAG_LABEL_INDEX):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class LabelIndex:
+    def __init__(self, path: str = RAG_LABEL_INDEX):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.path = path
+        self.model = data.get("model", "")
+        self.docs: List[Dict] = data["docs"]
+        self.terms: Dict[str, List[int]] = data["terms"]
+
+    def __len__(self):
+        return len(self.terms)
+
+    def lookup(self, query: str, top_k: int = 5) -> Optional[List[Dict]]:
+        """
+        第一個查得到的 key 對到的文件，依標題跟查詢有多接近排（最多 top_k 筆）；都查不到回 None。
+        score：標題字面跟查詢一樣 1.0 > 簡繁 / 異體字收斂後才一樣 0.95 > 經由同義詞 / 別名對到 0.9，
+        同分的照原本順序（正式名稱先、內容長的先）。
+        """
+        keys = candidate_keys(query)
+        for key in keys:
+            ids = self.terms.get(key)
+            if ids:
+                plain = {_plain(p) for p in _candidate_parts(query)} - {""}
+                hits = [dict(self.docs[i], score=self._title_score(self.docs[i], plain, keys)) for i in ids]
+                hits.sort(key=lambda h: h["score"], reverse=True)
+                return hits[:top_k]
+        return None
+
+    @staticmethod
+    def _title_score(doc: Dict, plain: set, keys: List[str]) -> float:
+        parts = _candidate_parts(doc.get("title"))
+        if any(_plain(p) in plain for p in parts):
+            return 1.0
+        if any(normalize_term(p) in keys for p in parts):
+            return 0.95
+        return 0.9
+
+
+def load_label_index(path: str = RAG_LABEL_INDEX) -> Optional[LabelIndex]:
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return LabelIndex(path)
+    except Exception as e:
+        print("⚠️ 標籤索引讀取失敗，全部走向量檢索：", e)
+        return None
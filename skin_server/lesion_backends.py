@@ -0,0 +1,346 @@
+# lesion_backends.py
+# ConvNeXt 分類器的推論後端（由 LESION_BACKEND 選擇）：
+#   eager         fp32 PyTorch（預設，跟原本一樣）
+#   torchscript   trace + freeze；有 export 出來的 .torchscript.pt 就直接讀
+#   int8_dynamic  Linear 層動態量化成 INT8（ConvNeXt 的 MLP 幾乎都是 Linear），載入時現做
+#   int8_static   FX 靜態量化，需要先用 export_lesion_model.py 校正、輸出 .int8_static.pt
+#   onnx          ONNX Runtime（CPU），讀 .onnx
+#   onnx_int8     ONNX Runtime + 動態量化過的 .int8.onnx
+#   optimized     fp32 權重 + channels_last；可選 torch.compile、bf16 autocast（CPU 有支援才開），
+#                 暖機時（fork 之後）固定 thread 數、把常用 batch 大小先跑過（編譯成本不留給第一個 request），
+#                 再跟 fp32 eager 比對，差太多就退回 fp32
+#
+# 每個後端都包成 runner：吃 (N, 3, 224, 224) 的 CPU float tensor，回傳 CPU 上的 logits。
+# 換後端前請先跑 export_lesion_model.py 看 top-1 跟 fp32 的一致率。
+
+import copy
+import json
+import os
+import threading
+import time
+from typing import List, Tuple
+
+import torch
+import torch.nn as nn
+import timm
+
+BACKENDS = ("eager", "torchscript", "int8_dynamic", "int8_static", "onnx", "onnx_int8", "optimized")
+
+_ARTIFACT_SUFFIX = {
+    "torchscript": ".torchscript.pt",
+    "int8_static": ".int8_static.pt",
+    "onnx": ".onnx",
+    "onnx_int8": ".int8.onnx",
+}
+
+INPUT_SHAPE = (3, 224, 224)
+
+# optimized 後端的選項
+#   LESION_COMPILE：1 = torch.compile（第一次編譯要幾十秒，所以在載入時做）
+#   LESION_BF16：auto = CPU 有 bf16 指令（AVX512-BF16 / AMX）才開；1 = 強制開；0 = 關
+#   LESION_INTRA_THREADS / LESION_INTEROP_THREADS：0 = 不動（serve.py 已經依 worker 數分好）
+#   LESION_WARMUP_BATCHES：載入時先跑哪些 batch 大小（compile 會為新的形狀重新編譯）
+#   LESION_PARITY_TOL：跟 fp32 比對的最大機率差，超過就退回 eager
+OPT_COMPILE = os.environ.get("LESION_COMPILE", "0") == "1"
+OPT_BF16 = os.environ.get("LESION_BF16", "auto")
+OPT_INTRA_THREADS = int(os.environ.get("LESION_INTRA_THREADS", "0"))
+OPT_INTEROP_THREADS = int(os.environ.get("LESION_INTEROP_THREADS", "0"))
+OPT_WARMUP_BATCHES = tuple(int(b) for b in os.environ.get("LESION_WARMUP_BATCHES", "1,2,8").split(",") if b)
+OPT_PARITY_TOL = float(os.environ.get("LESION_PARITY_TOL", "0.02"))
+
+
+# -----------------------------
+# checkpoint（model_state / classes / model_name）
+# -----------------------------
+def load_eager_model(ckpt_path: str, device: torch.device) -> Tuple[nn.Module, List[str]]:
+    ckpt = torch.load(ckpt_path, map_location=device)
+
+    model_name = ckpt["model_name"]
+    classes = ckpt["classes"]
+    num_classes = len(classes)
+
+    model = timm.create_model(
+        model_name,
+        pretrained=False,
+        num_classes=num_classes
+    )
+    model.load_state_dict(ckpt["model_state"])
+    model.to(device)
+    model.eval()
+
+    return model, classes
+
+
+def artifact_path(ckpt_path: str, backend: str) -> str:
+    """best_model.pth → best_model.onnx / best_model.int8_static.pt ..."""
+    base, _ = os.path.splitext(ckpt_path)
+    return base + _ARTIFACT_SUFFIX[backend]
+
+
+def write_artifact_meta(path: str, classes: List[str], model_name: str, ckpt_path: str):
+    """artifact 旁邊放一份 classes，載入時不用再讀整顆 checkpoint"""
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump({
+            "classes": list(classes),
+            "model_name": model_name,
+            "source_checkpoint": os.path.basename(ckpt_path),
+        }, f, ensure_ascii=False, indent=2)
+
+
+def _read_artifact_classes(path: str, ckpt_path: str) -> List[str]:
+    meta_path = path + ".json"
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)["classes"]
+    return torch.load(ckpt_path, map_location="cpu")["classes"]
+
+
+def _require_artifact(path: str, backend: str):
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"後端 {backend} 需要 {path}，請先執行：python export_lesion_model.py --backends {backend}"
+        )
+
+
+# -----------------------------
+# runner
+# -----------------------------
+class TorchRunner:
+    def __init__(self, module, device: torch.device):
+        self.module = module
+        self.device = device
+
+    @torch.inference_mode()
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        return self.module(x.to(self.device)).float().cpu()
+
+
+class OptimizedRunner:
+    """
+    channels_last（+ torch.compile）（+ bf16 autocast）；輸出一律轉回 fp32 logits。
+    固定 thread 數、compile、暖機、跟 fp32 比對都延到 prepare()（registry 暖機或第一次 forward）：
+    serve.py 的 master 只載權重不跑 forward，OpenMP / inductor 的 thread pool 不會在 fork 前就開起來，
+    權重也是在 master 轉好 channels_last，各 worker 照樣 copy-on-write 共用。
+    """
+
+    def __init__(self, module, bf16: bool, compile_model: bool, warmup_batches=OPT_WARMUP_BATCHES):
+        # channels_last 的 fp32 eager；prepare 時也拿它當比對基準
+        self.module = module
+        self.bf16 = bf16
+        self.compile_model = compile_model
+        self.warmup_batches = warmup_batches
+        self.device = torch.device("cpu")
+        self.parity = None
+        self._run = None
+        self._lock = threading.Lock()
+        opts = [name for name, on in (("compile", compile_model), ("bf16", bf16)) if on]
+        # 給結果快取的 fingerprint 用：選項不同輸出就可能不同
+        self.tag = "optimized" + (f"[{','.join(opts)}]" if opts else "")
+
+    @staticmethod
+    @torch.inference_mode()
+    def _forward(module, bf16: bool, x: torch.Tensor) -> torch.Tensor:
+        x = x.cpu().contiguous(memory_format=torch.channels_last)
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=bf16):
+            return module(x).float()
+
+    def prepare(self):
+        if self._run is not None:
+            return
+        with self._lock:
+            if self._run is not None:
+                return
+            pin_threads()
+            run = torch.compile(self.module) if self.compile_model else self.module
+
+            # 暖機：compile 在第一次看到某個形狀時編譯，常用的 batch 大小都先跑過
+            for n in self.warmup_batches:
+                t0 = time.perf_counter()
+                self._forward(run, self.bf16, torch.zeros(n, *INPUT_SHAPE))
+                print(f"  🔥 optimized 暖機 batch={n}：{(time.perf_counter() - t0) * 1000:.0f} ms")
+
+            parity = parity_check(lambda x: self._forward(run, self.bf16, x),
+                                  lambda x: self._forward(self.module, False, x))
+            print(f"🔎 {self.tag} 跟 fp32 比對：top-1 一致 {parity['top1_agreement']:.4f}，"
+                  f"最大機率差 {parity['max_prob_diff']:.4f}（容許 {OPT_PARITY_TOL}）")
+            if parity["top1_agreement"] < 1.0 or parity["max_prob_diff"] > OPT_PARITY_TOL:
+                print("⚠️ optimized 跟 fp32 差太多，改用 fp32 eager")
+                run, self.bf16, self.tag = self.module, False, "optimized"
+            self.parity = parity
+            self._run = run
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        if self._run is None:
+            self.prepare()
+        return self._forward(self._run, self.bf16, x)
+
+
+class OnnxRunner:
+    def __init__(self, onnx_path: str, num_threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("onnx 後端需要 onnxruntime：pip install onnxruntime") from e
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            opts.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.device = torch.device("cpu")
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        x = x.detach().cpu().contiguous().numpy()
+        logits = self.session.run(None, {self.input_name: x})[0]
+        return torch.from_numpy(logits)
+
+
+# -----------------------------
+# 轉換（export 工具跟載入時共用）
+# -----------------------------
+def to_torchscript(model: nn.Module) -> torch.jit.ScriptModule:
+    example = torch.zeros(1, *INPUT_SHAPE, device=next(model.parameters()).device)
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, example)
+    return torch.jit.freeze(traced.eval())
+
+
+def to_int8_dynamic(model: nn.Module) -> nn.Module:
+    model = copy.deepcopy(model).cpu().eval()
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def to_int8_static(model: nn.Module, calib_batches) -> torch.jit.ScriptModule:
+    """FX graph mode 靜態量化：calib_batches 是 (N, 3, 224, 224) tensor 的 iterable"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    model = copy.deepcopy(model).cpu().eval()
+    example = torch.zeros(1, *INPUT_SHAPE)
+    prepared = prepare_fx(model, get_default_qconfig_mapping("x86"), example_inputs=(example,))
+    with torch.inference_mode():
+        n = 0
+        for x in calib_batches:
+            prepared(x)
+            n += x.shape[0]
+    if n == 0:
+        raise ValueError("靜態量化需要校正影像（--calib-dir）")
+    quantized = convert_fx(prepared)
+    with torch.inference_mode():
+        return torch.jit.freeze(torch.jit.trace(quantized, example).eval())
+
+
+def cpu_supports_bf16() -> bool:
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+def pin_threads(intra: int = OPT_INTRA_THREADS, interop: int = OPT_INTEROP_THREADS):
+    if intra > 0:
+        torch.set_num_threads(intra)
+    if interop > 0:
+        try:
+            torch.set_num_interop_threads(interop)
+        except RuntimeError:
+            # 只能在第一次平行運算之前設，已經跑過就維持原值
+            print(f"⚠️ inter-op threads 已經固定為 {torch.get_num_interop_threads()}，LESION_INTEROP_THREADS 沒有生效")
+
+
+def _parity_inputs(n: int = 4) -> torch.Tensor:
+    """固定 seed 的假影像（0～1 像素再 normalize），每次載入比對的是同一批"""
+    g = torch.Generator().manual_seed(0)
+    x = torch.rand(n, *INPUT_SHAPE, generator=g)
+    mean = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+    std = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+    return (x - mean) / std
+
+
+def parity_check(runner, reference, x: torch.Tensor = None) -> dict:
+    """runner 跟 fp32 eager（reference）的 top-1 一致率、最大機率差"""
+    x = _parity_inputs() if x is None else x
+    with torch.inference_mode():
+        ref = torch.softmax(reference(x).float(), dim=1)
+        out = torch.softmax(runner(x).float(), dim=1)
+    return {
+        "top1_agreement": round((ref.argmax(1) == out.argmax(1)).float().mean().item(), 4),
+        "max_prob_diff": round((ref - out).abs().max().item(), 4),
+    }
+
+
+def to_optimized(model: nn.Module, compile_model: bool = OPT_COMPILE, bf16: str = OPT_BF16,
+                 warmup_batches=OPT_WARMUP_BATCHES) -> OptimizedRunner:
+    """
+    權重直接轉 channels_last（不另外複製一份）；bf16 為 auto 時看 CPU 支不支援。
+    這裡不跑 forward，compile / 暖機 / 比對在 runner.prepare()
+    """
+    use_bf16 = cpu_supports_bf16() if bf16 == "auto" else bf16 == "1"
+    module = model.cpu().eval().to(memory_format=torch.channels_last)
+    return OptimizedRunner(module, use_bf16, compile_model, warmup_batches)
+
+
+def export_onnx(model: nn.Module, onnx_path: str):
+    model = copy.deepcopy(model).cpu().eval()
+    example = torch.zeros(1, *INPUT_SHAPE)
+    torch.onnx.export(
+        model,
+        (example,),
+        onnx_path,
+        input_names=["input"],
+        output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17,
+        dynamo=False,
+    )
+
+
+def quantize_onnx(onnx_path: str, out_path: str):
+    try:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError as e:
+        raise ImportError("onnx_int8 需要 onnxruntime：pip install onnxruntime") from e
+    quantize_dynamic(onnx_path, out_path, weight_type=QuantType.QInt8)
+
+
+# -----------------------------
+# 對外：依名稱載入後端
+# -----------------------------
+def load_backend(backend: str, ckpt_path: str, device: torch.device):
+    """回傳 (runner, classes)；除了 eager / torchscript，其餘後端一律跑 CPU"""
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的 LESION_BACKEND：{backend}（可用：{', '.join(BACKENDS)}）")
+
+    if backend == "eager":
+        model, classes = load_eager_model(ckpt_path, device)
+        return TorchRunner(model, device), classes
+
+    if backend == "torchscript":
+        path = artifact_path(ckpt_path, backend)
+        if os.path.exists(path):
+            module = torch.jit.load(path, map_location=device).eval()
+            return TorchRunner(module, device), _read_artifact_classes(path, ckpt_path)
+        model, classes = load_eager_model(ckpt_path, device)
+        return TorchRunner(to_torchscript(model), device), classes
+
+    cpu = torch.device("cpu")
+
+    if backend == "int8_dynamic":
+        model, classes = load_eager_model(ckpt_path, cpu)
+        return TorchRunner(to_int8_dynamic(model), cpu), classes
+
+    if backend == "int8_static":
+        path = artifact_path(ckpt_path, backend)
+        _require_artifact(path, backend)
+        module = torch.jit.load(path, map_location=cpu).eval()
+        return TorchRunner(module, cpu), _read_artifact_classes(path, ckpt_path)
+
+    if backend == "optimized":
+        model, classes = load_eager_model(ckpt_path, cpu)
+        return to_optimized(model), classes
+
+    # onnx / onnx_int8
+    path = artifact_path(ckpt_path, backend)
+    _require_artifact(path, backend)
+    return OnnxRunner(path, num_threads=torch.get_num_threads()), _read_artifact_classes(path, ckpt_path)
@@ -1,33 +1,70 @@
 # lesion_model.py
+import hashlib
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
 import torch
-import timm
 from PIL import Image
 from torchvision import transforms
 
+import metrics
+import fast_preprocess
+from micro_batcher import MicroBatcher
+from lesion_backends import load_backend, load_eager_model
+
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-MODEL_PATH = "best_model.pth"  # 你現在放在 skin_server 底下的那顆
+MODEL_PATH = os.environ.get("LESION_MODEL_PATH", "best_model.pth")  # 你現在放在 skin_server 底下的那顆
+
+# 推論後端：eager / torchscript / int8_dynamic / int8_static / onnx / onnx_int8 / optimized（見 lesion_backends.py）
+LESION_BACKEND = os.environ.get("LESION_BACKEND", "eager")
+
+# 微批次設定：多個 request 在 MAX_WAIT_MS 內湊成一個 batch，一次最多 MAX_BATCH_SIZE 張
+MAX_BATCH_SIZE = int(os.environ.get("LESION_MAX_BATCH_SIZE", "8"))
+MAX_WAIT_MS = float(os.environ.get("LESION_MAX_WAIT_MS", "5"))
+
+# 前處理：0 = 原本的 torchvision transform（跟訓練 / 驗證一樣，預設）
+#         1 = fast_preprocess（JPEG draft 解碼 + EXIF 轉正），輸入會跟訓練時略有不同，
+#             先用 bench_preprocess.py --ckpt 確認 top-1 一致率再開
+LESION_FAST_DECODE = os.environ.get("LESION_FAST_DECODE", "0") == "1"
+
+# 批次端點（/predict_batch）平行解碼用的 thread 數；PIL 解碼 / resize 會放掉 GIL
+DECODE_WORKERS = int(os.environ.get("LESION_DECODE_WORKERS", "4"))
+_decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+
+
+def _reset_decode_pool():
+    # serve.py fork 出來的 worker 不會繼承 thread，pool 重開
+    global _decode_pool
+    _decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_decode_pool)
+
+# 測試時增強（TTA）：同一張圖的翻轉 / 旋轉版本疊成一個 batch 一次 forward，機率取平均
+#   off     不做
+#   always  每張都做（原圖連同其他視角一次 forward）
+#   auto    先照常跑原圖，top-1 信心落在 LESION_TTA_BAND 裡才補跑其他視角
+#           （預設 0.35～0.65：compute_risk_flag 惡性 / 癌前用 0.50 當門檻，門檻兩側最容易判錯）
+# 每個 request 可以自己指定（/analyze、/predict_combined… 的 tta 欄位），沒指定用這個預設；
+# 預設 off：輸出跟以前一樣，要的部署自己設 LESION_TTA=auto
+LESION_TTA = os.environ.get("LESION_TTA", "off")
+TTA_MODES = ("off", "auto", "always")
+# flips：原圖 / 左右 / 上下 / 180°，都是訓練時 RandomHorizontalFlip + RandomVerticalFlip 組得出來的
+# d4：再加 90° / 270° 旋轉與兩條對角線翻轉，共 8 個視角（訓練沒看過 90°，慢一倍，先當實驗選項）
+LESION_TTA_VIEWS = os.environ.get("LESION_TTA_VIEWS", "flips")
+LESION_TTA_BAND = tuple(float(v) for v in os.environ.get("LESION_TTA_BAND", "0.35,0.65").split(","))
 
 # -----------------------------
 # 1. 載入模型（你的 convnext_tiny）
 # -----------------------------
 def load_model(ckpt_path: str):
-    ckpt = torch.load(ckpt_path, map_location=DEVICE)
-
-    model_name = ckpt["model_name"]
-    classes = ckpt["classes"]
-    num_classes = len(classes)
-
-    model = timm.create_model(
-        model_name,
-        pretrained=False,
-        num_classes=num_classes
-    )
-    model.load_state_dict(ckpt["model_state"])
-    model.to(DEVICE)
-    model.eval()
-
-    return model, classes
+    return load_eager_model(ckpt_path, DEVICE)
 
 
 # -----------------------------
@@ -42,29 +79,113 @@ transform = transforms.Compose([
     )
 ])
 
-print("🚀 載入 ConvNeXt 皮膚病灶模型中...")
-lesion_model, lesion_classes = load_model(MODEL_PATH)
-print(f"✅ 模型載入完成，共有 {len(lesion_classes)} 個類別")
+def checkpoint_fingerprint(ckpt_path: str) -> str:
+    """checkpoint 檔案內容的 sha256，換了 best_model.pth 就會不同（給結果快取當 key 用）"""
+    h = hashlib.sha256()
+    with open(ckpt_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
 
 # -----------------------------
-# 3. 單張圖片推論
+# 延遲載入：import 時不讀 checkpoint，由 model_registry 在背景載，
+# 或第一個 request 用到時才載（兩邊搶的話只會載一次）
 # -----------------------------
-@torch.inference_mode()
-def predict_lesion(image_path: str):
+lesion_model = None
+lesion_classes = None
+CHECKPOINT_SHA = None
+_load_lock = threading.Lock()
+
+
+def ensure_loaded():
+    global lesion_model, lesion_classes, CHECKPOINT_SHA
+    if lesion_model is not None:
+        return
+    with _load_lock:
+        if lesion_model is not None:
+            return
+        print(f"🚀 載入 ConvNeXt 皮膚病灶模型中（後端：{LESION_BACKEND}）...")
+        t0 = time.perf_counter()
+        model, classes = load_backend(LESION_BACKEND, MODEL_PATH, DEVICE)
+        lesion_classes = classes
+        CHECKPOINT_SHA = checkpoint_fingerprint(MODEL_PATH)
+        lesion_model = model
+        print(f"✅ 模型載入完成，共有 {len(classes)} 個類別（{CHECKPOINT_SHA[:12]}），"
+              f"{(time.perf_counter() - t0) * 1000:.0f} ms")
+
+
+def get_classes():
+    ensure_loaded()
+    return lesion_classes
+
+
+def get_model_fingerprint() -> str:
     """
-    使用 ConvNeXt 模型做單張分類，回傳：
-    {
-      "top1": { "label": ..., "confidence": ... },
-      "top3": [ {label, confidence}, ... ]
-    }
+    checkpoint + 後端 + 前處理；不同後端（例如 INT8）、不同前處理的輸出會有些微差異，結果快取要分開。
+    optimized 後端的 tag 帶 compile / bf16 選項，暖機時比對沒過退回 fp32 tag 會跟著變，所以每次現算
+    """
+    ensure_loaded()
+    backend_tag = getattr(lesion_model, "tag", LESION_BACKEND)
+    return f"{CHECKPOINT_SHA}:{backend_tag}:{preprocess_tag()}"
+
+
+def warmup(batch_size: int = 1):
+    """用全零影像跑一次 forward，讓第一個真的 request 不用付初始化成本"""
+    ensure_loaded()
+    _forward_probs(torch.zeros(batch_size, 3, 224, 224))
+
+
+def open_image(image) -> Image.Image:
+    """
+    image 可以是：
+      - 檔案路徑（str / PathLike）
+      - 整張圖的 bytes
+      - file-like（例如 Flask 的 request.files[...].stream）
     """
-    img = Image.open(image_path).convert("RGB")
-    x = transform(img).unsqueeze(0).to(DEVICE)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    return Image.open(image).convert("RGB")
 
+
+def preprocess_tag() -> str:
+    if not LESION_FAST_DECODE:
+        return "tv"
+    return f"fast{fast_preprocess.DRAFT_FACTOR}{'e' if fast_preprocess.EXIF_TRANSPOSE else ''}"
+
+
+def preprocess_image(image, out: torch.Tensor = None) -> torch.Tensor:
+    """讀圖 + 前處理，回傳 (3, 224, 224) tensor（還在 CPU 上）；給了 out 就直接寫進 out"""
+    if LESION_FAST_DECODE:
+        return fast_preprocess.preprocess(image, out)
+    x = transform(open_image(image))
+    return x if out is None else out.copy_(x)
+
+
+# -----------------------------
+# 3. 批次 forward（由 micro-batcher 的 worker 呼叫）
+# -----------------------------
+@torch.inference_mode()
+def _forward_probs(x: torch.Tensor) -> torch.Tensor:
+    t0 = time.perf_counter()
     outputs = lesion_model(x)
-    probs = torch.softmax(outputs, dim=1)[0]
+    probs = torch.softmax(outputs, dim=1)
+    # 一個 batch 記一次（batch 大小看 /lesion_stats）
+    metrics.observe_stage("classifier_forward", time.perf_counter() - t0)
+    return probs
+
+
+lesion_batcher = MicroBatcher(
+    _forward_probs,
+    max_batch_size=MAX_BATCH_SIZE,
+    max_wait_ms=MAX_WAIT_MS,
+    name="lesion",
+)
 
+
+def format_prediction(probs: torch.Tensor, tta_views: int = 1):
+    """把單張影像的機率向量整理成 top1 + top3（有做 TTA 的多一個 tta_views：平均了幾個視角）"""
+    ensure_loaded()
     # Top1
     top1_prob, top1_idx = torch.max(probs, dim=0)
     top1_label = lesion_classes[top1_idx.item()]
@@ -78,10 +199,164 @@ def predict_lesion(image_path: str):
             "confidence": float(round(prob.item(), 3))
         })
 
-    return {
+    result = {
         "top1": {
             "label": top1_label,
             "confidence": float(round(top1_prob.item(), 3)),
         },
         "top3": top3
     }
+    if tta_views > 1:
+        result["tta_views"] = tta_views
+    return result
+
+
+# -----------------------------
+# 3b. 測試時增強（TTA）
+# -----------------------------
+def resolve_tta(tta=None) -> str:
+    """request 帶的 tta（None / bool / "off" / "auto" / "always"）→ 實際模式"""
+    if tta is None or tta == "":
+        mode = LESION_TTA
+    elif tta is True:
+        mode = "always"
+    elif tta is False:
+        mode = "off"
+    else:
+        mode = str(tta).lower()
+        mode = {"1": "always", "true": "always", "on": "always", "yes": "always",
+                "0": "off", "false": "off", "no": "off"}.get(mode, mode)
+    if mode not in TTA_MODES:
+        raise ValueError(f"tta 只能是 {' / '.join(TTA_MODES)}，收到 {tta!r}")
+    return mode
+
+
+def tta_cache_tag(tta=None) -> str:
+    """結果快取 key 用：TTA 模式 / 視角 / 區間不同，輸出就可能不同"""
+    mode = resolve_tta(tta)
+    if mode == "off":
+        return "tta=off"
+    return f"tta={mode}:{LESION_TTA_VIEWS}:{LESION_TTA_BAND[0]}-{LESION_TTA_BAND[1]}"
+
+
+def tta_views(x: torch.Tensor, kind: str = LESION_TTA_VIEWS, include_identity: bool = True) -> torch.Tensor:
+    """x (N, 3, H, W) → (N, V, 3, H, W)，第 0 個視角是原圖（include_identity=False 時不含原圖）"""
+    views = [x] if include_identity else []
+    views += [x.flip(-1), x.flip(-2), x.flip((-2, -1))]
+    if kind == "d4":
+        r = x.rot90(1, (-2, -1))
+        views += [r, r.flip(-1), r.flip(-2), r.flip((-2, -1))]
+    elif kind != "flips":
+        raise ValueError(f"LESION_TTA_VIEWS 只能是 flips / d4，收到 {kind!r}")
+    return torch.stack(views, dim=1)
+
+
+def _forward_views(views: torch.Tensor) -> torch.Tensor:
+    """
+    (N, V, 3, H, W) 送進 batcher，回傳 (N, V, C) 機率。
+    同一張圖的所有視角放在同一塊，一塊最多 MAX_BATCH_SIZE 個視角（至少一整張圖）。
+    """
+    n, v = views.shape[:2]
+    per = max(1, MAX_BATCH_SIZE // v)
+    futures = [lesion_batcher.submit(views[s:s + per].flatten(0, 1)) for s in range(0, n, per)]
+    return torch.cat([f.result() for f in futures]).view(n, v, -1)
+
+
+def _classify(x: torch.Tensor, mode: str):
+    """
+    x (N, 3, H, W) → ((N, C) 機率, 每張平均了幾個視角)
+    always：全部視角一次 forward；auto：原圖先跑，信心落在區間的才補跑其他視角再一起平均
+    """
+    n = x.shape[0]
+    if mode == "always":
+        t0 = time.perf_counter()
+        probs = _forward_views(tta_views(x))
+        metrics.observe_stage("tta", time.perf_counter() - t0)
+        return probs.mean(dim=1), [probs.shape[1]] * n
+
+    futures = [lesion_batcher.submit(x[s:s + MAX_BATCH_SIZE]) for s in range(0, n, MAX_BATCH_SIZE)]
+    probs = torch.cat([f.result() for f in futures])
+    used = [1] * n
+    if mode == "off":
+        return probs, used
+
+    lo, hi = LESION_TTA_BAND
+    conf = probs.max(dim=1).values
+    idx = [i for i in range(n) if lo <= conf[i].item() <= hi]
+    if not idx:
+        return probs, used
+
+    t0 = time.perf_counter()
+    extra = _forward_views(tta_views(x[idx], include_identity=False))
+    metrics.observe_stage("tta", time.perf_counter() - t0)
+    probs = probs.clone()
+    probs[idx] = (probs[idx] + extra.sum(dim=1)) / (1 + extra.shape[1])
+    for i in idx:
+        used[i] = 1 + extra.shape[1]
+    return probs, used
+
+
+# -----------------------------
+# 4. 單張圖片推論（同步包一層 batcher）
+# -----------------------------
+def predict_lesion(image, tta=None):
+    """
+    使用 ConvNeXt 模型做單張分類（image 可為路徑、bytes 或 file-like），回傳：
+    {
+      "top1": { "label": ..., "confidence": ... },
+      "top3": [ {label, confidence}, ... ],
+      "tta_views": 4        ← 有做 TTA 才有
+    }
+    實際 forward 由 lesion_batcher 跟其他 request 併成同一個 batch。
+    tta：off / auto / always（或 True / False），None 用 LESION_TTA。
+    """
+    ensure_loaded()
+    mode = resolve_tta(tta)
+    t0 = time.perf_counter()
+    x = preprocess_image(image).unsqueeze(0)
+    metrics.observe_stage("decode", time.perf_counter() - t0)
+    probs, used = _classify(x, mode)
+    return format_prediction(probs[0], used[0])
+
+
+# -----------------------------
+# 5. 多張圖片一起推論（/predict_batch、/analyze_batch）
+# -----------------------------
+def _try_preprocess(image, out: torch.Tensor):
+    try:
+        return preprocess_image(image, out), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def predict_lesion_batch(images: List, tta=None) -> List[Dict]:
+    """
+    多張一起：平行解碼後依 MAX_BATCH_SIZE 切塊送進 lesion_batcher，每一塊就是一次真的 batch forward。
+    回傳跟 images 同順序的 list，每個元素是 predict_lesion 的格式；解不開的圖是 {"error": ...}，不影響其他張。
+    tta 同 predict_lesion。
+    """
+    ensure_loaded()
+    mode = resolve_tta(tta)
+    if not images:
+        return []
+    t0 = time.perf_counter()
+    # 整批一次配好，每張解碼完直接寫進自己那一格
+    batch = torch.empty(len(images), 3, 224, 224)
+    decoded = list(_decode_pool.map(_try_preprocess, images, batch))
+    metrics.observe_stage("decode_batch", time.perf_counter() - t0)
+
+    results: List[Dict] = [{"error": err} if x is None else {} for x, err in decoded]
+    ok = [i for i, (x, _) in enumerate(decoded) if x is not None]
+    if not ok:
+        return results
+    # _classify 會把全部塊先送出去，batcher 的 worker 一塊接一塊跑，不用等上一塊回來才送下一塊
+    x = batch if len(ok) == len(images) else batch[ok]
+    probs, used = _classify(x, mode)
+    for i, p, v in zip(ok, probs, used):
+        results[i] = format_prediction(p, v)
+    return results
+
+
+def get_batcher_stats():
+    """queue 深度、batch 大小分佈、等待時間，給調 MAX_BATCH_SIZE / MAX_WAIT_MS 用"""
+    return lesion_batcher.get_stats()
@@ -0,0 +1,175 @@
+# llm_admission.py
+# LLM 准入控制：
+#   同時打到 Ollama 的請求數有上限（一顆 14B 模型同時塞太多只會大家一起慢），
+#   其餘的進有上限的等待佇列，報告生成優先於聊天；
+#   佇列滿了直接丟 QueueFullError，app.py 轉成 HTTP 429 + Retry-After。
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# 數字越小越優先
+PRIORITY_REPORT = 0
+PRIORITY_CHAT = 1
+
+PRIORITY_NAMES = {PRIORITY_REPORT: "report", PRIORITY_CHAT: "chat"}
+
+
+class QueueFullError(Exception):
+    """排不進佇列（或排太久、被更高優先的請求擠掉）"""
+
+    def __init__(self, message: str, retry_after: float, estimated_wait: float, queue_depth: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.estimated_wait = estimated_wait
+        self.queue_depth = queue_depth
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "granted", "evicted")
+
+    def __init__(self, priority: int, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.granted = False
+        self.evicted = False
+
+    def __lt__(self, other: "_Waiter"):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int = 1, max_queue: int = 8,
+                 queue_timeout: float = 120.0, initial_service_time: float = 30.0):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiters = []  # heap of _Waiter
+        self._seq = itertools.count()
+
+        # 每次生成大概要多久（EWMA），拿來估等待時間
+        self._service_time = float(initial_service_time)
+
+        self.admitted = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.timed_out = 0
+
+    # -----------------------------
+    # 估計等待時間
+    # -----------------------------
+    def _estimate_wait(self, position: int) -> float:
+        """position：前面還有幾個人在排（呼叫端要持有 _cond）"""
+        if self._active < self.max_concurrent and position == 0:
+            return 0.0
+        rounds = position // self.max_concurrent + 1
+        return rounds * self._service_time
+
+    def _reject(self, message: str, position: int) -> QueueFullError:
+        wait = self._estimate_wait(position)
+        return QueueFullError(
+            message,
+            retry_after=max(1, math.ceil(wait)),
+            estimated_wait=round(wait, 1),
+            queue_depth=len(self._waiters),
+        )
+
+    # -----------------------------
+    # 只檢查、不佔位（串流開始前先擋）
+    # -----------------------------
+    def check(self, priority: int = PRIORITY_REPORT):
+        with self._cond:
+            if self._active < self.max_concurrent or len(self._waiters) < self.max_queue:
+                return
+            if any(w.priority > priority for w in self._waiters):
+                return  # 可以擠掉排隊中較低優先的
+            self.rejected += 1
+            raise self._reject("LLM 佇列已滿", len(self._waiters))
+
+    # -----------------------------
+    # 佔位 / 釋放
+    # -----------------------------
+    def acquire(self, priority: int = PRIORITY_REPORT, timeout: Optional[float] = None):
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._cond:
+            if self._active < self.max_concurrent and not self._waiters:
+                self._active += 1
+                self.admitted += 1
+                return
+
+            if len(self._waiters) >= self.max_queue:
+                # 報告可以擠掉排最後面的聊天；同優先或更低就直接拒絕
+                victim = max(self._waiters, default=None)
+                if victim is None or victim.priority <= priority:
+                    self.rejected += 1
+                    raise self._reject("LLM 佇列已滿", len(self._waiters))
+                self._waiters.remove(victim)
+                heapq.heapify(self._waiters)
+                victim.evicted = True
+                self.evicted += 1
+                self._cond.notify_all()
+
+            me = _Waiter(priority, next(self._seq))
+            heapq.heappush(self._waiters, me)
+
+            deadline = time.monotonic() + timeout
+            while not me.granted and not me.evicted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(me)
+                    heapq.heapify(self._waiters)
+                    self.timed_out += 1
+                    raise self._reject("LLM 排隊逾時", len(self._waiters))
+                self._cond.wait(remaining)
+
+            if me.evicted:
+                raise self._reject("LLM 忙碌中，已讓給優先的報告生成", len(self._waiters))
+            self.admitted += 1
+
+    def release(self, service_time: Optional[float] = None):
+        with self._cond:
+            if service_time is not None:
+                self._service_time = 0.8 * self._service_time + 0.2 * service_time
+            if self._waiters:
+                # 名額直接轉給最優先的等待者，_active 不變
+                nxt = heapq.heappop(self._waiters)
+                nxt.granted = True
+                self._cond.notify_all()
+            else:
+                self._active -= 1
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_REPORT, timeout: Optional[float] = None):
+        self.acquire(priority, timeout)
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - t0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            waiting: Dict[str, int] = {}
+            for w in self._waiters:
+                name = PRIORITY_NAMES.get(w.priority, str(w.priority))
+                waiting[name] = waiting.get(name, 0) + 1
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queue_depth": len(self._waiters),
+                "waiting_by_priority": waiting,
+                "avg_service_seconds": round(self._service_time, 2),
+                "estimated_wait_seconds": round(self._estimate_wait(len(self._waiters)), 1),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "evicted": self.evicted,
+                "timed_out": self.timed_out,
+            }
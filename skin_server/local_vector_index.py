@@ -0,0 +1,335 @@
+# local_vector_index.py
+# 內嵌式向量索引（RAG_BACKEND=local 時取代 Milvus）：
+#   DermNet 語料只有幾千筆 1024 維向量，直接放在本機檔案、用 NumPy 做 cosine top-k，
+#   不用另外開 Milvus、每次查詢也少一趟 gRPC。
+#
+# 目錄結構（build_dermnet_index.py 寫，rag_milvus 讀）：
+#   index.json                 目前這一代的描述（最後才用 os.replace 換上去，讀的人不會看到寫一半的）
+#   vectors-<gen>.npy          (N, dim) float32，已經 L2 正規化 → 內積就是 cosine
+#   meta-<gen>.bin             各欄位 UTF-8 串在一起
+#   offsets-<gen>.npy          (N, 欄位數 + 1) int64，第 i 筆第 j 欄 = meta[off[i, j]:off[i, j + 1]]
+#   centroids-<gen>.npy        （IVF）(nlist, dim) 群心
+#   lists-<gen>.npy            （IVF）(nlist + 1,) 每一群在 vectors 裡的起訖；vectors 依群排好
+#
+# 向量 / metadata 都用 mmap 開，多個 worker 行程共用同一份 page cache。
+
+import json
+import mmap
+import os
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_FIELDS = ("title", "url", "content")
+INDEX_FILE = "index.json"
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """scores 一維，回傳分數最高的 k 個位置（由高到低）"""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(scores.shape[0])
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+# -----------------------------
+# IVF：球面 k-means（向量都正規化過，用內積分群）
+# -----------------------------
+def train_ivf(vectors: np.ndarray, nlist: int, iters: int = 10, seed: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+    """回傳 (centroids, assign)"""
+    n = vectors.shape[0]
+    nlist = max(1, min(nlist, n))
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(n, nlist, replace=False)].copy()
+    assign = np.zeros(n, dtype=np.int64)
+    for _ in range(iters):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = vectors[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+            else:
+                # 空群：隨便挑一筆當新群心
+                centroids[c] = vectors[rng.integers(n)]
+        centroids = _normalize(centroids)
+    assign = np.argmax(vectors @ centroids.T, axis=1)
+    return centroids, assign
+
+
+# -----------------------------
+# 寫入（index builder 用）
+#   LocalIndexWriter 一批一批往 .part 暫存檔加，記憶體只放得下一批也沒關係；
+#   commit() 才排好順序、寫出正式檔和 index.json，之前讀的人看到的還是舊的一代。
+#   state() 可以存進 checkpoint，重建中途掛掉時用 resume_state 接著寫。
+# -----------------------------
+class LocalIndexWriter:
+    def __init__(self, index_dir: str, dim: int, fields: Sequence[str] = DEFAULT_FIELDS,
+                 resume_state: Optional[Dict] = None):
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.dim = dim
+        self.fields = list(fields)
+        self.gen = (resume_state or {}).get("generation") or \
+            f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self._vec_part = os.path.join(index_dir, f"vectors-{self.gen}.f32.part")
+        self._off_part = os.path.join(index_dir, f"offsets-{self.gen}.i64.part")
+        self._meta_part = os.path.join(index_dir, f"meta-{self.gen}.bin.part")
+
+        if resume_state:
+            # 截掉 checkpoint 之後寫了一半的部分
+            self.count = int(resume_state["count"])
+            self._pos = int(resume_state["meta_bytes"])
+            for path, size in ((self._vec_part, self.count * dim * 4),
+                               (self._off_part, self.count * (len(self.fields) + 1) * 8),
+                               (self._meta_part, self._pos)):
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        else:
+            self.count = 0
+            self._pos = 0
+            for path in (self._vec_part, self._off_part, self._meta_part):
+                open(path, "wb").close()
+
+        self._vf = open(self._vec_part, "ab")
+        self._of = open(self._off_part, "ab")
+        self._mf = open(self._meta_part, "ab")
+
+    def add(self, rows: Sequence[Dict[str, str]], vectors: np.ndarray):
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        if len(rows) != vectors.shape[0]:
+            raise ValueError(f"metadata 筆數 {len(rows)} 跟向量筆數 {vectors.shape[0]} 不一致")
+        offsets = np.zeros((len(rows), len(self.fields) + 1), dtype=np.int64)
+        chunks = []
+        for i, row in enumerate(rows):
+            for j, field in enumerate(self.fields):
+                offsets[i, j] = self._pos
+                data = str(row.get(field) or "").encode("utf-8")
+                chunks.append(data)
+                self._pos += len(data)
+            offsets[i, len(self.fields)] = self._pos
+        self._mf.write(b"".join(chunks))
+        self._vf.write(vectors.tobytes())
+        self._of.write(offsets.tobytes())
+        self.count += len(rows)
+
+    def state(self) -> Dict:
+        """目前寫到哪（先 flush 到磁碟）；存進 checkpoint 用"""
+        for f in (self._vf, self._of, self._mf):
+            f.flush()
+            os.fsync(f.fileno())
+        return {"generation": self.gen, "count": self.count, "meta_bytes": self._pos}
+
+    def _close_parts(self):
+        for f in (self._vf, self._of, self._mf):
+            f.close()
+
+    def abort(self):
+        self._close_parts()
+        for path in (self._vec_part, self._off_part, self._meta_part):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def commit(self, kind: str = "flat", nlist: int = 0) -> Dict:
+        """
+        kind = "flat"（暴力精確）或 "ivf"（nlist 群，查詢時只看最近的 nprobe 群）。
+        """
+        if kind not in ("flat", "ivf"):
+            raise ValueError(f"未知的本地索引類型：{kind}（flat / ivf）")
+        self._close_parts()
+        n, dim, gen = self.count, self.dim, self.gen
+        n_fields = len(self.fields) + 1
+        index_dir = self.index_dir
+
+        raw = np.memmap(self._vec_part, dtype=np.float32, mode="r", shape=(n, dim)) if n else \
+            np.zeros((0, dim), dtype=np.float32)
+        offsets = np.fromfile(self._off_part, dtype=np.int64).reshape(n, n_fields)
+
+        order = np.arange(n)
+        files = {}
+        nlist_out = 0
+        if kind == "ivf" and n > 0:
+            nlist = nlist or max(1, int(np.sqrt(n)))
+            centroids, assign = train_ivf(np.asarray(raw), nlist)
+            order = np.argsort(assign, kind="stable")
+            nlist_out = centroids.shape[0]
+            lists = np.zeros(nlist_out + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assign, minlength=nlist_out), out=lists[1:])
+            files["centroids"] = f"centroids-{gen}.npy"
+            files["lists"] = f"lists-{gen}.npy"
+            np.save(os.path.join(index_dir, files["centroids"]), centroids.astype(np.float32))
+            np.save(os.path.join(index_dir, files["lists"]), lists)
+        else:
+            kind = "flat"
+
+        # 向量：照 order 分段搬進正式的 .npy
+        files["vectors"] = f"vectors-{gen}.npy"
+        out = np.lib.format.open_memmap(os.path.join(index_dir, files["vectors"]), mode="w+",
+                                        dtype=np.float32, shape=(n, dim))
+        step = 4096
+        for i in range(0, n, step):
+            out[i:i + step] = raw[order[i:i + step]]
+        out.flush()
+        del out, raw
+
+        # metadata：flat 直接改名；ivf 要照新順序重排
+        files["meta"] = f"meta-{gen}.bin"
+        files["offsets"] = f"offsets-{gen}.npy"
+        meta_path = os.path.join(index_dir, files["meta"])
+        if kind == "flat":
+            os.replace(self._meta_part, meta_path)
+            new_offsets = offsets
+        else:
+            new_offsets = np.zeros_like(offsets)
+            pos = 0
+            with open(self._meta_part, "rb") as src, open(meta_path, "wb") as dst:
+                for out_i, src_i in enumerate(order):
+                    start, stop = int(offsets[src_i, 0]), int(offsets[src_i, -1])
+                    src.seek(start)
+                    dst.write(src.read(stop - start))
+                    new_offsets[out_i] = offsets[src_i] - start + pos
+                    pos += stop - start
+            os.remove(self._meta_part)
+        np.save(os.path.join(index_dir, files["offsets"]), new_offsets)
+        for path in (self._vec_part, self._off_part):
+            os.remove(path)
+
+        info = {
+            "generation": gen,
+            "kind": kind,
+            "count": int(n),
+            "dim": int(dim),
+            "nlist": int(nlist_out),
+            "fields": self.fields,
+            "files": files,
+            "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        tmp_path = os.path.join(index_dir, INDEX_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, os.path.join(index_dir, INDEX_FILE))
+
+        _remove_old_generations(index_dir, gen)
+        return info
+
+
+def write_local_index(index_dir: str, rows: Sequence[Dict[str, str]], vectors: np.ndarray,
+                      kind: str = "flat", nlist: int = 0, fields: Sequence[str] = DEFAULT_FIELDS) -> Dict:
+    """一次寫完：rows[i] 是第 i 筆的 metadata（title / url / content ...），vectors[i] 是它的向量"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    dim = vectors.shape[1] if vectors.ndim == 2 else 0
+    writer = LocalIndexWriter(index_dir, dim, fields)
+    writer.add(rows, vectors)
+    return writer.commit(kind, nlist)
+
+
+def _remove_old_generations(index_dir: str, keep_gen: str):
+    # 舊的一代可能還被別的行程 mmap 著（Windows 上刪不掉），刪不掉就留著下次再刪
+    for name in os.listdir(index_dir):
+        if name == INDEX_FILE or keep_gen in name:
+            continue
+        # .part 是沒寫完（也沒被 resume）的舊重建留下的
+        if name.endswith((".npy", ".bin", ".part")) and "-" in name:
+            try:
+                os.remove(os.path.join(index_dir, name))
+            except OSError:
+                pass
+
+
+# -----------------------------
+# 讀取 / 查詢
+# -----------------------------
+class LocalVectorIndex:
+    def __init__(self, index_dir: str, nprobe: int = 8):
+        path = os.path.join(index_dir, INDEX_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"找不到本地向量索引 {path}，請先執行：python build_dermnet_index.py --backend local"
+            )
+        with open(path, "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+
+        self.index_dir = index_dir
+        self.nprobe = nprobe
+        self.kind = self.info["kind"]
+        self.fields = list(self.info["fields"])
+        self.generation = self.info["generation"]
+        files = self.info["files"]
+
+        self.vectors = np.load(os.path.join(index_dir, files["vectors"]), mmap_mode="r")
+        self.offsets = np.load(os.path.join(index_dir, files["offsets"]), mmap_mode="r")
+        self._meta_file = open(os.path.join(index_dir, files["meta"]), "rb")
+        self._meta = (mmap.mmap(self._meta_file.fileno(), 0, access=mmap.ACCESS_READ)
+                      if os.path.getsize(self._meta_file.name) > 0 else b"")
+
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: Optional[np.ndarray] = None
+        if self.kind == "ivf":
+            self.centroids = np.load(os.path.join(index_dir, files["centroids"]))
+            self.lists = np.load(os.path.join(index_dir, files["lists"]))
+
+    def __len__(self) -> int:
+        return int(self.vectors.shape[0])
+
+    def row(self, i: int) -> Dict[str, str]:
+        off = self.offsets[i]
+        return {
+            field: self._meta[int(off[j]):int(off[j + 1])].decode("utf-8")
+            for j, field in enumerate(self.fields)
+        }
+
+    def _candidates(self, q: np.ndarray) -> Optional[np.ndarray]:
+        """IVF：最近 nprobe 群裡的所有列；flat 回 None（全部都看）"""
+        if self.kind != "ivf":
+            return None
+        probes = _top_k(self.centroids @ q, self.nprobe)
+        return np.concatenate([np.arange(self.lists[c], self.lists[c + 1]) for c in probes])
+
+    def search(self, queries: np.ndarray, top_k: int = 5) -> List[List[Tuple[int, float]]]:
+        """queries：(dim,) 或 (B, dim)；回傳每個 query 的 [(列號, cosine 分數), ...]"""
+        q = _normalize(np.atleast_2d(queries))
+        if len(self) == 0:
+            return [[] for _ in range(q.shape[0])]
+
+        if self.kind != "ivf":
+            # 整批一次矩陣乘法
+            scores = q @ self.vectors.T
+            return [[(int(i), float(s[i])) for i in _top_k(s, top_k)] for s in scores]
+
+        out = []
+        for qi in q:
+            cand = self._candidates(qi)
+            s = self.vectors[cand] @ qi
+            out.append([(int(cand[i]), float(s[i])) for i in _top_k(s, top_k)])
+        return out
+
+    def search_rows(self, queries: np.ndarray, top_k: int = 5,
+                    fields: Sequence[str] = DEFAULT_FIELDS) -> List[List[Dict]]:
+        """跟 rag_milvus 的回傳格式一樣：[{title, url, content, score}, ...]"""
+        out = []
+        for hits in self.search(queries, top_k):
+            rows = []
+            for i, score in hits:
+                row = self.row(i)
+                rows.append(dict({f: row.get(f) for f in fields}, score=score))
+            out.append(rows)
+        return out
+
+    def close(self):
+        if isinstance(self._meta, mmap.mmap):
+            self._meta.close()
+        self._meta_file.close()
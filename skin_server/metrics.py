@@ -0,0 +1,249 @@
+# metrics.py
+# Prometheus 文字格式（text/plain; version=0.0.4）的 /metrics，不另外裝 prometheus_client：
+#   Counter / Gauge / Histogram 三種，label 組合各自一格，observe 只是 bisect + 幾個加法（一把鎖），
+#   熱路徑上量測的成本可以忽略。
+#   CallbackGauge 在被抓取時才呼叫函式取值（LLM 佇列、micro-batcher、快取這類已經有 stats() 的東西）。
+#
+# 常用：
+#   observe_stage("milvus_search", seconds)       各階段耗時 → skin_stage_duration_seconds{stage=...}
+#   record_llm("report", len(prompt), n_chars, data)  LLM prompt/回覆長度 + Ollama eval_count / eval_duration
+
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒：從 ConvNeXt forward（幾十 ms）到 DeepSeek 生成（幾十秒～幾分鐘）都要分得開
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# 字數：prompt 大多落在 2k～8k 字
+SIZE_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+# token/s
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels_text(self.labelnames, k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels_text(self.labelnames, k)} {_fmt(v)}" for k, v in items]
+
+
+class CallbackGauge(_Metric):
+    """抓取時才取值：fn 回傳數字，或 {label 值 tuple: 數字}"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn: Callable[[], object], labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            return [f"# {self.name} 取值失敗：{_escape(e)}"]
+        if not isinstance(value, dict):
+            value = {(): value}
+        lines = self.header()
+        for k, v in sorted(value.items()):
+            k = k if isinstance(k, tuple) else (k,)
+            lines.append(f"{self.name}{_labels_text(self.labelnames, k)} {_fmt(float(v))}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每組 label：[各 bucket 計數（不累加）..., +Inf 計數, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self.header()
+        for key, row in items:
+            acc = 0.0
+            for bound, n in zip(self.buckets + (float("inf"),), row[:-1]):
+                acc += n
+                le = ("le", _fmt(bound))
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {_fmt(acc)}")
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_fmt(row[-1])}")
+            lines.append(f"{self.name}_count{labels} {_fmt(acc)}")
+        return lines
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    lines: List[str] = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------
+# HTTP：每條 route 的請求數 / 耗時 / 進行中
+# -----------------------------
+http_requests = Counter(
+    "skin_http_requests_total", "HTTP 請求數（依 route / 狀態碼）", ["route", "method", "status"])
+http_latency = Histogram(
+    "skin_http_request_duration_seconds", "HTTP 請求耗時（串流回應算到最後一個 byte）", ["route"])
+http_in_flight = Gauge(
+    "skin_http_requests_in_flight", "正在處理中的 HTTP 請求", ["route"])
+
+# -----------------------------
+# 各階段耗時：decode / classifier_forward / embed / milvus_search / retrieve / llm ...
+# -----------------------------
+stage_latency = Histogram(
+    "skin_stage_duration_seconds", "各處理階段耗時", ["stage"])
+
+def observe_stage(stage: str, seconds: float):
+    stage_latency.observe(seconds, stage=stage)
+
+
+def observe_timings(timings: Dict[str, float]):
+    """StagePipeline.report() 的結果（毫秒）整批記進去"""
+    for name, ms in timings.items():
+        stage_latency.observe(ms / 1000.0, stage=name)
+
+
+# -----------------------------
+# LLM：prompt / 回覆長度、Ollama 自己回報的 token 數與生成時間
+# -----------------------------
+llm_requests = Counter(
+    "skin_llm_requests_total", "LLM 呼叫次數", ["kind", "outcome"])
+llm_prompt_chars = Histogram(
+    "skin_llm_prompt_chars", "送給 LLM 的 prompt 字數", ["kind"], buckets=SIZE_BUCKETS)
+llm_response_chars = Histogram(
+    "skin_llm_response_chars", "LLM 回覆字數（含 <think>）", ["kind"], buckets=SIZE_BUCKETS)
+llm_prompt_tokens_estimated = Histogram(
+    "skin_llm_prompt_tokens_estimated", "報告 prompt 的估計 token 數（context_packer.estimate_tokens）",
+    ["kind"], buckets=SIZE_BUCKETS)
+llm_prompt_tokens = Counter(
+    "skin_llm_prompt_eval_tokens_total", "Ollama prompt_eval_count 累計", ["kind"])
+llm_eval_tokens = Counter(
+    "skin_llm_eval_tokens_total", "Ollama eval_count 累計（生成的 token 數）", ["kind"])
+llm_eval_seconds = Counter(
+    "skin_llm_eval_seconds_total", "Ollama eval_duration 累計（秒）", ["kind"])
+llm_prompt_eval_seconds = Counter(
+    "skin_llm_prompt_eval_seconds_total", "Ollama prompt_eval_duration 累計（秒）", ["kind"])
+llm_tokens_per_second = Histogram(
+    "skin_llm_tokens_per_second", "每次生成的速度（eval_count / eval_duration）", ["kind"], buckets=RATE_BUCKETS)
+
+
+def record_llm(kind: str, prompt_chars: int, response_chars: int, data: Optional[Dict] = None):
+    """data 是 Ollama 最後一個（done=True）的 JSON；欄位的時間單位是奈秒"""
+    llm_requests.inc(kind=kind, outcome="ok")
+    llm_prompt_chars.observe(prompt_chars, kind=kind)
+    llm_response_chars.observe(response_chars, kind=kind)
+    if not data:
+        return
+    if data.get("prompt_eval_count"):
+        llm_prompt_tokens.inc(data["prompt_eval_count"], kind=kind)
+    if data.get("prompt_eval_duration"):
+        llm_prompt_eval_seconds.inc(data["prompt_eval_duration"] / 1e9, kind=kind)
+    eval_count = data.get("eval_count") or 0
+    eval_seconds = (data.get("eval_duration") or 0) / 1e9
+    if eval_count:
+        llm_eval_tokens.inc(eval_count, kind=kind)
+    if eval_seconds:
+        llm_eval_seconds.inc(eval_seconds, kind=kind)
+        llm_tokens_per_second.observe(eval_count / eval_seconds, kind=kind)
+
+
+def record_llm_failure(kind: str, outcome: str = "error"):
+    llm_requests.inc(kind=kind, outcome=outcome)
@@ -0,0 +1,184 @@
+# micro_batcher.py
+# 動態微批次（micro-batching）排程器：
+#   多個 Flask request thread 各自 submit 自己的影像 tensor，
+#   背景 worker 在 max_wait_ms 內把它們收集起來，湊成一個 batch 做一次 forward，
+#   再把輸出依原本順序切回去，交給各自的 Future。
+
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Any, List, Optional
+
+import torch
+
+
+class _Request:
+    __slots__ = ("tensor", "future", "enqueued_at")
+
+    def __init__(self, tensor: torch.Tensor):
+        self.tensor = tensor
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    forward_fn: 吃 (N, C, H, W) tensor，回傳第一維也是 N 的 tensor。
+    max_batch_size: 一次 forward 最多幾張影像。
+    max_wait_ms: 第一個 request 進來後，最多再等多久湊 batch。
+    """
+
+    def __init__(
+        self,
+        forward_fn: Callable[[torch.Tensor], torch.Tensor],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        name: str = "batcher",
+    ):
+        self.forward_fn = forward_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+        # ---- 統計 ----
+        self._stats_lock = threading.Lock()
+        self._batch_hist: Counter = Counter()
+        self._recent_waits = deque(maxlen=1000)
+        self._num_requests = 0
+        self._num_batches = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._total_forward = 0.0
+
+    # -----------------------------
+    # 對外：送出推論
+    # -----------------------------
+    def submit(self, x: torch.Tensor) -> Future:
+        """x 形狀為 (N, C, H, W)，回傳的 Future 會得到 (N, ...) 的輸出"""
+        self._ensure_worker()
+        req = _Request(x)
+        self._queue.put(req)
+        return req.future
+
+    def infer(self, x: torch.Tensor, timeout: Optional[float] = None) -> torch.Tensor:
+        """同步版本：送出後等待結果"""
+        return self.submit(x).result(timeout=timeout)
+
+    # -----------------------------
+    # worker thread（fork 之後要在子行程重開）
+    # -----------------------------
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            if self._worker_pid != pid:
+                # fork 進來的子行程：舊的 queue / lock 狀態不可信，整個換掉
+                self._queue = queue.Queue()
+            self._worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"{self.name}-worker",
+                daemon=True,
+            )
+            self._worker_pid = pid
+            self._worker.start()
+
+    def _worker_loop(self):
+        carry: Optional[_Request] = None
+        while True:
+            first = carry if carry is not None else self._queue.get()
+            carry = None
+
+            batch = [first]
+            size = first.tensor.shape[0]
+            deadline = first.enqueued_at + self.max_wait
+
+            while size < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining <= 0:
+                        req = self._queue.get_nowait()
+                    else:
+                        req = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+                n = req.tensor.shape[0]
+                if size + n > self.max_batch_size:
+                    # 放不下就留給下一輪，不拆開同一個 request
+                    carry = req
+                    break
+                batch.append(req)
+                size += n
+
+            self._run_batch(batch, size)
+
+    def _run_batch(self, batch: List[_Request], size: int):
+        started = time.perf_counter()
+        try:
+            if len(batch) == 1:
+                x = batch[0].tensor
+            else:
+                x = torch.cat([r.tensor for r in batch], dim=0)
+            out = self.forward_fn(x)
+        except Exception as e:
+            for r in batch:
+                r.future.set_exception(e)
+            return
+        finally:
+            self._record(batch, size, started)
+
+        offset = 0
+        for r in batch:
+            n = r.tensor.shape[0]
+            r.future.set_result(out[offset:offset + n])
+            offset += n
+
+    # -----------------------------
+    # 統計（給調參用）
+    # -----------------------------
+    def _record(self, batch: List[_Request], size: int, started: float):
+        forward_time = time.perf_counter() - started
+        with self._stats_lock:
+            self._num_batches += 1
+            self._batch_hist[size] += 1
+            self._total_forward += forward_time
+            for r in batch:
+                wait = started - r.enqueued_at
+                self._num_requests += 1
+                self._total_wait += wait
+                self._max_wait_seen = max(self._max_wait_seen, wait)
+                self._recent_waits.append(wait)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            waits = sorted(self._recent_waits)
+            p95 = waits[int(0.95 * (len(waits) - 1))] if waits else 0.0
+            n_req = self._num_requests
+            n_batch = self._num_batches
+            return {
+                "name": self.name,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "requests": n_req,
+                "batches": n_batch,
+                "avg_batch_size": (sum(k * v for k, v in self._batch_hist.items()) / n_batch) if n_batch else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_hist.items())},
+                "wait_ms": {
+                    "avg": (self._total_wait / n_req * 1000.0) if n_req else 0.0,
+                    "p95_recent": p95 * 1000.0,
+                    "max": self._max_wait_seen * 1000.0,
+                },
+                "avg_forward_ms": (self._total_forward / n_batch * 1000.0) if n_batch else 0.0,
+            }
@@ -0,0 +1,159 @@
+# model_registry.py
+# 模型註冊表：ConvNeXt 分類器 / BGE-m3 / Milvus 連線在背景「平行」載入 + 暖機，
+# Flask 不用等它們就能先綁 port；/healthz 看行程活著沒，/readyz 看模型都好了沒。
+# 每個元件的載入、暖機耗時都會印出來，冷啟動慢在哪一段一看就知道。
+
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional
+
+import lesion_model
+import rag_milvus
+
+
+class _Component:
+    def __init__(self, name: str, load: Callable[[], object], warmup: Optional[Callable[[], object]]):
+        self.name = name
+        self.load = load
+        self.warmup = warmup
+        self.state = "pending"   # pending → loading →（loaded）→ warming → ready / failed
+        self.error: Optional[str] = None
+        self.load_ms: Optional[float] = None
+        self.warmup_ms: Optional[float] = None
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "error": self.error,
+            "load_ms": self.load_ms,
+            "warmup_ms": self.warmup_ms,
+        }
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._components: Dict[str, _Component] = {}
+        self._on_ready: List[Callable[[], object]] = []
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._started_at: Optional[float] = None
+        self._ready_ms: Optional[float] = None
+        self._started = False
+
+    def register(self, name: str, load: Callable[[], object], warmup: Optional[Callable[[], object]] = None):
+        self._components[name] = _Component(name, load, warmup)
+
+    def on_ready(self, fn: Callable[[], object]):
+        """全部元件 ready 之後要做的事（例如預熱 RAG 快取）"""
+        self._on_ready.append(fn)
+
+    # -----------------------------
+    # prefork（serve.py）：master 先把權重載好、不暖機，fork 出去的 worker 共用同一份記憶體（copy-on-write），
+    # worker 裡再 start() 時就只剩暖機（暖機要在 worker 裡跑，fork 前用過的 OpenMP thread pool 不能帶進子行程）
+    # -----------------------------
+    def preload(self, names: List[str]):
+        for name in names:
+            c = self._components.get(name)
+            if c is None or c.state != "pending":
+                continue
+            try:
+                c.state = "loading"
+                t0 = time.perf_counter()
+                c.load()
+                c.load_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+                c.state = "loaded"
+                print(f"  📦 [{c.name}] 預先載入 {c.load_ms} ms（fork 後共用）")
+            except Exception as e:
+                # 留給 worker 自己再載一次
+                c.state = "pending"
+                print(f"  ⚠️ [{c.name}] 預先載入失敗，交給 worker 各自載：{type(e).__name__}: {e}")
+
+    # -----------------------------
+    # 啟動：每個元件一條 thread，同時載
+    # -----------------------------
+    def start(self, background: bool = True):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._started_at = time.perf_counter()
+        print(f"🧊 冷啟動：平行載入 {', '.join(self._components)}")
+
+        threads = [
+            threading.Thread(target=self._load_one, args=(c,), name=f"load-{c.name}", daemon=True)
+            for c in self._components.values()
+        ]
+        for t in threads:
+            t.start()
+
+        def finish():
+            for t in threads:
+                t.join()
+            self._finish()
+
+        if background:
+            threading.Thread(target=finish, name="registry-finish", daemon=True).start()
+        else:
+            finish()
+
+    def _load_one(self, c: _Component):
+        try:
+            if c.state != "loaded":
+                c.state = "loading"
+                t0 = time.perf_counter()
+                c.load()
+                c.load_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+
+            if c.warmup is not None:
+                c.state = "warming"
+                t0 = time.perf_counter()
+                c.warmup()
+                c.warmup_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+
+            c.state = "ready"
+            print(f"  ✅ [{c.name}] 載入 {c.load_ms} ms，暖機 {c.warmup_ms or 0} ms")
+        except Exception as e:
+            c.state = "failed"
+            c.error = f"{type(e).__name__}: {e}"
+            print(f"  ❌ [{c.name}] 載入失敗：{c.error}")
+            traceback.print_exc()
+
+    def _finish(self):
+        if not all(c.state == "ready" for c in self._components.values()):
+            print("⚠️ 冷啟動未完成：有元件載入失敗，/readyz 會維持 503")
+            return
+        for fn in self._on_ready:
+            try:
+                fn()
+            except Exception as e:
+                print("⚠️ on_ready 執行失敗：", e)
+        self._ready_ms = round((time.perf_counter() - self._started_at) * 1000.0, 1)
+        self._ready.set()
+        print(f"🟢 冷啟動完成，總耗時 {self._ready_ms} ms")
+
+    # -----------------------------
+    # 狀態
+    # -----------------------------
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def status(self) -> Dict:
+        return {
+            "ready": self.is_ready(),
+            "ready_ms": self._ready_ms,
+            "components": {name: c.to_dict() for name, c in self._components.items()},
+        }
+
+
+# -----------------------------
+# 預設註冊：分類器 / 向量模型 / Milvus（或本地向量索引）
+# -----------------------------
+registry = ModelRegistry()
+registry.register("classifier", lesion_model.ensure_loaded, lesion_model.warmup)
+registry.register("embedder", rag_milvus.get_embedder, rag_milvus.warmup_embedder)
+registry.register("local_index" if rag_milvus.RAG_BACKEND == "local" else "milvus", rag_milvus.get_index)
+registry.on_ready(lambda: rag_milvus.prewarm_knowledge_cache(lesion_model.get_classes()))
@@ -1,50 +1,196 @@
 # rag_milvus.py
 # -*- coding: utf-8 -*-
 import os
-from typing import List, Dict
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Iterable
 
-from pymilvus import connections, Collection
-from FlagEmbedding import BGEM3FlagModel
+import torch
+
+import metrics
+from embedding_cache import encode_cached, open_default_cache
+from label_index import RAG_LABEL_INDEX, load_label_index
+from rag_version import read_index_version
 
 MILVUS_HOST = "127.0.0.1"
 MILVUS_PORT = "19530"
 COLLECTION_NAME = "dermnet_zh_bge_m3"
 EMBED_DIM = 1024
+EMBED_MODEL = "BAAI/bge-m3"
+
+# 向量檢索後端：milvus（預設，連外部 Milvus）/ local（本機 mmap 檔 + NumPy，見 local_vector_index.py）
+# pymilvus / FlagEmbedding 都是用到才 import，local 後端不需要 Milvus 也能跑
+RAG_BACKEND = os.environ.get("RAG_BACKEND", "milvus")
+RAG_LOCAL_INDEX_DIR = os.environ.get("RAG_LOCAL_INDEX_DIR", "rag_local_index")
+RAG_LOCAL_NPROBE = int(os.environ.get("RAG_LOCAL_NPROBE", "8"))
 
-# ---- Milvus 連線 & collection ----
-connections.connect(alias="default", host=MILVUS_HOST, port=MILVUS_PORT)
-collection = Collection(COLLECTION_NAME)
-collection.load()
+# 檢索快取：查詢字串幾乎都是固定的分類標籤，同樣的 (query, top_k) 不必每次重算 embedding + 查 Milvus
+RAG_CACHE_SIZE = int(os.environ.get("RAG_CACHE_SIZE", "512"))
 
 # ---- BGE-m3 模型（跟 index 用同一個）----
-device = "cuda"  # 或 "cpu"
-bge_model = BGEM3FlagModel("BAAI/bge-m3", device=device, use_fp16=(device == "cuda"))
+# 沒有 GPU 的機器自動用 CPU；要強制指定就設 EMBED_DEVICE
+device = os.environ.get("EMBED_DEVICE") or ("cuda" if torch.cuda.is_available() else "cpu")
+
+# Milvus 連線 / collection / BGE-m3 都是第一次用到才建立（或由 model_registry 在背景先建好）
+collection = None
+local_index = None
+bge_model = None
+_collection_lock = threading.Lock()
+_embedder_lock = threading.Lock()
+
+
+def get_collection():
+    global collection
+    if collection is not None:
+        return collection
+    with _collection_lock:
+        if collection is None:
+            from pymilvus import connections, Collection
+            t0 = time.perf_counter()
+            connections.connect(alias="default", host=MILVUS_HOST, port=MILVUS_PORT)
+            c = Collection(COLLECTION_NAME)
+            c.load()
+            collection = c
+            print(f"✅ Milvus collection {COLLECTION_NAME} 載入完成，{(time.perf_counter() - t0) * 1000:.0f} ms")
+    return collection
+
+
+def get_local_index():
+    global local_index
+    if local_index is not None:
+        return local_index
+    with _collection_lock:
+        if local_index is None:
+            from local_vector_index import LocalVectorIndex
+            t0 = time.perf_counter()
+            idx = LocalVectorIndex(RAG_LOCAL_INDEX_DIR, nprobe=RAG_LOCAL_NPROBE)
+            local_index = idx
+            print(f"✅ 本地向量索引載入完成（{idx.kind}，{len(idx)} 筆），{(time.perf_counter() - t0) * 1000:.0f} ms")
+    return local_index
+
+
+def get_index():
+    """依 RAG_BACKEND 拿 Milvus collection 或本地索引（model_registry 用這個預先載入）"""
+    return get_local_index() if RAG_BACKEND == "local" else get_collection()
+
+
+def get_embedder():
+    global bge_model
+    if bge_model is not None:
+        return bge_model
+    with _embedder_lock:
+        if bge_model is None:
+            from FlagEmbedding import BGEM3FlagModel
+            t0 = time.perf_counter()
+            bge_model = BGEM3FlagModel(EMBED_MODEL, device=device, use_fp16=(device == "cuda"))
+            print(f"✅ BGE-m3 載入完成（{device}），{(time.perf_counter() - t0) * 1000:.0f} ms")
+    return bge_model
+
+
+def warmup_embedder():
+    # 暖機一定要真的跑一次模型，不走 embedding 快取
+    get_embedder().encode(["暖機"])
+
+
+# ---- embedding 持久化快取（跟 build_dermnet_index.py 共用 EMBED_CACHE_DIR）----
+_embed_cache = None
+_embed_cache_opened = False
+
+
+def get_embedding_cache():
+    global _embed_cache, _embed_cache_opened
+    if not _embed_cache_opened:
+        with _embedder_lock:
+            if not _embed_cache_opened:
+                _embed_cache = open_default_cache(EMBED_MODEL, EMBED_DIM)
+                _embed_cache_opened = True
+    return _embed_cache
+
+
+def _encode(texts: List[str]):
+    return get_embedder().encode(texts)["dense_vecs"]
 
 
 def embed_query(text: str):
-    vec = bge_model.encode([text])["dense_vecs"][0]
+    vec = encode_cached(get_embedding_cache(), [text], _encode, EMBED_DIM)[0]
     return [float(x) for x in vec]
 
 
-def search_knowledge(query: str, top_k: int = 5) -> List[Dict]:
-    """
-    回傳 top_k 筆相關段落：
-    [{title, url, content, score}, ...]
-    """
+# ---- 標籤字面索引：已知的分類標籤直接查表，不跑 BGE-m3 + 向量檢索 ----
+label_index = None
+_label_index_loaded = False
+_label_hits = 0
+_label_misses = 0
+
+
+def get_label_index():
+    global label_index, _label_index_loaded
+    if not _label_index_loaded:
+        with _collection_lock:
+            if not _label_index_loaded:
+                label_index = load_label_index(RAG_LABEL_INDEX)
+                _label_index_loaded = True
+                if label_index is not None:
+                    print(f"✅ 標籤索引載入完成（{len(label_index)} 個詞）")
+    return label_index
+
+
+def _search_label(query: str, top_k: int):
+    global _label_hits, _label_misses
+    idx = get_label_index()
+    if idx is None:
+        return None
+    t0 = time.perf_counter()
+    hits = idx.lookup(query, top_k)
+    metrics.observe_stage("label_lookup", time.perf_counter() - t0)
+    with _cache_lock:
+        if hits is None:
+            _label_misses += 1
+        else:
+            _label_hits += 1
+    return hits
+
+
+def _search(query: str, top_k: int) -> List[Dict]:
+    hits = _search_label(query, top_k)
+    if hits is not None:
+        return hits
+    if RAG_BACKEND == "local":
+        return _search_local(query, top_k)
+    return _search_milvus(query, top_k)
+
+
+def _search_local(query: str, top_k: int) -> List[Dict]:
+    t0 = time.perf_counter()
+    q_vec = embed_query(query)
+    t1 = time.perf_counter()
+    metrics.observe_stage("embed", t1 - t0)
+
+    hits = get_local_index().search_rows(q_vec, top_k)[0]
+    metrics.observe_stage("local_search", time.perf_counter() - t1)
+    return hits
+
+
+def _search_milvus(query: str, top_k: int) -> List[Dict]:
+    t0 = time.perf_counter()
     q_vec = embed_query(query)
+    t1 = time.perf_counter()
+    metrics.observe_stage("embed", t1 - t0)
 
     search_params = {
         "metric_type": "COSINE",
         "params": {"nprobe": 10}
     }
 
-    results = collection.search(
+    results = get_collection().search(
         data=[q_vec],
         anns_field="embedding",
         param=search_params,
         limit=top_k,
         output_fields=["title", "url", "content"]
     )
+    metrics.observe_stage("milvus_search", time.perf_counter() - t1)
 
     hits = results[0]
     out = []
@@ -57,3 +203,106 @@ def search_knowledge(query: str, top_k: int = 5) -> List[Dict]:
             "score": float(h.distance),
         })
     return out
+
+
+# ---- 檢索快取（key 含 RAG 版本，build_dermnet_index.py 重建後自動失效）----
+_cache_lock = threading.Lock()
+_search_cache: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+_cache_version = read_index_version()
+_cache_hits = 0
+_cache_misses = 0
+
+
+def _check_version(version: str) -> bool:
+    """版本變了：清空快取、換版本號，回傳 True 讓呼叫端放掉 _cache_lock 後再 _reload_index()。呼叫端要持有 _cache_lock"""
+    global local_index, _label_index_loaded, _cache_version
+    if version == _cache_version:
+        return False
+    print(f"🔄 RAG 版本變更 {_cache_version} → {version}，清空檢索快取並重新載入索引")
+    _search_cache.clear()
+    _cache_version = version
+    # local_index / _label_index_loaded 是在 _collection_lock 底下讀寫的，重設也要拿同一把，
+    # 不然正在載入的 get_label_index() 會在重設之後把旗標設回 True，留著舊的標籤索引
+    with _collection_lock:
+        # 下次用到再開新的一代；舊的 mmap 留給還在查詢中的 thread，沒人參照後自動釋放
+        local_index = None
+        _label_index_loaded = False  # 標籤索引跟向量庫一起重建，下次用到再讀
+    return True
+
+
+def _reload_index():
+    """重新拿 Milvus collection（舊的可能已經被 drop 掉）。不能拿著 _cache_lock 呼叫：load() 要好幾秒，快取命中也會被卡住"""
+    global collection
+    if collection is None:
+        return  # 還沒連過，之後第一次用到自然會拿新的
+    try:
+        from pymilvus import Collection
+        c = Collection(COLLECTION_NAME)
+        c.load()
+        with _collection_lock:
+            collection = c
+    except Exception as e:
+        print("⚠️ 重新載入 collection 失敗：", e)
+
+
+def search_knowledge(query: str, top_k: int = 5) -> List[Dict]:
+    """
+    回傳 top_k 筆相關段落：
+    [{title, url, content, score}, ...]
+    """
+    global _cache_hits, _cache_misses
+    version = read_index_version()
+    key = (query, top_k)
+
+    with _cache_lock:
+        changed = _check_version(version)
+        hits = _search_cache.get(key)
+        if hits is not None:
+            _search_cache.move_to_end(key)
+            _cache_hits += 1
+            return [dict(h) for h in hits]
+        _cache_misses += 1
+
+    if changed:
+        _reload_index()
+    hits = _search(query, top_k)
+
+    with _cache_lock:
+        if _cache_version == version:
+            _search_cache[key] = hits
+            _search_cache.move_to_end(key)
+            while len(_search_cache) > RAG_CACHE_SIZE:
+                _search_cache.popitem(last=False)
+    return [dict(h) for h in hits]
+
+
+def prewarm_knowledge_cache(labels: Iterable[str], top_k: int = 5) -> int:
+    """啟動時把分類器每個類別的檢索結果先算好，回傳成功筆數"""
+    n = 0
+    for label in labels:
+        try:
+            search_knowledge(label, top_k=top_k)
+            n += 1
+        except Exception as e:
+            print(f"⚠️ 預熱 RAG 失敗（{label}）：", e)
+    print(f"🔥 RAG 檢索快取預熱完成：{n} 個標籤")
+    return n
+
+
+def get_search_cache_stats() -> Dict:
+    with _cache_lock:
+        lookups = _cache_hits + _cache_misses
+        return {
+            "entries": len(_search_cache),
+            "max_entries": RAG_CACHE_SIZE,
+            "version": _cache_version,
+            "hits": _cache_hits,
+            "misses": _cache_misses,
+            "hit_rate": (_cache_hits / lookups) if lookups else 0.0,
+            "embedding_cache": _embed_cache.stats() if _embed_cache is not None else None,
+            "label_index": {
+                "terms": len(label_index) if label_index is not None else 0,
+                "hits": _label_hits,
+                "misses": _label_misses,
+            },
+        }
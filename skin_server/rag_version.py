@@ -0,0 +1,55 @@
+# rag_version.py
+# RAG 資料庫版本戳記：
+#   build_dermnet_index.py 每次重建完成就寫一次新版本，
+#   查詢端（結果快取、檢索快取）把版本放進 cache key，重建後自然全部失效。
+
+import json
+import os
+import threading
+import time
+import uuid
+
+INDEX_VERSION_PATH = os.environ.get("RAG_INDEX_VERSION_PATH", "rag_index_version.json")
+
+_lock = threading.Lock()
+_cached_mtime = None
+_cached_version = "unversioned"
+
+
+def write_index_version(collection_name: str, count: int) -> str:
+    """重建完成後呼叫，回傳新的版本字串"""
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    info = {
+        "version": version,
+        "collection": collection_name,
+        "count": count,
+        "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    tmp_path = INDEX_VERSION_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, INDEX_VERSION_PATH)
+    return version
+
+
+def read_index_version() -> str:
+    """
+    讀目前的版本字串（只在檔案 mtime 變了才重新讀檔，熱路徑上只多一次 stat）。
+    還沒重建過（沒有版本檔）就回傳 "unversioned"。
+    """
+    global _cached_mtime, _cached_version
+    try:
+        mtime = os.stat(INDEX_VERSION_PATH).st_mtime_ns
+    except OSError:
+        return "unversioned"
+
+    with _lock:
+        if mtime != _cached_mtime:
+            try:
+                with open(INDEX_VERSION_PATH, "r", encoding="utf-8") as f:
+                    _cached_version = str(json.load(f).get("version") or "unversioned")
+            except Exception as e:
+                print("⚠️ RAG 版本檔讀取失敗：", e)
+                _cached_version = "unversioned"
+            _cached_mtime = mtime
+        return _cached_version
@@ -0,0 +1,392 @@
+# report_jobs.py
+# 非同步報告工作（/jobs）：
+#   /predict_combined 要等 DeepSeek 整篇生完（最久到 call_llm 的 300 秒），手機網路一斷整份工作就白做。
+#   改成：POST /jobs 分類完就回 job id（順便附 top-1），LLM 在有上限的 worker pool 裡跑；
+#   client 用 GET /jobs/<id> long-poll 拿狀態、目前生到哪、最後的報告。
+#
+#   - 同一張圖（同一個結果快取 key）在 TTL 內重送，直接接到原本的工作，不會再生一次
+#   - 排隊 + 執行中的工作數有上限，滿了丟 QueueFullError（app.py 回 429）
+#   - 完成（或失敗）的工作保留 JOB_TTL 秒；失敗的不拿來接，重送會重跑
+#   - serve.py 多行程時，POST 跟 GET 可能落在不同 worker：設 JOB_STATE_DIR 讓各 worker 把工作狀態寫到共用資料夾
+#     （serve.py 沒設的話會自己開一個暫存資料夾）
+#
+# 事件來源直接用 predict_combined_stream：第一個事件（分類）在 POST 的 thread 裡拿，其餘交給 pool 消化。
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from combined_inference import predict_combined_stream, result_cache_key
+from llm_admission import QueueFullError
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", "16"))
+JOB_TTL = float(os.environ.get("JOB_TTL", "1800"))
+# long-poll 一次最多掛多久（client 給更大的也會被截）
+JOB_MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", "30"))
+# 多行程共用的狀態資料夾；空 = 只放記憶體（單一行程）
+JOB_STATE_DIR = os.environ.get("JOB_STATE_DIR") or None
+# 生成中的部分文字多久寫一次磁碟（狀態改變一定會寫）
+JOB_FLUSH_SECONDS = float(os.environ.get("JOB_FLUSH_SECONDS", "0.5"))
+
+FINISHED = ("done", "error")
+
+
+class Job:
+    """
+    status：classifying → queued → running → done / error
+    version：每收到一個事件 +1，long-poll 用 since=<上次看到的 version> 等下一個變化
+    """
+
+    def __init__(self, key: str):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "classifying"
+        self.version = 0
+        self.created = time.time()
+        self.updated = self.created
+        self.finished: Optional[float] = None
+        self.top1: Dict[str, Any] = {}
+        self.top3 = []
+        self.risk_flag = ""
+        self.cached = False
+        self.rag_titles = []
+        self.think = ""
+        self.text = ""
+        self.report: Optional[str] = None
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self.prompt_tokens: Optional[int] = None
+        self.flushed = 0.0
+
+    def apply(self, event: Dict[str, Any]):
+        kind = event.get("type")
+        if kind == "classification":
+            self.top1 = event.get("top1", {})
+            self.top3 = event.get("top3", [])
+            self.risk_flag = event.get("risk_flag", "")
+            self.cached = bool(event.get("cached"))
+            self.status = "queued"
+        elif kind == "rag":
+            self.rag_titles = event.get("titles", [])
+        elif kind == "think":
+            self.think += event.get("text", "")
+        elif kind == "token":
+            self.text += event.get("text", "")
+        elif kind == "error":
+            self.error = event.get("message") or "LLM 失敗"
+        elif kind == "done":
+            self.report = event.get("report", "")
+            self.timings = event.get("timings", {})
+            self.prompt_tokens = event.get("prompt_tokens")
+            self.finish("error" if self.error else "done")
+            return
+        self.touch()
+
+    def touch(self):
+        self.version += 1
+        self.updated = time.time()
+
+    def finish(self, status: str, error: Optional[str] = None):
+        if error:
+            self.error = error
+        self.status = status
+        self.finished = time.time()
+        self.touch()
+
+    def expired(self, now: float) -> bool:
+        return self.finished is not None and self.finished + JOB_TTL <= now
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "version": self.version,
+            "top1": self.top1,
+            "top3": self.top3,
+            "risk_flag": self.risk_flag,
+            "cached": self.cached,
+            "rag_titles": self.rag_titles,
+            "think": self.think,
+            "text": self.text,
+            "report": self.report,
+            "error": self.error,
+            "timings": self.timings,
+            "prompt_tokens": self.prompt_tokens,
+            "created": self.created,
+            "updated": self.updated,
+            "expires_at": self.finished + JOB_TTL if self.finished is not None else None,
+            "pid": os.getpid(),
+        }
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING,
+                 state_dir: Optional[str] = JOB_STATE_DIR):
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.state_dir = state_dir
+        if self.state_dir:
+            os.makedirs(self.state_dir, exist_ok=True)
+        self._reset()
+
+        self.created = 0
+        self.attached = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _reset(self):
+        # fork 之後也走這裡：thread / 鎖都不會跟著過來
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._cond = threading.Condition()
+        self._jobs: Dict[str, Job] = {}
+        self._by_key: Dict[str, str] = {}
+        self._pending = 0
+        self._last_disk_sweep = 0.0
+
+    # -----------------------------
+    # 建立 / 接到既有的工作
+    # -----------------------------
+    def submit(self, image_bytes: bytes, survey=None, tta=None) -> Tuple[Dict[str, Any], bool]:
+        """回傳 (工作快照, 是否新建)；同一張圖已經有工作在跑或剛完成就接上去"""
+        key = result_cache_key(image_bytes, tta)
+        with self._cond:
+            self._sweep()
+            job = self._local_by_key(key)
+            if job is not None:
+                self.attached += 1
+                # 另一個 request 正在分類：等它分完，回傳的快照才有 top-1
+                self._cond.wait_for(lambda: job.status != "classifying", timeout=JOB_MAX_WAIT)
+                return job.snapshot(), False
+            shared = self._shared_by_key(key)
+            if shared is not None:
+                self.attached += 1
+                return shared, False
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFullError(
+                    f"報告工作已滿（{self._pending}/{self.max_pending}）",
+                    retry_after=30, estimated_wait=30.0, queue_depth=self._pending,
+                )
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+            self._pending += 1
+            self.created += 1
+
+        try:
+            events = predict_combined_stream(image_bytes, survey, tta)
+            with self._cond:
+                job.apply(next(events))
+                self._cond.notify_all()
+            self._flush(job, force=True)
+        except Exception as e:
+            print("❌ 報告工作分類失敗：", e)
+            self._done(job, "error", f"{type(e).__name__}: {e}")
+            return job.snapshot(), True
+
+        if job.cached:
+            # 結果快取命中：剩下的事件都是現成的，直接吃完
+            self._consume(job, events)
+        else:
+            self._pool.submit(self._consume, job, events)
+        return job.snapshot(), True
+
+    def _consume(self, job: Job, events: Iterator[Dict[str, Any]]):
+        try:
+            with self._cond:
+                job.status = "running"
+                job.touch()
+                self._cond.notify_all()
+            for event in events:
+                with self._cond:
+                    job.apply(event)
+                    self._cond.notify_all()
+                self._flush(job, force=job.status in FINISHED)
+            if job.status not in FINISHED:
+                self._done(job, "error", "報告生成中斷")
+            else:
+                self._done(job, job.status)
+        except Exception as e:
+            print("❌ 報告工作失敗：", e)
+            self._done(job, "error", f"{type(e).__name__}: {e}")
+        finally:
+            events.close()
+
+    def _done(self, job: Job, status: str, error: Optional[str] = None):
+        with self._cond:
+            if job.finished is None:
+                job.finish(status, error)
+            self._pending -= 1
+            if job.status == "done":
+                self.completed += 1
+            else:
+                self.failed += 1
+            self._cond.notify_all()
+        self._flush(job, force=True)
+        print(f"🧾 報告工作 {job.id[:8]} {job.status}（{job.finished - job.created:.1f}s）")
+
+    # -----------------------------
+    # 查詢（long-poll）
+    # -----------------------------
+    def get(self, job_id: str, since: int = -1, wait: float = 0.0) -> Optional[Dict[str, Any]]:
+        """version > since、工作結束或等滿 wait 秒就回傳；找不到回 None"""
+        wait = max(0.0, min(float(wait), JOB_MAX_WAIT))
+        deadline = time.monotonic() + wait
+        with self._cond:
+            self._sweep()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._cond.wait_for(lambda: job.version > since or job.status in FINISHED,
+                                    timeout=wait)
+                return job.snapshot()
+
+        # 別的 worker 建的：讀共用資料夾，輪詢到有變化為止
+        while True:
+            snap = self._read_shared(job_id)
+            if snap is None or snap["version"] > since or snap["status"] in FINISHED:
+                return snap
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return snap
+            time.sleep(min(0.25, remaining))
+
+    # -----------------------------
+    # 記憶體 / 共用資料夾
+    # -----------------------------
+    def _local_by_key(self, key: str) -> Optional[Job]:
+        job = self._jobs.get(self._by_key.get(key, ""))
+        if job is None or job.status == "error":
+            return None
+        return job
+
+    def _sweep(self):
+        """過期的工作丟掉（呼叫端要持有 _cond）"""
+        now = time.time()
+        for job_id in [i for i, j in self._jobs.items() if j.expired(now)]:
+            job = self._jobs.pop(job_id)
+            if self._by_key.get(job.key) == job_id:
+                del self._by_key[job.key]
+            self._remove_shared(job)
+        self._sweep_shared()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.state_dir, f"{name}.json")
+
+    def _write_json(self, path: str, data: Dict[str, Any]):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _flush(self, job: Job, force: bool = False):
+        if not self.state_dir:
+            return
+        now = time.monotonic()
+        if not force and now - job.flushed < JOB_FLUSH_SECONDS:
+            return
+        with self._cond:
+            snap = job.snapshot()
+        try:
+            self._write_json(self._path(job.id), snap)
+            if force and job.version <= 1:
+                self._write_json(self._path(f"key-{job.key}"), {"id": job.id})
+            job.flushed = now
+        except Exception as e:
+            print("⚠️ 報告工作狀態寫入失敗：", e)
+
+    def _read_shared(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not self.state_dir or not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if snap.get("expires_at") is not None and snap["expires_at"] <= time.time():
+            return None
+        if snap["status"] not in FINISHED and not _alive(int(snap.get("pid", 0))):
+            # 負責的 worker 掛了（serve.py 會重開一個，但工作不會接著跑）
+            snap.update(status="error", error="負責這個工作的行程已結束，請重新送出")
+        return snap
+
+    def _shared_by_key(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.state_dir:
+            return None
+        try:
+            with open(self._path(f"key-{key}"), "r", encoding="utf-8") as f:
+                job_id = json.load(f)["id"]
+        except (OSError, ValueError, KeyError):
+            return None
+        snap = self._read_shared(job_id)
+        if snap is None or snap["status"] == "error":
+            return None
+        return snap
+
+    def _remove_shared(self, job: Job):
+        if not self.state_dir:
+            return
+        try:
+            os.remove(self._path(job.id))
+            key_path = self._path(f"key-{job.key}")
+            with open(key_path, "r", encoding="utf-8") as f:
+                owner = json.load(f).get("id")
+            # 同一張圖失敗後重送會有新的工作，key 檔已經指到新的就別刪
+            if owner == job.id:
+                os.remove(key_path)
+        except (OSError, ValueError):
+            pass
+
+    def _sweep_shared(self):
+        """掛掉的 worker 留下的檔案沒人會刪：超過 TTL 再一小時沒動過的一律清掉"""
+        now = time.time()
+        if not self.state_dir or now - self._last_disk_sweep < 60:
+            return
+        self._last_disk_sweep = now
+        try:
+            for name in os.listdir(self.state_dir):
+                path = os.path.join(self.state_dir, name)
+                if os.path.getmtime(path) < now - JOB_TTL - 3600:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            by_status: Dict[str, int] = {}
+            for job in self._jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+            return {
+                "workers": self.workers,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "jobs": by_status,
+                "created": self.created,
+                "attached": self.attached,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+                "ttl_seconds": JOB_TTL,
+                "state_dir": self.state_dir,
+            }
+
+
+job_manager = JobManager()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=job_manager._reset)
@@ -0,0 +1,222 @@
+# result_cache.py
+# /predict_combined 結果快取（content-addressed）：
+#   key = hash(圖片 bytes + 模型 checkpoint 指紋 + prompt 版本 + RAG 版本)
+#   第一層：記憶體 LRU + TTL
+#   第二層（選用）：磁碟 JSON，重開機後還在
+#     過期的檔案只有被讀到才會刪，所以 put 時定期掃一次：刪掉過期的，檔數超過上限就從最舊的刪
+
+import copy
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def make_cache_key(image_bytes: bytes, *parts: str) -> str:
+    h = hashlib.sha256()
+    h.update(hashlib.sha256(image_bytes).digest())
+    for p in parts:
+        h.update(b"\x00")
+        h.update(str(p).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 86400.0,
+                 disk_dir: Optional[str] = None, disk_max_files: int = 10000,
+                 disk_sweep_seconds: float = 300.0):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.disk_dir = disk_dir or None
+        self.disk_max_files = max(1, int(disk_max_files))
+        self.disk_sweep_seconds = float(disk_sweep_seconds)
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._sweep_lock = threading.Lock()
+        self._last_sweep = 0.0          # 0 = 啟動後第一次 put 就掃（清掉上次留下的）
+        self._disk_puts_since_sweep = 0
+        self.disk_files = 0             # 上次掃描後的檔數
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self.expired = 0
+        self.disk_evictions = 0
+
+    # -----------------------------
+    # 查詢
+    # -----------------------------
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._mem.move_to_end(key)
+                    self.hits_memory += 1
+                    return copy.deepcopy(value)
+                del self._mem[key]
+                self.expired += 1
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits_disk += 1
+            self._mem_put(key, value, now + self.ttl)
+        return copy.deepcopy(value)
+
+    def put(self, key: str, value: Dict[str, Any]):
+        expires_at = time.time() + self.ttl
+        value = copy.deepcopy(value)
+        with self._lock:
+            self.puts += 1
+            self._mem_put(key, value, expires_at)
+        self._disk_put(key, value, expires_at)
+
+    def _mem_put(self, key: str, value: Dict[str, Any], expires_at: float):
+        self._mem[key] = (expires_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    # -----------------------------
+    # 磁碟層
+    # -----------------------------
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if float(entry.get("expires_at", 0)) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self.expired += 1
+            return None
+        return entry.get("value")
+
+    def _disk_put(self, key: str, value: Dict[str, Any], expires_at: float):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print("⚠️ 結果快取寫入磁碟失敗：", e)
+            return
+        self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        """距離上次掃描夠久，或上次之後寫進的檔案可能已經超過上限，就掃一次（同時只有一個 thread 在掃）"""
+        with self._lock:
+            self._disk_puts_since_sweep += 1
+            due = (time.time() - self._last_sweep >= self.disk_sweep_seconds
+                   or self.disk_files + self._disk_puts_since_sweep > self.disk_max_files)
+        if not due or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self.sweep_disk()
+        finally:
+            self._sweep_lock.release()
+
+    def sweep_disk(self) -> int:
+        """
+        刪掉過期的檔案，剩下的超過 disk_max_files 就從最舊的開始刪到九成（留點空間，不會每次 put 都掃），
+        回傳刪掉幾個。
+        過期用 mtime + ttl 判斷（寫入時 expires_at 就是 now + ttl），不用每個檔都打開來讀。
+        """
+        if not self.disk_dir:
+            return 0
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    files.append((os.stat(path).st_mtime, path))
+                except OSError:
+                    pass
+
+        files.sort()
+        fresh = [(mtime, path) for mtime, path in files if mtime + self.ttl > now]
+        n_expired = len(files) - len(fresh)
+        keep = self.disk_max_files - self.disk_max_files // 10
+        overflow = len(fresh) - keep if len(fresh) > self.disk_max_files else 0
+        doomed = [path for mtime, path in files if mtime + self.ttl <= now] + [path for _, path in fresh[:overflow]]
+        for path in doomed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        with self._lock:
+            self._last_sweep = now
+            self._disk_puts_since_sweep = 0
+            self.disk_files = len(fresh) - overflow
+            self.expired += n_expired
+            self.disk_evictions += overflow
+        if doomed:
+            print(f"🧹 結果快取磁碟層：刪掉過期 {n_expired} 個、超量 {overflow} 個，剩 {self.disk_files} 個")
+        return len(doomed)
+
+    # -----------------------------
+    # 管理
+    # -----------------------------
+    def invalidate_all(self) -> int:
+        """換了 best_model.pth 或重建 RAG 後手動清空，回傳清掉的記憶體筆數"""
+        with self._lock:
+            n = len(self._mem)
+            self._mem.clear()
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            for name in os.listdir(self.disk_dir):
+                shutil.rmtree(os.path.join(self.disk_dir, name), ignore_errors=True)
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.hits_memory + self.hits_disk
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._mem),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "disk_dir": self.disk_dir,
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (hits / lookups) if lookups else 0.0,
+                "puts": self.puts,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "disk_files": self.disk_files,
+                "disk_max_files": self.disk_max_files,
+                "disk_evictions": self.disk_evictions,
+            }
@@ -0,0 +1,358 @@
+# serve.py
+# 正式環境入口：prefork 多行程，模型權重 copy-on-write 共用
+#   python serve.py --workers 4 --port 5000
+#
+#   1. master 先載 ConvNeXt / BGE-m3 / 本地向量索引（不暖機），gc.freeze() 之後 fork 出 N 個 worker；
+#      權重所在的記憶體頁沒有人寫，所有 worker 共用同一份實體記憶體
+#   2. master 開好 listen socket，每個 worker 用 werkzeug make_server(fd=...) 一起 accept，由核心分配連線
+#   3. 每個 worker 的 torch thread 數 = 核心數 / worker 數，不會彼此搶 CPU
+#   4. Milvus 連線（gRPC）不能跨 fork，由各 worker 自己連；有 GPU 時 CUDA 也不能在 fork 前初始化，改由 worker 各自載
+#
+# 訊號（送給 master）：
+#   SIGTERM / SIGINT  所有 worker 停止接新請求，進行中的做完（最多 --graceful-timeout 秒）再結束
+#   SIGHUP            逐一換新 worker：新的暖機完成才停掉舊的，服務不中斷
+#   worker 意外結束會自動補一個
+#
+# 注意：/metrics、結果快取的記憶體層、RAG 檢索快取、LLM 准入佇列（LLM_MAX_CONCURRENT / LLM_MAX_QUEUE）
+#      都是每個 worker 各自一份；要跨 worker 共用結果快取請設 RESULT_CACHE_DIR。
+#      /jobs 的工作狀態一定要跨 worker 看得到，沒設 JOB_STATE_DIR 時這裡會開一個暫存資料夾。
+
+import argparse
+import gc
+import os
+import select
+import signal
+import socket
+import tempfile
+import threading
+import time
+import traceback
+
+
+def parse_args():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="skin_server 正式環境（prefork 多行程）")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "5000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_WORKERS", "0")),
+                        help="worker 行程數（0 = 核心數 / 2，至少 1）")
+    parser.add_argument("--torch-threads", type=int, default=int(os.environ.get("TORCH_THREADS_PER_WORKER", "0")),
+                        help="每個 worker 的 torch intra-op thread 數（0 = 核心數 / worker 數）")
+    parser.add_argument("--backlog", type=int, default=128)
+    parser.add_argument("--graceful-timeout", type=float, default=float(os.environ.get("GRACEFUL_TIMEOUT", "120")),
+                        help="停止 / 重啟時等進行中請求的秒數（LLM 報告可能要一兩分鐘）")
+    parser.add_argument("--ready-timeout", type=float, default=300.0,
+                        help="SIGHUP 換 worker 時，等新 worker 暖機的秒數")
+    parser.add_argument("--no-preload", action="store_true", help="不在 master 預載，每個 worker 自己載（較吃記憶體）")
+    args = parser.parse_args()
+    if args.workers <= 0:
+        args.workers = max(1, cpus // 2)
+    if args.torch_threads <= 0:
+        args.torch_threads = max(1, cpus // args.workers)
+    return args
+
+
+# -----------------------------
+# worker：數進行中的請求，收到 SIGTERM 後等它歸零再結束
+# -----------------------------
+class _InFlight:
+    """WSGI 包一層：串流回應算到 close（最後一個 byte 送完）為止"""
+
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self._cond = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        from werkzeug.wsgi import ClosingIterator
+
+        with self._cond:
+            self.count += 1
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        return ClosingIterator(body, self._done)
+
+    def _done(self):
+        with self._cond:
+            self.count -= 1
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.count > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+
+def worker_main(idx: int, fd: int, ready_w: int, args):
+    # Ctrl-C 會送給整個 process group，交給 master 統一處理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    import torch
+    torch.set_num_threads(args.torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # master 已經用過 inter-op pool 就不能再改
+
+    from werkzeug.serving import make_server
+    from app import app
+    from model_registry import registry
+
+    wsgi = _InFlight(app)
+    server = make_server(args.host, args.port, wsgi, threaded=True, fd=fd)
+    stopping = threading.Event()
+
+    def on_term(signum, frame):
+        if not stopping.is_set():
+            stopping.set()
+            # shutdown() 會等 serve_forever 結束，不能在 signal handler 的 thread 裡直接等
+            threading.Thread(target=server.shutdown, name="shutdown", daemon=True).start()
+
+    signal.signal(signal.SIGTERM, on_term)
+
+    # 權重已經在 master 載好，這裡只剩暖機 + Milvus 連線 + 預熱 RAG 快取
+    registry.start(background=True)
+
+    def report_ready():
+        ok = registry.wait_ready(args.ready_timeout)
+        try:
+            os.write(ready_w, b"1" if ok else b"0")
+            os.close(ready_w)
+        except OSError:
+            pass
+
+    threading.Thread(target=report_ready, name="report-ready", daemon=True).start()
+
+    print(f"👷 worker {idx}（pid {os.getpid()}）開始接請求，torch threads = {torch.get_num_threads()}")
+    server.serve_forever()
+
+    # 已經不再 accept；進行中的請求（包含還在串流的報告）做完才走
+    print(f"🛑 worker {idx}（pid {os.getpid()}）停止接新請求，等 {wsgi.count} 個進行中的請求完成")
+    if not wsgi.wait_idle(args.graceful_timeout):
+        print(f"⚠️ worker {idx} 等了 {args.graceful_timeout:.0f} 秒還有 {wsgi.count} 個請求沒完成，直接結束")
+    server.server_close()
+
+
+# -----------------------------
+# master：fork / 監看 / 重啟 worker
+# -----------------------------
+class Master:
+    def __init__(self, args, sock: socket.socket):
+        self.args = args
+        self.sock = sock
+        self.workers = {}       # pid → worker 編號
+        self.ready_fds = {}     # pid → 就緒通知的 pipe（讀端）
+        self.spawned_at = {}    # pid → fork 的時間
+        self.retiring = set()   # SIGHUP 換下來、正在收尾的舊 worker
+        self.stopping = False
+        self.reload = False
+        self.kill_deadline = None
+
+    def spawn(self, idx: int) -> int:
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 0
+            try:
+                worker_main(idx, self.sock.fileno(), ready_w, self.args)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                # 不要跑 master 留下來的 atexit / finally
+                os._exit(code)
+        os.close(ready_w)
+        self.workers[pid] = idx
+        self.ready_fds[pid] = ready_r
+        self.spawned_at[pid] = time.monotonic()
+        return pid
+
+    def _forget(self, pid: int):
+        fd = self.ready_fds.pop(pid, None)
+        if fd is not None:
+            os.close(fd)
+        self.spawned_at.pop(pid, None)
+        self.retiring.discard(pid)
+        return self.workers.pop(pid, None)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            retiring = pid in self.retiring
+            lived = time.monotonic() - self.spawned_at.get(pid, 0.0)
+            idx = self._forget(pid)
+            if idx is None or self.stopping or retiring:
+                continue
+            print(f"⚠️ worker {idx}（pid {pid}）意外結束（{_describe(status)}），重新啟動")
+            if lived < 5.0:
+                time.sleep(1.0)  # 一啟動就掛（例如設定錯），別瘋狂重開
+            self.spawn(idx)
+
+    def _wait_ready(self, pid: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not self.stopping:
+            fd = self.ready_fds.get(pid)
+            if fd is None:
+                return False  # 新 worker 自己掛了
+            readable, _, _ = select.select([fd], [], [], 1.0)
+            if readable:
+                return os.read(fd, 1) == b"1"
+            self.reap()
+        return False
+
+    def rolling_restart(self):
+        old = list(self.workers.items())
+        print(f"🔄 收到 SIGHUP，逐一替換 {len(old)} 個 worker")
+        for pid, idx in old:
+            if self.stopping:
+                return
+            if pid not in self.workers:
+                continue
+            new_pid = self.spawn(idx)
+            if not self._wait_ready(new_pid, self.args.ready_timeout):
+                print(f"⚠️ 新的 worker {idx}（pid {new_pid}）沒有在時間內就緒，仍然替換舊的")
+            # 標成收尾中：reap 到的時候不會被當成意外結束而再補一個
+            self.retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        print("✅ worker 替換完成")
+
+    def stop(self, signum=None, frame=None):
+        if self.stopping:
+            return
+        self.stopping = True
+        self.kill_deadline = time.monotonic() + self.args.graceful_timeout + 10.0
+        print(f"🛑 停止中：通知 {len(self.workers)} 個 worker 收尾")
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def request_reload(self, signum=None, frame=None):
+        self.reload = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.request_reload)
+
+        for idx in range(self.args.workers):
+            self.spawn(idx)
+        print(f"🟢 master（pid {os.getpid()}）：{self.args.workers} 個 worker，"
+              f"http://{self.args.host}:{self.args.port}")
+
+        while True:
+            self.reap()
+            if self.stopping:
+                if not self.workers:
+                    break
+                if time.monotonic() > self.kill_deadline:
+                    print(f"⚠️ 還有 {len(self.workers)} 個 worker 沒結束，強制停止")
+                    for pid in list(self.workers):
+                        try:
+                            os.kill(pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                    self.kill_deadline = float("inf")
+            elif self.reload:
+                self.reload = False
+                self.rolling_restart()
+            time.sleep(0.2)
+        self.sock.close()
+        print("👋 所有 worker 已結束")
+
+
+def _describe(status: int) -> str:
+    if os.WIFSIGNALED(status):
+        return f"signal {os.WTERMSIG(status)}"
+    return f"exit {os.WEXITSTATUS(status)}"
+
+
+def preload():
+    """
+    fork 前先把權重載進 master（不暖機、不跑 forward）；gRPC / CUDA 不能跨 fork 的就留給 worker。
+    LESION_BACKEND=optimized 也一樣：master 只轉好 channels_last 權重，compile / 暖機 / 比對在各 worker 暖機時做
+    """
+    import torch
+    import rag_milvus
+    from model_registry import registry
+
+    if torch.cuda.is_available():
+        print("⚠️ 偵測到 GPU：CUDA 不能在 fork 前初始化，模型改由各 worker 自己載")
+        return
+    names = ["classifier", "embedder"]
+    if rag_milvus.RAG_BACKEND == "local":
+        names.append("local_index")
+    t0 = time.perf_counter()
+    registry.preload(names)
+    rag_milvus.get_label_index()
+    print(f"📦 master 預先載入完成，{(time.perf_counter() - t0) * 1000:.0f} ms")
+
+
+def serve_single(args):
+    """沒有 fork 的平台（Windows）：單一行程 threaded server，至少不用 debug 模式 + reloader"""
+    import torch
+    torch.set_num_threads(os.cpu_count() or 1)
+    from werkzeug.serving import make_server
+    from app import app
+
+    print("⚠️ 這個平台不支援 fork，改用單一行程")
+    make_server(args.host, args.port, app, threaded=True).serve_forever()
+
+
+def main():
+    args = parse_args()
+    # 要在 import torch 之前設：master 載模型、各 worker 跑推論都用同樣的 thread 數
+    os.environ.setdefault("OMP_NUM_THREADS", str(args.torch_threads))
+    os.environ.setdefault("MKL_NUM_THREADS", str(args.torch_threads))
+    # HF tokenizers 的 Rust thread pool 在 fork 後會死結
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    # POST /jobs 跟之後的 GET /jobs/<id> 可能落在不同 worker
+    if args.workers > 1:
+        os.environ.setdefault("JOB_STATE_DIR", tempfile.mkdtemp(prefix="skin_jobs_"))
+
+    if not hasattr(os, "fork"):
+        serve_single(args)
+        return
+
+    # app.py 看到這個就不會在 import 時開始載模型，等 fork 之後由各 worker start
+    os.environ["SKIN_PREFORK"] = "1"
+    import app  # noqa: F401  路由、metrics 都在 fork 前 import 好，worker 共用
+
+    if not args.no_preload:
+        preload()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+
+    # 載入時產生的物件移到永久代，之後 GC 不會去碰（寫入）它們所在的記憶體頁，copy-on-write 才共用得住
+    gc.collect()
+    gc.freeze()
+
+    Master(args, sock).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# stage_pipeline.py
+# 小型相依圖（DAG）執行器：
+#   每個 stage 宣告自己依賴哪些 stage，相依都完成才丟進 thread pool，
+#   彼此獨立的 stage 就會同時跑；還沒開始的 stage 可以取消（投機查詢用）。
+#   每個 stage 的耗時記在 timings（毫秒），方便量測重疊後省了多少。
+
+import threading
+import time
+from concurrent.futures import Future, Executor
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+class StagePipeline:
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self.started_at = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self._stages: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    # -----------------------------
+    # 加入 stage
+    # -----------------------------
+    def add(self, name: str, fn: Callable[..., Any], deps: Iterable[str] = ()) -> Future:
+        """
+        fn 會拿到相依 stage 的結果當位置參數（順序同 deps）。
+        任何一個相依失敗或被取消，這個 stage 也跟著失敗。
+        """
+        dep_futs = [self._stages[d] for d in deps]
+        fut: Future = Future()
+        with self._lock:
+            if name in self._stages:
+                raise ValueError(f"stage 名稱重複：{name}")
+            self._stages[name] = fut
+
+        if not dep_futs:
+            self._launch(name, fn, fut, dep_futs)
+            return fut
+
+        remaining = [len(dep_futs)]
+        remaining_lock = threading.Lock()
+
+        def on_dep_done(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                self._launch(name, fn, fut, dep_futs)
+
+        for d in dep_futs:
+            d.add_done_callback(on_dep_done)
+        return fut
+
+    def _launch(self, name: str, fn: Callable[..., Any], fut: Future, dep_futs):
+        if fut.cancelled():
+            return
+        for d in dep_futs:
+            if d.cancelled():
+                self._fail(fut, RuntimeError(f"{name} 的相依 stage 已取消"))
+                return
+            if d.exception() is not None:
+                self._fail(fut, d.exception())
+                return
+        args = [d.result() for d in dep_futs]
+
+        def run():
+            if not fut.set_running_or_notify_cancel():
+                self.timings[name] = 0.0
+                return
+            t0 = time.perf_counter()
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                # 耗時要在 set_* 之前記：set_* 一呼叫等結果的人就醒了，可能馬上 report()
+                self.timings[name] = (time.perf_counter() - t0) * 1000.0
+                fut.set_exception(e)
+            else:
+                self.timings[name] = (time.perf_counter() - t0) * 1000.0
+                fut.set_result(result)
+
+        self.executor.submit(run)
+
+    @staticmethod
+    def _fail(fut: Future, exc: BaseException):
+        if fut.set_running_or_notify_cancel():
+            fut.set_exception(exc)
+
+    # -----------------------------
+    # 取結果 / 取消
+    # -----------------------------
+    def result(self, name: str, timeout: Optional[float] = None) -> Any:
+        return self._stages[name].result(timeout=timeout)
+
+    def cancel(self, name: str) -> bool:
+        """只取消還沒開始跑的 stage（耗時記 0）；已經在跑的就讓它跑完，回 False"""
+        fut = self._stages.get(name)
+        if fut is None or not fut.cancel():
+            return False
+        self.timings.setdefault(name, 0.0)
+        return True
+
+    def names(self):
+        return list(self._stages)
+
+    def record(self, name: str, ms: float):
+        """在 pipeline 外面量的階段（例如 LLM）也記進同一份 timings"""
+        self.timings[name] = ms
+
+    def report(self) -> Dict[str, float]:
+        out = {k: round(v, 1) for k, v in self.timings.items()}
+        out["total"] = round((time.perf_counter() - self.started_at) * 1000.0, 1)
+        return out
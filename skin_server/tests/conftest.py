@@ -0,0 +1,6 @@
+# conftest.py
+# skin_server 的模組都是平的（import lesion_model、import rag_milvus…），測試從 skin_server/ 底下 import
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
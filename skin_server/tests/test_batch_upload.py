@@ -0,0 +1,112 @@
+# test_batch_upload.py
+# /predict_batch、/analyze_batch 的 zip 上限：張數、單張大小、解壓後總量、壞掉的 zip / 成員都回 400
+# 分類換成假的 predict_lesion_batch，不用載模型
+
+import io
+import zipfile
+
+import pytest
+
+ENDPOINTS = ["/predict_batch", "/analyze_batch"]
+
+
+@pytest.fixture(scope="module")
+def app_module():
+    with pytest.MonkeyPatch.context() as mp:
+        # 不要在 import 時背景載模型
+        mp.setenv("SKIN_PREFORK", "1")
+        import app
+    return app
+
+
+@pytest.fixture
+def client(app_module, monkeypatch):
+    calls = []
+
+    def fake_batch(images, tta=None):
+        calls.append(list(images))
+        return [{"top1": {"label": "濕疹", "confidence": 0.9}, "top3": []} for _ in images]
+
+    monkeypatch.setattr(app_module, "predict_lesion_batch", fake_batch)
+    monkeypatch.setattr(app_module, "MAX_BATCH_IMAGES", 3)
+    monkeypatch.setattr(app_module, "MAX_ZIP_MEMBER_BYTES", 1000)
+    monkeypatch.setattr(app_module, "MAX_ZIP_TOTAL_BYTES", 2500)
+    client = app_module.app.test_client()
+    client.calls = calls
+    return client
+
+
+def _zip(members, compression=zipfile.ZIP_DEFLATED):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def _post(client, url, archive):
+    return client.post(url, data={"images": (io.BytesIO(archive), "batch.zip")},
+                       content_type="multipart/form-data")
+
+
+@pytest.mark.parametrize("url", ENDPOINTS)
+def test_zip_images_are_classified_in_order(client, url):
+    archive = _zip([("a.jpg", b"a" * 10), ("notes.txt", b"x"), ("__MACOSX/._a.jpg", b"y"), ("b.png", b"b" * 10)])
+    resp = _post(client, url, archive)
+    assert resp.status_code == 200
+    assert [r["image"] for r in resp.get_json()["results"]] == ["a.jpg", "b.png"]
+    assert client.calls == [[b"a" * 10, b"b" * 10]]
+
+
+@pytest.mark.parametrize("url", ENDPOINTS)
+def test_too_many_entries(client, url):
+    archive = _zip([(f"{i}.jpg", b"x" * 10) for i in range(4)])
+    resp = _post(client, url, archive)
+    assert resp.status_code == 400 and "3" in resp.get_json()["error"]
+    assert client.calls == []
+
+
+@pytest.mark.parametrize("url", ENDPOINTS)
+def test_member_too_large(client, url):
+    archive = _zip([("big.jpg", b"\0" * 1001)])
+    resp = _post(client, url, archive)
+    assert resp.status_code == 400 and "big.jpg" in resp.get_json()["error"]
+    assert client.calls == []
+
+
+@pytest.mark.parametrize("url", ENDPOINTS)
+def test_total_uncompressed_size(client, url):
+    # 每張都在單張上限內，但解壓後加起來超過總量（高壓縮比）
+    archive = _zip([(f"{i}.jpg", b"\0" * 900) for i in range(3)])
+    assert len(archive) < 1000
+    resp = _post(client, url, archive)
+    assert resp.status_code == 400 and "2500" in resp.get_json()["error"]
+    assert client.calls == []
+
+
+@pytest.mark.parametrize("url", ENDPOINTS)
+def test_member_with_forged_size(client, url):
+    # 中央目錄宣稱只有 10 bytes，實際內容 5000 bytes
+    archive = bytearray(_zip([("liar.jpg", b"\0" * 5000)], zipfile.ZIP_STORED))
+    central = archive.rindex(b"PK\x01\x02")
+    archive[central + 24:central + 28] = (10).to_bytes(4, "little")
+    resp = _post(client, url, bytes(archive))
+    assert resp.status_code == 400 and "liar.jpg" in resp.get_json()["error"]
+    assert client.calls == []
+
+
+@pytest.mark.parametrize("url", ENDPOINTS)
+def test_not_a_zip(client, url):
+    resp = _post(client, url, b"PK\x03\x04 garbage")
+    assert resp.status_code == 400 and "batch.zip" in resp.get_json()["error"]
+
+
+@pytest.mark.parametrize("url", ENDPOINTS)
+def test_corrupt_member(client, url):
+    archive = bytearray(_zip([("ok.jpg", b"a" * 50), ("bad.jpg", b"b" * 50)], zipfile.ZIP_STORED))
+    # 改掉 bad.jpg 的內容，CRC 對不上
+    start = archive.index(b"b" * 50)
+    archive[start:start + 4] = b"XXXX"
+    resp = _post(client, url, bytes(archive))
+    assert resp.status_code == 400 and "bad.jpg" in resp.get_json()["error"]
+    assert client.calls == []
@@ -0,0 +1,244 @@
+# test_build_dermnet_index.py
+import json
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import build_dermnet_index as bdi
+
+
+class FakeCollection:
+    """跟 Milvus 一樣：insert 不去重，upsert 依主鍵（fp）覆蓋"""
+
+    def __init__(self):
+        self.rows = []
+
+    def insert(self, columns):
+        self.rows += columns[0]
+
+    def upsert(self, columns):
+        for fp in columns[0]:
+            if fp in self.rows:
+                self.rows.remove(fp)
+            self.rows.append(fp)
+
+    def delete(self, expr):
+        gone = set(json.loads(expr.split(" in ", 1)[1]))
+        self.rows = [fp for fp in self.rows if fp not in gone]
+
+    def flush(self):
+        pass
+
+    def load(self):
+        pass
+
+
+class CrashingCheckpoint(bdi.Checkpoint):
+    """第 crash_at 次存 checkpoint 時當掉：sink 已經寫了、checkpoint 還沒存"""
+
+    def __init__(self, path, key, crash_at):
+        super().__init__(path, key)
+        self.saves = 0
+        self.crash_at = crash_at
+
+    def save(self, done, sink_state):
+        self.saves += 1
+        if self.saves == self.crash_at:
+            raise RuntimeError("crash before checkpoint")
+        super().save(done, sink_state)
+
+
+@pytest.fixture
+def fake_milvus(monkeypatch):
+    collection = FakeCollection()
+    fake = types.ModuleType("pymilvus")
+    fake.Collection = lambda name: collection
+    fake.connections = types.SimpleNamespace(connect=lambda **kw: None)
+    monkeypatch.setitem(sys.modules, "pymilvus", fake)
+    monkeypatch.setattr(bdi, "create_milvus_collection", lambda: collection)
+    return collection
+
+
+def _items(n):
+    return [{"fp": f"fp{i}", "title": f"t{i}", "url": f"u{i}", "content": f"c{i}"} for i in range(n)]
+
+
+def _vectors(batch):
+    return np.zeros((len(batch), 4), dtype=np.float32)
+
+
+def test_full_mode_resume_does_not_duplicate_rows(fake_milvus, tmp_path):
+    items = _items(10)
+    path = str(tmp_path / "ckpt.json")
+
+    crashing = CrashingCheckpoint(path, {"k": 1}, crash_at=2)
+    with pytest.raises(RuntimeError):
+        bdi.run_pipeline(iter(items), len(items), bdi.MilvusSink("full"), _vectors, crashing, chunk_size=4)
+    # 第二批已經進 Milvus，checkpoint 只記到第一批
+    assert len(fake_milvus.rows) == 8
+
+    checkpoint = bdi.Checkpoint(path, {"k": 1})
+    saved = checkpoint.load()
+    assert saved["done"] == 4
+    sink = bdi.MilvusSink("full", resume_state=saved["sink"])
+    done = bdi.run_pipeline(iter(items[saved["done"]:]), len(items), sink, _vectors, checkpoint,
+                            done=saved["done"], chunk_size=4)
+
+    assert done == 10
+    assert sorted(fake_milvus.rows) == sorted(it["fp"] for it in items)
+
+
+def test_local_resume_after_crash_writes_every_item_once(tmp_path):
+    from local_vector_index import LocalVectorIndex
+
+    items = _items(10)
+    index_dir = str(tmp_path / "local")
+    path = str(tmp_path / "ckpt.json")
+
+    def vectors(batch):
+        vecs = np.zeros((len(batch), bdi.EMBED_DIM), dtype=np.float32)
+        vecs[np.arange(len(batch)), [int(it["fp"][2:]) for it in batch]] = 1.0
+        return vecs
+
+    crashing = CrashingCheckpoint(path, {"k": 1}, crash_at=2)
+    with pytest.raises(RuntimeError):
+        bdi.run_pipeline(iter(items), len(items), bdi.LocalSink(index_dir), vectors, crashing, chunk_size=4)
+
+    checkpoint = bdi.Checkpoint(path, {"k": 1})
+    saved = checkpoint.load()
+    assert saved["done"] == 4
+    assert bdi.Checkpoint(path, {"k": 2}).load() is None  # 參數不一樣就不接著做
+    sink = bdi.LocalSink(index_dir, resume_state=saved["sink"])
+    bdi.run_pipeline(iter(items[saved["done"]:]), len(items), sink, vectors, checkpoint,
+                     done=saved["done"], chunk_size=4)
+    sink.commit()
+
+    index = LocalVectorIndex(index_dir)
+    try:
+        assert [index.row(i)["fp"] for i in range(len(index))] == [it["fp"] for it in items]
+        assert np.argmax(index.vectors, axis=1).tolist() == list(range(10))
+    finally:
+        index.close()
+
+
+def test_iter_items_streams_every_format(tmp_path):
+    (tmp_path / "a.json").write_text(json.dumps(
+        [{"title": "濕疹", "content": "皮膚發炎"}, "痤瘡", ["乾癬", "脫屑"]], ensure_ascii=False), encoding="utf-8")
+    (tmp_path / "b.json").write_text(json.dumps(
+        {"items": [{"title": "濕疹", "content": "皮膚發炎"}]}, ensure_ascii=False), encoding="utf-8")
+    (tmp_path / "notes.txt").write_text("不是 JSON", encoding="utf-8")
+
+    items = list(bdi.iter_items(str(tmp_path), verbose=False))
+    assert [it["title"] for it in items] == ["濕疹", "痤瘡", "乾癬；脫屑", "濕疹"]
+    # 完全相同的條目不去掉，指紋加上序號
+    assert items[3]["fp"] == items[0]["fp"] + "-1"
+    assert len({it["fp"] for it in items}) == 4
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    """假語料 + 假 embedding：記下每次真的 embed 了哪些內容"""
+    src = tmp_path / "rag_sources"
+    src.mkdir()
+    monkeypatch.setattr(bdi, "JSON_DIR", str(src))
+    monkeypatch.setattr(bdi, "milvus_supports_incremental", lambda: True)
+    monkeypatch.setattr(bdi, "write_index_version", lambda name, count: "v")
+    embedded = []
+
+    def embed(texts, batch_size=64, token_budget=None):
+        embedded.extend(texts)
+        vecs = np.zeros((len(texts), bdi.EMBED_DIM), dtype=np.float32)
+        vecs[:, 0] = 1.0
+        return vecs
+
+    monkeypatch.setattr(bdi, "embed_texts", embed)
+
+    def write(entries):
+        (src / "terms.json").write_text(json.dumps(
+            [{"title": t, "url": f"https://x/{t}", "content": c} for t, c in entries], ensure_ascii=False),
+            encoding="utf-8")
+
+    def run(backend):
+        embedded.clear()
+        monkeypatch.setattr(sys, "argv", [
+            "build_dermnet_index.py", "--incremental", "--backend", backend,
+            "--local-dir", str(tmp_path / "local"), "--manifest", str(tmp_path / "manifest.json"),
+            "--checkpoint", str(tmp_path / "ckpt.json"), "--label-index", "",
+        ])
+        bdi.main()
+        return list(embedded)
+
+    return write, run
+
+
+def _fps(entries):
+    return sorted(bdi.item_fingerprint(t, f"https://x/{t}", c) for t, c in entries)
+
+
+def test_incremental_milvus_adds_changes_and_removes(fake_milvus, corpus):
+    write, run = corpus
+    write([("濕疹", "很癢"), ("痤瘡", "粉刺"), ("乾癬", "脫屑")])
+    assert sorted(run("milvus")) == ["很癢", "粉刺", "脫屑"]
+
+    second = [("濕疹", "癢到睡不著"), ("痤瘡", "粉刺"), ("蕁麻疹", "膨疹")]
+    write(second)
+    # 只 embed 改過的跟新的；乾癬、舊版濕疹從 collection 刪掉
+    assert sorted(run("milvus")) == ["癢到睡不著", "膨疹"]
+    assert sorted(fake_milvus.rows) == _fps(second)
+
+    assert run("milvus") == []
+
+
+def test_incremental_local_adds_changes_and_removes(corpus, tmp_path):
+    from local_vector_index import LocalVectorIndex
+
+    write, run = corpus
+    write([("濕疹", "很癢"), ("痤瘡", "粉刺"), ("乾癬", "脫屑")])
+    assert sorted(run("local")) == ["很癢", "粉刺", "脫屑"]
+
+    second = [("濕疹", "癢到睡不著"), ("痤瘡", "粉刺"), ("蕁麻疹", "膨疹")]
+    write(second)
+    assert sorted(run("local")) == ["癢到睡不著", "膨疹"]
+
+    index = LocalVectorIndex(str(tmp_path / "local"))
+    try:
+        rows = [index.row(i) for i in range(len(index))]
+    finally:
+        index.close()
+    assert sorted(r["fp"] for r in rows) == _fps(second)
+    assert {r["title"]: r["content"] for r in rows}["濕疹"] == "癢到睡不著"
+
+    assert run("local") == []
+
+
+def test_plan_batches_respects_token_budget():
+    lengths = [5, 300, 40, 120, 7, 64, 300, 2]
+    batches = bdi.plan_batches(lengths, token_budget=600, max_batch=3)
+
+    assert sorted(i for b in batches for i in b) == list(range(len(lengths)))
+    for b in batches:
+        assert len(b) <= 3
+        # 一個 batch 會 pad 到最長那筆
+        assert len(b) == 1 or len(b) * max(lengths[i] for i in b) <= 600
+
+
+def test_plan_batches_oversized_text_gets_its_own_batch():
+    batches = bdi.plan_batches([5000, 10, 10], token_budget=1000, max_batch=8)
+    assert [0] in batches
+    assert sorted(i for b in batches for i in b) == [0, 1, 2]
+
+
+def test_encode_batch_splits_failed_batch_and_keeps_order():
+    class OomModel:
+        def encode(self, texts, batch_size, max_length):
+            if len(texts) > 2:
+                raise RuntimeError("CUDA out of memory")
+            vecs = np.zeros((len(texts), bdi.EMBED_DIM), dtype=np.float32)
+            vecs[:, 0] = [int(t) for t in texts]
+            return {"dense_vecs": vecs}
+
+    emb = bdi._encode_batch(OomModel(), [str(i) for i in range(7)])
+    assert emb.shape == (7, bdi.EMBED_DIM)
+    assert emb[:, 0].tolist() == list(range(7))
@@ -0,0 +1,51 @@
+# test_context_packer.py
+# pack_context：去重、不超過 token 預算、每段報告都有素材、句子照原文順序
+
+import pytest
+
+from context_packer import _header, estimate_tokens, pack_context, split_sentences
+
+ECZEMA = ("濕疹是一種常見的慢性皮膚發炎疾病。"
+          + "".join(f"患者第{i}天會出現紅斑與搔癢的症狀。" for i in range(40))
+          + "遺傳與環境因素會引起惡化。治療以保濕與外用類固醇乳膏為主。若出現感染應立即就醫檢查。")
+
+HITS = [
+    {"title": "濕疹", "url": "u1", "content": ECZEMA, "score": 0.9},
+    {"title": "濕疹摘要", "url": "u1", "content": ECZEMA[:200], "score": 0.8},  # 長文的一段 → 重複
+    {"title": "異位性皮膚炎", "url": "u2", "content": "異位性皮膚炎與遺傳因素有關。常見於兒童。" * 5, "score": 0.7},
+]
+
+
+def _prompt_tokens(packed):
+    return sum(estimate_tokens(_header(i, h)) + estimate_tokens(h["content"])
+               for i, h in enumerate(packed, start=1))
+
+
+@pytest.mark.parametrize("budget", [40, 60, 150, 400, 800])
+def test_packed_context_stays_within_budget(budget):
+    packed, stats = pack_context(HITS, "濕疹", budget)
+    assert stats["tokens"] <= budget
+    assert _prompt_tokens(packed) <= budget
+    assert stats["duplicates"] == 1
+    assert all(h["title"] != "濕疹摘要" for h in packed)
+
+
+def test_every_report_section_gets_material():
+    packed, _ = pack_context(HITS, "濕疹", 150)
+    text = "".join(h["content"] for h in packed)
+    assert "是一種" in text      # 簡介
+    assert "治療" in text        # 照護
+    assert "就醫" in text        # 就醫
+
+
+def test_sentences_keep_source_order():
+    packed, _ = pack_context(HITS, "濕疹", 400)
+    eczema = next(h for h in packed if h["title"] == "濕疹")
+    positions = [ECZEMA.index(s.rstrip("。")) for s in split_sentences(eczema["content"])]
+    assert positions == sorted(positions)
+
+
+def test_zero_budget_passes_hits_through():
+    packed, stats = pack_context(HITS, "濕疹", 0)
+    assert [h["content"] for h in packed] == [h["content"] for h in HITS]
+    assert stats["hits_used"] == 3
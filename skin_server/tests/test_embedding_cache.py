@@ -0,0 +1,112 @@
+# test_embedding_cache.py
+# EmbeddingCache：重開還在、多個實例共用、壓縮留最近用到的、encode_cached 只算沒快取的
+
+import os
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache, encode_cached
+
+DIM = 4
+MODEL = "test-model"
+
+
+def _vec(i):
+    return np.full(DIM, float(i), dtype=np.float32)
+
+
+def _texts(n):
+    return [f"文字{i}" for i in range(n)]
+
+
+def test_round_trip_survives_reopen(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, DIM)
+    cache.put_many(_texts(3), np.stack([_vec(i) for i in range(3)]))
+
+    reopened = EmbeddingCache(str(tmp_path), MODEL, DIM)
+    got = reopened.get_many(_texts(3) + ["沒看過"])
+    assert [v[0] for v in got[:3]] == [0.0, 1.0, 2.0]
+    assert got[3] is None
+
+
+def test_other_instance_sees_new_rows(tmp_path):
+    # 兩個實例 = builder 跟伺服器 worker 同時開著同一個資料夾
+    writer = EmbeddingCache(str(tmp_path), MODEL, DIM)
+    reader = EmbeddingCache(str(tmp_path), MODEL, DIM)
+    assert reader.get_many(["a"]) == [None]
+    writer.put_many(["a"], _vec(7)[None])
+    assert reader.get_many(["a"])[0][0] == 7.0
+
+
+def test_compaction_keeps_recently_used_entries(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, DIM, max_entries=8)
+    other = EmbeddingCache(str(tmp_path), MODEL, DIM, max_entries=8)
+    texts = _texts(9)
+    cache.put_many(texts[:8], np.stack([_vec(i) for i in range(8)]))
+    old_files = {n for n in os.listdir(tmp_path) if n.startswith(("vectors-", "index-"))}
+
+    cache.get_many(texts[:4])                # 0～3 剛用過
+    cache.put_many(texts[8:], _vec(8)[None])  # 第 9 筆 → 超過上限，壓縮成 6 筆
+
+    assert cache.stats()["compactions"] == 1
+    assert cache.stats()["entries"] == 6
+    got = cache.get_many(texts)
+    kept = [i for i, v in enumerate(got) if v is not None]
+    assert kept == [0, 1, 2, 3, 7, 8]
+    # 重新編號後向量還對得上
+    assert all(got[i][0] == float(i) for i in kept)
+
+    # 舊一代刪掉了，另一個實例換到新一代
+    assert not old_files & set(os.listdir(tmp_path))
+    assert [v is not None for v in other.get_many(texts)] == [i in kept for i in range(9)]
+
+
+def test_encode_cached_only_encodes_misses_once(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, DIM)
+    cache.put_many(["舊的"], _vec(1)[None])
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return np.stack([_vec(len(t)) for t in texts])
+
+    out = encode_cached(cache, ["舊的", "新", "新", "更新的"], encode, DIM)
+    assert calls == [["新", "更新的"]]
+    assert out[:, 0].tolist() == [1.0, 1.0, 1.0, 3.0]
+
+    encode_cached(cache, ["新", "更新的"], encode, DIM)
+    assert len(calls) == 1
+
+
+def test_model_change_starts_fresh(tmp_path):
+    EmbeddingCache(str(tmp_path), MODEL, DIM).put_many(["a"], _vec(1)[None])
+    assert EmbeddingCache(str(tmp_path), "other-model", DIM).get_many(["a"]) == [None]
+
+
+def test_reader_survives_compaction_by_another_instance(tmp_path):
+    writer = EmbeddingCache(str(tmp_path), MODEL, DIM, max_entries=8)
+    texts = _texts(9)
+    writer.put_many(texts[:4], np.stack([_vec(i) for i in range(4)]))
+
+    # reader 已經知道前 4 筆的 slot，但還沒 mmap 過向量檔
+    reader = EmbeddingCache(str(tmp_path), MODEL, DIM, max_entries=8)
+    writer.put_many(texts[4:], np.stack([_vec(i) for i in range(4, 9)]))  # 超過上限 → 壓縮、刪掉舊一代
+    assert writer.stats()["compactions"] == 1
+
+    got = reader.get_many(texts[:4])
+    kept = writer.get_many(texts[:4])
+    assert any(v is not None for v in got)
+    assert [v is not None for v in got] == [v is not None for v in kept]
+    assert all(v[0] == float(i) for i, v in enumerate(got) if v is not None)
+
+
+def test_encode_cached_falls_back_when_cache_breaks(tmp_path):
+    class Broken:
+        def get_many(self, texts):
+            raise OSError("disk gone")
+
+        def put_many(self, texts, vectors):
+            raise OSError("disk gone")
+
+    out = encode_cached(Broken(), ["a", "bb"], lambda ts: np.stack([_vec(len(t)) for t in ts]), DIM)
+    assert out[:, 0].tolist() == [1.0, 2.0]
@@ -0,0 +1,83 @@
+# test_fast_preprocess.py
+import io
+import os
+import subprocess
+import sys
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+import fast_preprocess
+
+# 訓練.py 的 transform_val / lesion_model.transform
+REFERENCE = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+])
+
+
+def _jpeg(w=1200, h=900, orientation=None):
+    rng = np.random.default_rng(0)
+    # 平滑一點的圖，JPEG 壓縮 / draft 縮圖的誤差才有意義
+    small = rng.integers(0, 255, (h // 50, w // 50, 3), dtype=np.uint8)
+    img = Image.fromarray(small).resize((w, h), Image.BICUBIC)
+    buf = io.BytesIO()
+    if orientation is None:
+        img.save(buf, "JPEG", quality=95)
+    else:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        img.save(buf, "JPEG", quality=95, exif=exif.tobytes())
+    return buf.getvalue()
+
+
+def test_full_decode_matches_training_transform():
+    data = _jpeg()
+    ref = REFERENCE(Image.open(io.BytesIO(data)).convert("RGB"))
+    out = fast_preprocess.to_tensor_into(
+        fast_preprocess.load_resized(data, draft_factor=0, exif_transpose=False), torch.empty(3, 224, 224))
+    assert torch.allclose(out, ref, atol=1e-5)
+
+
+def test_draft_decode_stays_close():
+    data = _jpeg(4000, 3000)
+    ref = REFERENCE(Image.open(io.BytesIO(data)).convert("RGB"))
+    out = fast_preprocess.to_tensor_into(
+        fast_preprocess.load_resized(data, draft_factor=2, exif_transpose=False), torch.empty(3, 224, 224))
+    assert (out - ref).abs().mean().item() < 0.02
+
+
+def test_exif_orientation_is_applied():
+    data = _jpeg(1200, 900, orientation=6)
+    img = fast_preprocess.load_resized(data, size=224, draft_factor=0, exif_transpose=True)
+    ref = Image.open(io.BytesIO(data)).convert("RGB").transpose(Image.Transpose.ROTATE_270).resize(
+        (224, 224), Image.BILINEAR)
+    assert np.abs(np.asarray(img, dtype=np.int16) - np.asarray(ref, dtype=np.int16)).max() <= 1
+
+
+def test_writes_into_batch_slot():
+    batch = torch.zeros(2, 3, 224, 224)
+    fast_preprocess.preprocess(_jpeg(), out=batch[1])
+    assert batch[0].abs().sum() == 0
+    assert batch[1].abs().sum() > 0
+
+
+
+def test_import_leaves_warning_filters_alone():
+    # 不能靠改整個行程的 warnings filter（會把 PIL 的 DecompressionBombWarning 之類一起吃掉），
+    # torch 的警告一個行程只報一次，所以開新的 python 看
+    code = (
+        "import warnings, io, numpy as np, torch\n"
+        "from PIL import Image\n"
+        "before = list(warnings.filters)\n"
+        "import fast_preprocess\n"
+        "assert warnings.filters == before, 'filters changed'\n"
+        "warnings.simplefilter('error')\n"
+        "buf = io.BytesIO(); Image.new('RGB', (300, 200), 'red').save(buf, 'JPEG')\n"
+        "fast_preprocess.preprocess(buf.getvalue())\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True,
+                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,90 @@
+# test_label_index.py
+# 標籤字面索引：NFKC / 簡繁 / 異體字收斂、"英文 - 中文（別名）" 拆成各個 key、查得到就不走向量檢索
+
+import pytest
+
+from label_index import build_label_index, candidate_keys, load_label_index, normalize_term, write_label_index
+
+MAPPING = [
+    {"term_en": "Acne", "term_zh_standard": "痤瘡", "synonyms_tw": ["青春痘", "粉刺"],
+     "url": "https://dermnetnz.org/topics/acne"},
+    {"term_en": "Pemphigus", "term_zh_standard": "天疱瘡", "term_zh_raw": "天皰瘡",
+     "url": "https://dermnetnz.org/topics/pemphigus"},
+    {"term_en": "Eczema", "term_zh_standard": "湿疹", "url": "https://dermnetnz.org/topics/eczema"},
+    {"term_en": "No docs", "url": "https://dermnetnz.org/topics/missing"},
+]
+DOCS = [
+    {"title": "粉刺", "url": "https://dermnetnz.org/topics/acne", "content": "粉刺的說明" * 10},
+    {"title": "痤瘡（青春痘）", "url": "https://dermnetnz.org/topics/acne", "content": "痤瘡"},
+    {"title": "天疱瘡", "url": "https://dermnetnz.org/topics/pemphigus", "content": "天疱瘡是一種水疱病"},
+    {"title": "濕疹", "url": "https://dermnetnz.org/topics/eczema", "content": "濕疹很癢"},
+    {"title": "沒有名稱對照", "url": "https://dermnetnz.org/topics/other", "content": "x"},
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "labels.json")
+    write_label_index(build_label_index(MAPPING, DOCS, "bge-m3"), path)
+    return load_label_index(path)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("ＡＣＮＥ", "acne"),                      # 全形 → 半形、大小寫
+    ("Acne  Vulgaris", "acne-vulgaris"),       # 空白 / 標點
+    ("湿疹", "濕疹"),                          # 簡 → 繁
+    ("银屑病", "銀屑病"),
+    ("天皰瘡", "天疱瘡"),                      # 異體字
+    ("體癬", "體蘚"),
+    ("痤瘡（青春痘）", "痤瘡(青春痘)"),        # 全形括號
+])
+def test_normalize_term_folds_variants(a, b):
+    assert normalize_term(a) == normalize_term(b)
+
+
+def test_candidate_keys_split_bilingual_label():
+    assert candidate_keys("Acne - 痤瘡（青春痘）") == [
+        "acne痤瘡青春痘", "acne痤瘡", "acne", "痤瘡青春痘", "痤瘡", "青春痘"]
+    assert candidate_keys("濕疹") == ["濕疹"]
+    assert candidate_keys("  ") == []
+
+
+def test_build_only_keeps_docs_reachable_from_names(index):
+    titles = {d["title"] for d in index.docs}
+    assert titles == {"粉刺", "痤瘡（青春痘）", "天疱瘡", "濕疹"}
+    assert index.model == "bge-m3"
+
+
+@pytest.mark.parametrize("query, title", [
+    ("Acne - 痤瘡（青春痘）", "痤瘡（青春痘）"),
+    ("青春痘", "痤瘡（青春痘）"),
+    ("天皰瘡", "天疱瘡"),             # 異體字
+    ("Eczema - 湿疹", "濕疹"),        # 簡體標籤
+    ("ECZEMA", "濕疹"),
+])
+def test_lookup_resolves_label_variants(index, query, title):
+    hits = index.lookup(query)
+    assert hits and title in [h["title"] for h in hits]
+    assert all({"title", "url", "content", "score"} <= set(h) for h in hits)
+
+
+def test_lookup_miss_and_top_k(index):
+    assert index.lookup("Lichen - 苔癬") is None
+    assert len(index.lookup("Acne", top_k=1)) == 1
+
+
+def test_missing_index_file(tmp_path):
+    assert load_label_index(str(tmp_path / "nope.json")) is None
+    assert load_label_index("") is None
+
+
+def test_exact_title_ranks_before_synonym(index):
+    # 同一個網址的文件照內容長度存（粉刺比較長），但查詢字面對到的標題要排前面
+    hits = index.lookup("Acne - 痤瘡（青春痘）")
+    assert [(h["title"], h["score"]) for h in hits] == [("痤瘡（青春痘）", 1.0), ("粉刺", 0.9)]
+
+
+def test_folded_match_scores_below_exact(index):
+    assert index.lookup("天疱瘡")[0]["score"] == 1.0
+    assert index.lookup("天皰瘡")[0]["score"] == 0.95   # 異體字收斂後才一樣
+    assert index.lookup("Eczema - 湿疹")[0]["score"] == 0.95
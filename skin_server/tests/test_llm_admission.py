@@ -0,0 +1,121 @@
+# test_llm_admission.py
+# AdmissionController：同時上限、優先序、佇列滿拒絕、報告擠掉聊天
+
+import threading
+import time
+
+import pytest
+
+from llm_admission import PRIORITY_CHAT, PRIORITY_REPORT, AdmissionController, QueueFullError
+
+
+def _wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "等太久"
+        time.sleep(0.005)
+
+
+class _Client(threading.Thread):
+    """在背景排隊，拿到名額後記下來，等 done 才釋放"""
+
+    def __init__(self, ctrl, priority, name, order):
+        super().__init__(daemon=True)
+        self.ctrl, self.priority, self.name_, self.order = ctrl, priority, name, order
+        self.error = None
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            with self.ctrl.slot(self.priority):
+                self.order.append(self.name_)
+                self.done.wait(5)
+        except QueueFullError as e:
+            self.error = e
+
+
+def test_full_queue_rejects_with_retry_hint():
+    ctrl = AdmissionController(max_concurrent=1, max_queue=1, initial_service_time=10.0)
+    ctrl.acquire()
+    order = []
+    queued = _Client(ctrl, PRIORITY_REPORT, "queued", order)
+    queued.start()
+    _wait_for(lambda: ctrl.stats()["queue_depth"] == 1)
+
+    with pytest.raises(QueueFullError) as exc:
+        ctrl.acquire(PRIORITY_REPORT)
+    assert exc.value.queue_depth == 1
+    assert exc.value.retry_after >= 1 and exc.value.estimated_wait > 0
+    with pytest.raises(QueueFullError):
+        ctrl.check(PRIORITY_REPORT)
+
+    ctrl.release()
+    _wait_for(lambda: order == ["queued"])
+    queued.done.set()
+    queued.join(5)
+    assert ctrl.stats()["active"] == 0
+    assert ctrl.stats()["rejected"] == 2
+
+
+def test_report_evicts_queued_chat():
+    ctrl = AdmissionController(max_concurrent=1, max_queue=1)
+    ctrl.acquire()
+    order = []
+    chat = _Client(ctrl, PRIORITY_CHAT, "chat", order)
+    chat.start()
+    _wait_for(lambda: ctrl.stats()["queue_depth"] == 1)
+
+    ctrl.check(PRIORITY_REPORT)  # 可以擠掉聊天，不擋
+    report = _Client(ctrl, PRIORITY_REPORT, "report", order)
+    report.start()
+    chat.join(5)
+    assert isinstance(chat.error, QueueFullError)
+    assert ctrl.stats()["evicted"] == 1
+
+    ctrl.release()
+    _wait_for(lambda: order == ["report"])
+    report.done.set()
+    report.join(5)
+
+
+def test_chat_cannot_evict_report():
+    ctrl = AdmissionController(max_concurrent=1, max_queue=1)
+    ctrl.acquire()
+    order = []
+    report = _Client(ctrl, PRIORITY_REPORT, "report", order)
+    report.start()
+    _wait_for(lambda: ctrl.stats()["queue_depth"] == 1)
+
+    with pytest.raises(QueueFullError):
+        ctrl.acquire(PRIORITY_CHAT)
+    ctrl.release()
+    report.done.set()
+    report.join(5)
+    assert order == ["report"]
+
+
+def test_reports_are_served_before_earlier_chats():
+    ctrl = AdmissionController(max_concurrent=1, max_queue=4)
+    ctrl.acquire()
+    order = []
+    clients = []
+    for name, prio in [("chat1", PRIORITY_CHAT), ("chat2", PRIORITY_CHAT), ("report", PRIORITY_REPORT)]:
+        c = _Client(ctrl, prio, name, order)
+        c.done.set()  # 拿到就放
+        c.start()
+        clients.append(c)
+        _wait_for(lambda n=len(clients): ctrl.stats()["queue_depth"] == n)
+
+    ctrl.release()
+    for c in clients:
+        c.join(5)
+    assert order == ["report", "chat1", "chat2"]
+
+
+def test_queue_timeout():
+    ctrl = AdmissionController(max_concurrent=1, max_queue=2, queue_timeout=0.05)
+    ctrl.acquire()
+    with pytest.raises(QueueFullError):
+        ctrl.acquire()
+    stats = ctrl.stats()
+    assert stats["timed_out"] == 1 and stats["queue_depth"] == 0
@@ -0,0 +1,97 @@
+# test_local_vector_index.py
+# 本地向量索引：寫入 → commit → 讀取、IVF 重排後 metadata 還對得上、中途掛掉用 checkpoint 接著寫
+
+import os
+
+import numpy as np
+import pytest
+
+from local_vector_index import INDEX_FILE, LocalIndexWriter, LocalVectorIndex, write_local_index
+
+DIM = 16
+
+
+def _data(n, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+    rows = [{"title": f"條目{i}", "url": f"https://example.org/{i}", "content": "內容" * (i % 5)}
+            for i in range(n)]
+    return rows, vectors
+
+
+@pytest.mark.parametrize("kind", ["flat", "ivf"])
+def test_write_then_search_returns_own_row(tmp_path, kind):
+    rows, vectors = _data(60)
+    info = write_local_index(str(tmp_path), rows, vectors, kind=kind, nlist=6)
+    assert info["kind"] == kind and info["count"] == 60
+
+    idx = LocalVectorIndex(str(tmp_path), nprobe=6)  # nprobe = nlist：IVF 也是全看
+    try:
+        hits = idx.search_rows(vectors, top_k=3)
+        for i, row_hits in enumerate(hits):
+            assert row_hits[0]["title"] == rows[i]["title"]
+            assert row_hits[0]["url"] == rows[i]["url"]
+            assert row_hits[0]["content"] == rows[i]["content"]
+            assert row_hits[0]["score"] == pytest.approx(1.0, abs=1e-5)
+    finally:
+        idx.close()
+
+
+def test_resume_truncates_uncheckpointed_rows(tmp_path):
+    rows, vectors = _data(30)
+    writer = LocalIndexWriter(str(tmp_path), DIM)
+    writer.add(rows[:10], vectors[:10])
+    state = writer.state()
+    writer.add(rows[10:20], vectors[10:20])  # checkpoint 之前就掛了：這批要重寫
+    writer._close_parts()
+
+    resumed = LocalIndexWriter(str(tmp_path), DIM, resume_state=state)
+    assert resumed.gen == state["generation"] and resumed.count == 10
+    resumed.add(rows[10:], vectors[10:])
+    info = resumed.commit()
+    assert info["count"] == 30
+
+    idx = LocalVectorIndex(str(tmp_path))
+    try:
+        assert [idx.row(i)["title"] for i in range(len(idx))] == [r["title"] for r in rows]
+        assert [h[0][0] for h in idx.search(vectors, top_k=1)] == list(range(30))
+    finally:
+        idx.close()
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".part")]
+
+
+def test_commit_swaps_generation_and_cleans_old_files(tmp_path):
+    rows, vectors = _data(5)
+    first = write_local_index(str(tmp_path), rows, vectors)
+    old_reader = LocalVectorIndex(str(tmp_path))
+
+    # 上一次沒寫完的重建留下的 .part
+    stale = LocalIndexWriter(str(tmp_path), DIM)
+    stale.add(rows, vectors)
+    stale._close_parts()
+    second = write_local_index(str(tmp_path), rows[:2], vectors[:2])
+    assert second["generation"] != first["generation"]
+
+    names = os.listdir(tmp_path)
+    assert INDEX_FILE in names
+    assert all(second["generation"] in n for n in names if n != INDEX_FILE)
+    # 已經開著的舊一代照樣能查（mmap 還在）
+    assert old_reader.search(vectors[4], top_k=1)[0][0][0] == 4
+    old_reader.close()
+
+    new_reader = LocalVectorIndex(str(tmp_path))
+    assert len(new_reader) == 2
+    new_reader.close()
+
+
+def test_empty_index(tmp_path):
+    info = write_local_index(str(tmp_path), [], np.zeros((0, DIM), dtype=np.float32))
+    assert info["count"] == 0
+    idx = LocalVectorIndex(str(tmp_path))
+    assert idx.search(np.ones(DIM), top_k=5) == [[]]
+    idx.close()
+
+
+def test_missing_index_dir_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        LocalVectorIndex(str(tmp_path / "nope"))
@@ -0,0 +1,73 @@
+# test_micro_batcher.py
+# MicroBatcher：湊 batch 不超過上限、放不下的 request 留到下一輪（不拆開）、結果切回各自的 Future
+
+import threading
+
+import pytest
+import torch
+
+from micro_batcher import MicroBatcher
+
+
+def _rows(n, start):
+    return torch.arange(start, start + n, dtype=torch.float32).view(n, 1)
+
+
+def test_carry_over_keeps_requests_whole_and_in_order():
+    started, gate = threading.Event(), threading.Event()
+    sizes = []
+
+    def forward(x):
+        sizes.append(x.shape[0])
+        if len(sizes) == 1:
+            started.set()
+            gate.wait(5)  # 第一個 batch 卡住，讓後面的 request 都排進佇列
+        return x * 2
+
+    b = MicroBatcher(forward, max_batch_size=4, max_wait_ms=50)
+    blocker = b.submit(_rows(1, 100))
+    assert started.wait(5)
+
+    inputs = [_rows(2, 0), _rows(3, 10), _rows(1, 20), _rows(1, 30)]
+    futures = [b.submit(x) for x in inputs]
+    gate.set()
+
+    assert torch.equal(blocker.result(5), _rows(1, 100) * 2)
+    for x, fut in zip(inputs, futures):
+        assert torch.equal(fut.result(5), x * 2)
+    # 2 + 3 放不下 → 3 留到下一輪跟 1 湊成 4 → 剩下的 1 自己一個
+    assert sizes == [1, 2, 4, 1]
+
+    stats = b.get_stats()
+    assert stats["requests"] == 5 and stats["batches"] == 4
+    assert stats["batch_size_histogram"] == {"1": 2, "2": 1, "4": 1}
+
+
+def test_oversized_request_runs_alone():
+    sizes = []
+    b = MicroBatcher(lambda x: sizes.append(x.shape[0]) or x, max_batch_size=2, max_wait_ms=0)
+    out = b.infer(_rows(5, 0), timeout=5)
+    assert out.shape[0] == 5 and sizes == [5]
+
+
+def test_forward_error_reaches_every_request_in_batch():
+    started, gate = threading.Event(), threading.Event()
+    calls = []
+
+    def forward(x):
+        calls.append(x.shape[0])
+        if len(calls) == 1:
+            started.set()
+            gate.wait(5)
+            return x
+        raise RuntimeError("boom")
+
+    b = MicroBatcher(forward, max_batch_size=8, max_wait_ms=50)
+    b.submit(_rows(1, 0))
+    assert started.wait(5)
+    futures = [b.submit(_rows(1, i)) for i in range(3)]
+    gate.set()
+    for fut in futures:
+        with pytest.raises(RuntimeError):
+            fut.result(5)
+    assert calls == [1, 3]
@@ -0,0 +1,112 @@
+# test_rag_milvus.py
+# 檢索快取：同樣的 (query, top_k) 只查一次；RAG 版本變更時重新載入 collection 不能卡住其他查詢
+
+import sys
+import threading
+import types
+
+import pytest
+
+import rag_milvus
+
+
+@pytest.fixture
+def rag(monkeypatch):
+    version = {"v": "v1"}
+    monkeypatch.setattr(rag_milvus, "read_index_version", lambda: version["v"])
+    monkeypatch.setattr(rag_milvus, "_search", lambda q, k: [{"title": q, "content": "", "url": "", "score": 1.0}])
+    monkeypatch.setattr(rag_milvus, "_search_cache", rag_milvus.OrderedDict())
+    monkeypatch.setattr(rag_milvus, "_cache_version", "v1")
+    monkeypatch.setattr(rag_milvus, "collection", object())
+    return version
+
+
+def test_same_query_is_searched_once(rag, monkeypatch):
+    calls = []
+
+    def search(q, k):
+        calls.append((q, k))
+        return [{"title": q, "content": "", "url": "", "score": 1.0}]
+
+    monkeypatch.setattr(rag_milvus, "_search", search)
+    first = rag_milvus.search_knowledge("濕疹")
+    first[0]["title"] = "改掉"  # 拿到的是複本
+    assert rag_milvus.search_knowledge("濕疹")[0]["title"] == "濕疹"
+    rag_milvus.search_knowledge("濕疹", top_k=3)
+    assert calls == [("濕疹", 5), ("濕疹", 3)]
+
+
+def test_milvus_reload_does_not_block_other_lookups(rag, monkeypatch):
+    entered, release = threading.Event(), threading.Event()
+
+    class SlowCollection:
+        def __init__(self, name):
+            self.name = name
+
+        def load(self):
+            entered.set()
+            release.wait(5)
+
+    monkeypatch.setitem(sys.modules, "pymilvus", types.SimpleNamespace(Collection=SlowCollection))
+
+    rag["v"] = "v2"
+    reloader = threading.Thread(target=rag_milvus.search_knowledge, args=("濕疹",))
+    reloader.start()
+    assert entered.wait(5)
+
+    # collection.load() 還卡著，其他查詢照樣要馬上回來
+    done = []
+    other = threading.Thread(target=lambda: done.append(rag_milvus.search_knowledge("痤瘡")))
+    other.start()
+    other.join(2)
+    try:
+        assert done and done[0][0]["title"] == "痤瘡"
+    finally:
+        release.set()
+        reloader.join(5)
+    assert isinstance(rag_milvus.collection, SlowCollection)
+    assert rag_milvus.get_search_cache_stats()["version"] == "v2"
+
+
+def test_version_bump_clears_cache(rag):
+    rag_milvus.search_knowledge("濕疹")
+    rag_milvus.search_knowledge("濕疹")
+    assert len(rag_milvus._search_cache) == 1
+
+    rag_milvus.collection = None  # 還沒連過 Milvus：不用重新載入
+    rag["v"] = "v2"
+    rag_milvus.search_knowledge("痤瘡")
+    assert list(rag_milvus._search_cache) == [("痤瘡", 5)]
+
+
+def test_version_bump_during_label_index_load_forces_reload(rag, monkeypatch):
+    entered, release = threading.Event(), threading.Event()
+    loads = []
+
+    def slow_load(path):
+        loads.append(path)
+        if len(loads) == 1:
+            entered.set()
+            release.wait(5)
+        return None
+
+    monkeypatch.setattr(rag_milvus, "load_label_index", slow_load)
+    monkeypatch.setattr(rag_milvus, "_label_index_loaded", False)
+    monkeypatch.setattr(rag_milvus, "collection", None)
+
+    loader = threading.Thread(target=rag_milvus.get_label_index)
+    loader.start()
+    assert entered.wait(5)
+
+    # 舊的標籤索引讀到一半，RAG 版本換了
+    rag["v"] = "v2"
+    bump = threading.Thread(target=rag_milvus.search_knowledge, args=("濕疹",))
+    bump.start()
+    bump.join(0.2)
+    release.set()
+    loader.join(5)
+    bump.join(5)
+
+    # 讀到一半的是舊版，下一次一定要重讀
+    rag_milvus.get_label_index()
+    assert len(loads) == 2
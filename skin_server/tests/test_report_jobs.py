@@ -0,0 +1,166 @@
+# test_report_jobs.py
+# JobManager：同一張圖接到既有工作、排隊上限、TTL 過期、多個 worker 透過共用資料夾互看（負責的行程掛了要報錯）
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import report_jobs
+from llm_admission import QueueFullError
+
+
+class FakeStream:
+    """代替 predict_combined_stream：分類事件馬上給，其餘等 release() 才吐"""
+
+    def __init__(self):
+        self.gates = {}
+        self.calls = []
+
+    def gate(self, image):
+        return self.gates.setdefault(image, threading.Event())
+
+    def release(self, image):
+        self.gate(image).set()
+
+    def __call__(self, image, survey=None, tta=None):
+        self.calls.append(image)
+        gate = self.gate(image)
+        yield {"type": "classification", "top1": {"label": "濕疹", "confidence": 0.8},
+               "top3": [], "risk_flag": "低", "cached": False}
+        gate.wait(5)
+        if image.startswith(b"bad"):
+            yield {"type": "error", "message": "LLM 掛了"}
+        yield {"type": "think", "text": "先看顏色"}
+        yield {"type": "token", "text": "可能是濕疹。"}
+        yield {"type": "done", "report": "可能是濕疹。", "timings": {"llm": 1.0}, "prompt_tokens": 10}
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    fake = FakeStream()
+    monkeypatch.setattr(report_jobs, "predict_combined_stream", fake)
+    monkeypatch.setattr(report_jobs, "result_cache_key", lambda image, tta=None: image.hex())
+    return fake
+
+
+def _wait_status(manager, job_id, status):
+    snap = manager.get(job_id, wait=0)
+    deadline = time.monotonic() + 5
+    while snap["status"] != status:
+        assert time.monotonic() < deadline, snap
+        snap = manager.get(job_id, since=snap["version"], wait=1)
+    return snap
+
+
+def test_retry_attaches_to_running_and_finished_job(stream):
+    m = report_jobs.JobManager(workers=1, max_pending=4, state_dir=None)
+    first, created = m.submit(b"img")
+    assert created and first["top1"]["label"] == "濕疹"
+
+    again, created = m.submit(b"img")
+    assert not created and again["id"] == first["id"]
+
+    stream.release(b"img")
+    done = _wait_status(m, first["id"], "done")
+    assert done["report"] == "可能是濕疹。" and done["think"] == "先看顏色"
+    assert m.submit(b"img")[0]["id"] == first["id"]
+    assert stream.calls == [b"img"]  # 只生成一次
+    assert m.stats()["attached"] == 2
+
+
+def test_failed_job_is_not_reused(stream):
+    m = report_jobs.JobManager(workers=1, max_pending=4, state_dir=None)
+    stream.release(b"bad")
+    failed, _ = m.submit(b"bad")
+    assert _wait_status(m, failed["id"], "error")["error"] == "LLM 掛了"
+    retry, created = m.submit(b"bad")
+    assert created and retry["id"] != failed["id"]
+
+
+def test_long_poll_returns_on_next_event(stream):
+    m = report_jobs.JobManager(workers=1, max_pending=4, state_dir=None)
+    snap, _ = m.submit(b"img")
+    version = m.get(snap["id"])["version"]
+    threading.Timer(0.2, stream.release, args=(b"img",)).start()
+    t0 = time.monotonic()
+    newer = m.get(snap["id"], since=version, wait=5)
+    assert newer["version"] > version
+    assert time.monotonic() - t0 < 4
+
+
+def test_pending_limit_rejects_with_retry_hint(stream):
+    m = report_jobs.JobManager(workers=1, max_pending=1, state_dir=None)
+    first, _ = m.submit(b"one")
+    with pytest.raises(QueueFullError) as exc:
+        m.submit(b"two")
+    assert exc.value.retry_after > 0 and exc.value.queue_depth == 1
+    assert m.stats()["rejected"] == 1
+
+    stream.release(b"one")
+    _wait_status(m, first["id"], "done")
+    stream.release(b"two")
+    assert m.submit(b"two")[1]
+
+
+def test_finished_jobs_expire_after_ttl(stream, monkeypatch):
+    monkeypatch.setattr(report_jobs, "JOB_TTL", 0.2)
+    m = report_jobs.JobManager(workers=1, max_pending=4, state_dir=None)
+    stream.release(b"img")
+    snap, _ = m.submit(b"img")
+    done = _wait_status(m, snap["id"], "done")
+    assert done["expires_at"] is not None
+
+    time.sleep(0.3)
+    assert m.get(snap["id"]) is None
+    again, created = m.submit(b"img")
+    assert created and again["id"] != snap["id"]
+
+
+def test_other_worker_reads_shared_state(stream, tmp_path):
+    owner = report_jobs.JobManager(workers=1, max_pending=4, state_dir=str(tmp_path))
+    other = report_jobs.JobManager(workers=1, max_pending=4, state_dir=str(tmp_path))
+
+    snap, _ = owner.submit(b"img")
+    seen = other.get(snap["id"])
+    assert seen["id"] == snap["id"] and seen["top1"]["label"] == "濕疹"
+    # 同一張圖送到另一個 worker：接到同一個工作
+    attached, created = other.submit(b"img")
+    assert not created and attached["id"] == snap["id"]
+
+    stream.release(b"img")
+    _wait_status(owner, snap["id"], "done")
+    # 狀態檔在記憶體更新之後才寫：另一個 worker 要等到讀得到 done
+    assert _wait_status(other, snap["id"], "done")["report"] == "可能是濕疹。"
+
+
+def test_job_of_dead_worker_reports_error(stream, tmp_path):
+    owner = report_jobs.JobManager(workers=1, max_pending=4, state_dir=str(tmp_path))
+    other = report_jobs.JobManager(workers=1, max_pending=4, state_dir=str(tmp_path))
+    snap, _ = owner.submit(b"img")
+
+    # 把狀態檔的 pid 換成一個已經結束的行程（= 負責的 worker 掛了）
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    path = os.path.join(str(tmp_path), f"{snap['id']}.json")
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    state["pid"] = dead.pid
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+    seen = other.get(snap["id"])
+    assert seen["status"] == "error" and "行程已結束" in seen["error"]
+    # 掛掉的工作不拿來接：重送會新建
+    assert other.submit(b"img")[1]
+    stream.release(b"img")
+
+
+def test_unknown_job(stream, tmp_path):
+    m = report_jobs.JobManager(workers=1, max_pending=4, state_dir=str(tmp_path))
+    assert m.get("0" * 32) is None
+    assert m.get("../etc/passwd") is None
@@ -0,0 +1,70 @@
+# test_report_pipeline.py
+# start_report_pipeline：分類一出來就投機查 top-k 候選的 RAG，top-1 確定後取消其他候選、retrieve 接手 top-1 那一個
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import combined_inference as ci
+
+LESION = {
+    "top1": {"label": "濕疹", "confidence": 0.7},
+    "top3": [{"label": "濕疹", "confidence": 0.7},
+             {"label": "乾癬", "confidence": 0.2},
+             {"label": "痤瘡", "confidence": 0.1}],
+}
+
+
+@pytest.fixture
+def fake_stages(monkeypatch):
+    calls = []
+    lock = threading.Lock()
+
+    def retrieve(label):
+        with lock:
+            calls.append(label)
+        return [{"title": label, "url": "", "content": f"{label}是一種皮膚病。", "score": 0.9}]
+
+    monkeypatch.setattr(ci, "predict_lesion", lambda image, tta=None: LESION)
+    monkeypatch.setattr(ci, "_retrieve", retrieve)
+    monkeypatch.setattr(ci, "SPECULATIVE_TOPK", 3)
+    return calls
+
+
+def _run(monkeypatch, workers):
+    pool = ThreadPoolExecutor(max_workers=workers)
+    monkeypatch.setattr(ci, "_stage_pool", pool)
+    try:
+        pipe = ci.start_report_pipeline(b"img")
+        return pipe, ci.report_context(pipe)
+    finally:
+        pool.shutdown(wait=True)
+
+
+def test_busy_pool_cancels_losing_candidates(fake_stages, monkeypatch):
+    # 只有一個 worker：top1 排在候選前面，輪到它時其他候選都還在排隊
+    pipe, ctx = _run(monkeypatch, workers=1)
+    assert ctx["label"] == "濕疹"
+    assert [h["title"] for h in ctx["rag"]] == ["濕疹"]
+    assert fake_stages == ["濕疹"]  # 沒中的候選沒有真的查
+
+    timings = pipe.report()
+    assert timings["speculative_retrieve[2]"] == 0.0
+    assert timings["speculative_retrieve[3]"] == 0.0
+    assert "speculative_retrieve[1]" in timings and "retrieve" in timings
+
+
+def test_retrieve_reuses_running_candidate(fake_stages, monkeypatch):
+    pipe, ctx = _run(monkeypatch, workers=8)
+    assert [h["title"] for h in ctx["rag"]] == ["濕疹"]
+    # top-1 只查一次（不是候選查一次、retrieve 又查一次）
+    assert fake_stages.count("濕疹") == 1
+    assert set(fake_stages) <= {"濕疹", "乾癬", "痤瘡"}
+
+
+def test_speculation_can_be_turned_off(fake_stages, monkeypatch):
+    monkeypatch.setattr(ci, "SPECULATIVE_TOPK", 0)
+    pipe, ctx = _run(monkeypatch, workers=2)
+    assert fake_stages == ["濕疹"]
+    assert not [n for n in pipe.names() if n.startswith("speculative")]
@@ -0,0 +1,73 @@
+# test_result_cache.py
+# ResultCache：記憶體 LRU + TTL、磁碟層過期清除與檔數上限
+
+import os
+import time
+
+from result_cache import ResultCache, make_cache_key
+
+
+def _disk_files(root):
+    return sorted(n for _, _, names in os.walk(root) for n in names if n.endswith(".json"))
+
+
+def test_memory_lru_and_copy():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", {"x": [1]})
+    cache.put("b", {"x": [2]})
+    cache.get("a")["x"].append(99)  # 拿到的是複本
+    cache.put("c", {"x": [3]})      # 擠掉最久沒用的 b
+    assert cache.get("a") == {"x": [1]}
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    key = make_cache_key(b"img", "model", "v1")
+    ResultCache(disk_dir=str(tmp_path)).put(key, {"report": "ok"})
+    fresh = ResultCache(disk_dir=str(tmp_path))
+    assert fresh.get(key) == {"report": "ok"}
+    assert fresh.stats()["hits_disk"] == 1
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = ResultCache(ttl_seconds=0.05, disk_dir=str(tmp_path))
+    key = make_cache_key(b"img")
+    cache.put(key, {"report": "ok"})
+    time.sleep(0.1)
+    assert cache.get(key) is None
+    assert ResultCache(ttl_seconds=0.05, disk_dir=str(tmp_path)).get(key) is None
+
+
+def test_sweep_removes_expired_files_that_are_never_read(tmp_path):
+    cache = ResultCache(ttl_seconds=60, disk_dir=str(tmp_path))
+    old = [make_cache_key(b"old", str(i)) for i in range(3)]
+    for k in old:
+        cache.put(k, {"i": k})
+    past = time.time() - 3600
+    for root, _, names in os.walk(tmp_path):
+        for n in names:
+            os.utime(os.path.join(root, n), (past, past))
+
+    new_key = make_cache_key(b"new")
+    cache.put(new_key, {"i": "new"})
+    cache.sweep_disk()
+    assert _disk_files(tmp_path) == [f"{new_key}.json"]
+    assert cache.stats()["disk_files"] == 1
+
+
+def test_put_caps_disk_files(tmp_path):
+    cache = ResultCache(max_entries=1, disk_dir=str(tmp_path), disk_max_files=10,
+                        disk_sweep_seconds=3600)
+    keys = [make_cache_key(str(i).encode()) for i in range(40)]
+    for i, k in enumerate(keys):
+        cache.put(k, {"i": i})
+        # mtime 決定誰最舊，檔案系統的時間解析度可能不夠，手動拉開
+        t = time.time() - 1000 + i
+        os.utime(cache._disk_path(k), (t, t))
+        assert len(_disk_files(tmp_path)) <= 10
+
+    # 留下的是最新寫的那幾筆
+    assert f"{keys[-1]}.json" in _disk_files(tmp_path)
+    assert f"{keys[0]}.json" not in _disk_files(tmp_path)
+    assert cache.stats()["disk_evictions"] > 0
@@ -0,0 +1,93 @@
+# test_serve.py
+# prefork master：worker 意外結束會補一個，新的 worker 接得到同一個 port 的連線
+# worker 換成小小的 socket 伺服器（回自己的 pid），不用載模型 / app
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="prefork 只在 POSIX 上跑")
+
+SKIN_SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MASTER = textwrap.dedent("""
+    import os, signal, socket, sys, types
+    import serve
+
+    pid_dir = sys.argv[1]
+
+    def fake_worker(idx, fd, ready_w, args):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        path = os.path.join(pid_dir, str(os.getpid()))
+        with open(path + ".tmp", "w") as f:
+            f.write(str(idx))
+        os.replace(path + ".tmp", path)  # 測試端看到檔案時編號已經寫好
+        os.write(ready_w, b"1")
+        os.close(ready_w)
+        sock = socket.socket(fileno=os.dup(fd))
+        while True:
+            conn, _ = sock.accept()
+            conn.sendall(str(os.getpid()).encode())
+            conn.close()
+
+    serve.worker_main = fake_worker
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(16)
+    sock.set_inheritable(True)
+    print(sock.getsockname()[1], flush=True)
+    args = types.SimpleNamespace(workers=2, graceful_timeout=2.0, ready_timeout=5.0, host="127.0.0.1",
+                                 port=sock.getsockname()[1])
+    serve.Master(args, sock).run()
+""")
+
+
+def _ask(port):
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as conn:
+        return int(conn.recv(32))
+
+
+def _wait_pids(pid_dir, n, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        pids = sorted(int(p) for p in os.listdir(pid_dir) if not p.endswith(".tmp"))
+        if len(pids) >= n:
+            return pids
+        time.sleep(0.1)
+    raise AssertionError(f"只看到 {os.listdir(pid_dir)}")
+
+
+def test_master_respawns_killed_worker(tmp_path):
+    pid_dir = tmp_path / "pids"
+    pid_dir.mkdir()
+    master = subprocess.Popen([sys.executable, "-c", MASTER, str(pid_dir)], cwd=SKIN_SERVER,
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(master.stdout.readline())
+        first = _wait_pids(str(pid_dir), 2)
+        assert _ask(port) in first
+
+        victim = first[0]
+        os.kill(victim, signal.SIGKILL)
+        pids = _wait_pids(str(pid_dir), 3)
+        (new,) = set(pids) - set(first)
+        # 補上來的 worker 沿用被殺掉那個的編號
+        assert (pid_dir / str(new)).read_text() == (pid_dir / str(victim)).read_text()
+
+        alive = {first[1], new}
+        for _ in range(10):
+            assert _ask(port) in alive
+    finally:
+        master.send_signal(signal.SIGTERM)
+        try:
+            assert master.wait(timeout=15) == 0
+        finally:
+            if master.poll() is None:
+                master.kill()
+            master.stdout.close()
@@ -0,0 +1,71 @@
+# test_stage_pipeline.py
+# StagePipeline：相依順序、失敗往下傳、結果拿到時耗時已經記好
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from stage_pipeline import StagePipeline
+
+
+@pytest.fixture
+def pool():
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        yield ex
+
+
+def test_deps_receive_results_in_order(pool):
+    p = StagePipeline(pool)
+    p.add("a", lambda: 2)
+    p.add("b", lambda: 3)
+    p.add("c", lambda a, b: a * 10 + b, deps=["a", "b"])
+    assert p.result("c", timeout=5) == 23
+
+
+def test_failure_propagates_to_dependents(pool):
+    p = StagePipeline(pool)
+
+    def boom():
+        raise KeyError("x")
+
+    p.add("a", boom)
+    p.add("b", lambda a: a, deps=["a"])
+    with pytest.raises(KeyError):
+        p.result("b", timeout=5)
+
+
+def test_timing_recorded_before_result_is_visible(pool):
+    # 結果一拿到，report() 裡就要有這個 stage（以前 finally 才記，會漏最後一個）
+    for _ in range(200):
+        p = StagePipeline(pool)
+        p.add("a", lambda: 1)
+        p.add("last", lambda a: a, deps=["a"])
+        p.result("last", timeout=5)
+        assert "last" in p.report()
+
+    p = StagePipeline(pool)
+    p.add("bad", lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        p.result("bad", timeout=5)
+    assert "bad" in p.report()
+
+
+def test_cancel_only_pending_stage_and_records_zero():
+    started, gate = threading.Event(), threading.Event()
+
+    def busy():
+        started.set()
+        return gate.wait(5)
+
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        p = StagePipeline(ex)
+        p.add("busy", busy)
+        p.add("queued", lambda: 1)
+        assert started.wait(5)
+        assert p.cancel("queued")        # 唯一的 worker 還在忙，排隊中的取消得掉
+        assert not p.cancel("busy")      # 已經在跑的不行
+        assert not p.cancel("nope")
+        gate.set()
+        assert p.result("busy", timeout=5) is True
+    assert p.report()["queued"] == 0.0
@@ -0,0 +1,56 @@
+# test_think_splitter.py
+# ThinkSplitter：<think> / </think> 被切在 chunk 中間也要分對，不能把標籤的一部分吐出去
+
+import pytest
+
+from combined_inference import ThinkSplitter
+
+REPLY = "<think>先看病灶顏色 <與邊界></think>濕疹的可能性較高，<建議>保濕。"
+EXPECTED = {"think": "先看病灶顏色 <與邊界>", "token": "濕疹的可能性較高，<建議>保濕。"}
+
+
+def _run(chunks):
+    splitter = ThinkSplitter()
+    events = []
+    for c in chunks:
+        events += splitter.feed(c)
+    events += splitter.flush()
+    return events
+
+
+def _joined(events):
+    out = {"think": "", "token": ""}
+    for kind, text in events:
+        out[kind] += text
+    return out
+
+
+def test_whole_reply_in_one_chunk():
+    assert _joined(_run([REPLY])) == EXPECTED
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7])
+def test_tags_split_across_chunks(size):
+    chunks = [REPLY[i:i + size] for i in range(0, len(REPLY), size)]
+    events = _run(chunks)
+    assert _joined(events) == EXPECTED
+    assert all("<think" not in t and "</think" not in t for _, t in events)
+
+
+@pytest.mark.parametrize("cut", range(1, len(REPLY)))
+def test_every_two_chunk_cut(cut):
+    assert _joined(_run([REPLY[:cut], REPLY[cut:]])) == EXPECTED
+
+
+def test_partial_tag_is_held_back_until_resolved():
+    splitter = ThinkSplitter()
+    assert splitter.feed("答案<thi") == [("token", "答案")]
+    assert splitter.feed("s is not a tag") == [("token", "<this is not a tag")]
+
+
+def test_unclosed_think_is_flushed_as_think():
+    assert _run(["<think>還在想", "</thi"]) == [("think", "還在想"), ("think", "</thi")]
+
+
+def test_reply_without_think():
+    assert _run(["純文字", "回覆"]) == [("token", "純文字"), ("token", "回覆")]